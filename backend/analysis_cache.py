@@ -0,0 +1,340 @@
+"""
+Result cache for /analyze
+Repeat scans of the same product skip the vision model. Entries are keyed on the
+exact SHA-256 of the image and also matched by perceptual hash (dHash) within a
+configurable Hamming distance, so a re-shot of the same item still hits.
+
+The in-process tier is always used; ANALYSIS_CACHE_SHARED=sqlite|mysql adds a
+shared tier so several API processes reuse each other's results.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from mysql.connector import Error
+from dotenv import load_dotenv
+from caching import TTLLRUCache
+from database import get_database_connection, DHASH_BANDS
+from image_processing import hamming_distance
+from structured_log import get_logger
+
+# Load environment variables
+load_dotenv()
+
+log = get_logger('analysis_cache')
+
+ANALYSIS_CACHE_ENABLED = os.getenv('ANALYSIS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', 3600))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 1024))
+ANALYSIS_CACHE_HAMMING_THRESHOLD = int(os.getenv('ANALYSIS_CACHE_HAMMING_THRESHOLD', 6))
+ANALYSIS_CACHE_SHARED = os.getenv('ANALYSIS_CACHE_SHARED', 'none').lower()
+ANALYSIS_CACHE_SHARED_MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_SHARED_MAX_ENTRIES', 50000))
+ANALYSIS_CACHE_SQLITE_PATH = os.getenv(
+    'ANALYSIS_CACHE_SQLITE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analysis_cache.sqlite3')
+)
+
+# Prune the shared tier every this many stores
+_PRUNE_EVERY = 100
+
+def _to_signed64(value):
+    """SQLite and MySQL BIGINT are signed; store dHash bits as a signed 64-bit int"""
+    return value - (1 << 64) if value is not None and value >= (1 << 63) else value
+
+def _to_unsigned64(value):
+    return value + (1 << 64) if value is not None and value < 0 else value
+
+def _dhash_bands(dhash):
+    """The DHASH_BANDS 8-bit bands of a dHash, lowest byte first"""
+    if dhash is None:
+        return (None,) * DHASH_BANDS
+    return tuple((_to_unsigned64(dhash) >> (8 * band)) & 255 for band in range(DHASH_BANDS))
+
+def _band_filter(dhash, threshold, placeholder):
+    """SQL condition (and its parameters) for rows that can be within threshold bits of dhash
+
+    Every match within DHASH_BANDS - 1 bits shares a band, so the band indexes
+    bound the scan; higher thresholds have to compare every row.
+    """
+    if threshold >= DHASH_BANDS:
+        return "dhash IS NOT NULL", ()
+    condition = ' OR '.join(f"dhash_band{band} = {placeholder}" for band in range(DHASH_BANDS))
+    return f"({condition})", _dhash_bands(dhash)
+
+class SQLiteCacheTier:
+    """Shared cache tier in a local SQLite file (shared by processes on one host)"""
+
+    def __init__(self, path=ANALYSIS_CACHE_SQLITE_PATH, ttl=ANALYSIS_CACHE_TTL,
+                 max_entries=ANALYSIS_CACHE_SHARED_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                sha256 TEXT PRIMARY KEY,
+                dhash INTEGER,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit_at REAL NOT NULL
+            )
+            """
+        )
+        # Perceptual lookups only compare rows that share a dHash band
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(analysis_cache)")}
+        for band in range(DHASH_BANDS):
+            column = f"dhash_band{band}"
+            if column not in columns:
+                connection.execute(f"ALTER TABLE analysis_cache ADD COLUMN {column} INTEGER")
+                connection.execute(f"UPDATE analysis_cache SET {column} = (dhash >> {8 * band}) & 255")
+            connection.execute(f"CREATE INDEX IF NOT EXISTS idx_analysis_cache_{column} ON analysis_cache ({column})")
+        connection.commit()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.create_function('hamming', 2, lambda a, b: hamming_distance(_to_unsigned64(a), _to_unsigned64(b)))
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, image_hash, dhash, threshold):
+        connection = self._connection()
+        cutoff = time.time() - self.ttl
+        row = connection.execute(
+            "SELECT sha256, result, 0 FROM analysis_cache WHERE sha256 = ? AND created_at > ?",
+            (image_hash, cutoff)
+        ).fetchone()
+        if row is None and dhash is not None:
+            band_filter, bands = _band_filter(dhash, threshold, '?')
+            row = connection.execute(
+                f"""
+                SELECT sha256, result, distance FROM (
+                    SELECT sha256, result, hamming(dhash, ?) AS distance FROM analysis_cache
+                    WHERE {band_filter} AND created_at > ?
+                )
+                WHERE distance <= ? ORDER BY distance LIMIT 1
+                """,
+                (_to_signed64(dhash), *bands, cutoff, threshold)
+            ).fetchone()
+        if row is None:
+            return None
+
+        connection.execute("UPDATE analysis_cache SET last_hit_at = ? WHERE sha256 = ?", (time.time(), row[0]))
+        connection.commit()
+        return json.loads(row[1]), row[2]
+
+    def store(self, image_hash, dhash, result):
+        connection = self._connection()
+        now = time.time()
+        band_columns = ''.join(f", dhash_band{band}" for band in range(DHASH_BANDS))
+        connection.execute(
+            f"""
+            INSERT OR REPLACE INTO analysis_cache (sha256, dhash, result, created_at, last_hit_at{band_columns})
+            VALUES (?, ?, ?, ?, ?{', ?' * DHASH_BANDS})
+            """,
+            (image_hash, _to_signed64(dhash), json.dumps(result), now, now, *_dhash_bands(dhash))
+        )
+        connection.commit()
+
+    def prune(self):
+        connection = self._connection()
+        connection.execute("DELETE FROM analysis_cache WHERE created_at <= ?", (time.time() - self.ttl,))
+        connection.execute(
+            """
+            DELETE FROM analysis_cache WHERE sha256 IN (
+                SELECT sha256 FROM analysis_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,)
+        )
+        connection.commit()
+
+class MySQLCacheTier:
+    """Shared cache tier in the analysis_cache MySQL table (shared across hosts)"""
+
+    def __init__(self, ttl=ANALYSIS_CACHE_TTL, max_entries=ANALYSIS_CACHE_SHARED_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _run(self, callback):
+        connection = get_database_connection()
+        if not connection:
+            raise Error(msg="No database connection for analysis cache")
+
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            return callback(cursor, connection)
+        finally:
+            if cursor:
+                cursor.close()
+            connection.close()
+
+    def lookup(self, image_hash, dhash, threshold):
+        """Exact match, else the nearest dHash among rows sharing one of its bands"""
+        def query(cursor, connection):
+            cursor.execute(
+                """
+                SELECT sha256, result, 0 FROM analysis_cache
+                WHERE sha256 = %s AND created_at > NOW() - INTERVAL %s SECOND
+                """,
+                (image_hash, self.ttl)
+            )
+            row = cursor.fetchone()
+            if row is None and dhash is not None:
+                band_filter, bands = _band_filter(dhash, threshold, '%s')
+                cursor.execute(
+                    f"""
+                    SELECT sha256, result, BIT_COUNT(dhash ^ %s) AS distance FROM analysis_cache
+                    WHERE {band_filter} AND created_at > NOW() - INTERVAL %s SECOND
+                      AND BIT_COUNT(dhash ^ %s) <= %s
+                    ORDER BY distance LIMIT 1
+                    """,
+                    (_to_signed64(dhash), *bands, self.ttl, _to_signed64(dhash), threshold)
+                )
+                row = cursor.fetchone()
+            if row is None:
+                return None
+
+            cursor.execute("UPDATE analysis_cache SET last_hit_at = NOW() WHERE sha256 = %s", (row[0],))
+            connection.commit()
+            return json.loads(row[1]), int(row[2])
+
+        return self._run(query)
+
+    def store(self, image_hash, dhash, result):
+        def insert(cursor, connection):
+            cursor.execute(
+                """
+                REPLACE INTO analysis_cache (sha256, dhash, result, created_at, last_hit_at)
+                VALUES (%s, %s, %s, NOW(), NOW())
+                """,
+                (image_hash, _to_signed64(dhash), json.dumps(result))
+            )
+            connection.commit()
+
+        self._run(insert)
+
+    def prune(self):
+        def delete(cursor, connection):
+            cursor.execute("DELETE FROM analysis_cache WHERE created_at <= NOW() - INTERVAL %s SECOND", (self.ttl,))
+            cursor.execute(
+                "SELECT last_hit_at FROM analysis_cache ORDER BY last_hit_at DESC LIMIT 1 OFFSET %s",
+                (self.max_entries,)
+            )
+            row = cursor.fetchone()
+            if row:
+                cursor.execute("DELETE FROM analysis_cache WHERE last_hit_at <= %s", (row[0],))
+            connection.commit()
+
+        self._run(delete)
+
+class AnalysisCache:
+    """Two-tier analysis cache: in-process LRU plus an optional shared tier"""
+
+    def __init__(self, ttl=ANALYSIS_CACHE_TTL, max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+                 threshold=ANALYSIS_CACHE_HAMMING_THRESHOLD, shared=ANALYSIS_CACHE_SHARED):
+        self.threshold = threshold
+        self._local = TTLLRUCache(max_entries=max_entries, ttl=ttl)
+        self._shared = None
+        self._stores = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'perceptual_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+        try:
+            if shared == 'sqlite':
+                self._shared = SQLiteCacheTier(ttl=ttl)
+            elif shared == 'mysql':
+                self._shared = MySQLCacheTier(ttl=ttl)
+        except Exception as e:
+            log.warning("Shared analysis cache unavailable, using in-process cache only", error=str(e))
+        if self._shared is not None and threshold >= DHASH_BANDS:
+            log.warning("Hamming threshold too high for the dHash band index; perceptual lookups scan the whole shared cache",
+                        threshold=threshold, indexed_up_to=DHASH_BANDS - 1)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def lookup(self, image_hash, dhash):
+        """Return (result, match) for a cached analysis, or (None, None)
+
+        match is 'exact' or 'perceptual'. dhash may be None, in which case
+        only exact matches are possible.
+        """
+        entry = self._local.get(image_hash)
+        if entry is not None:
+            self._count('exact_hits')
+            return dict(entry['result']), 'exact'
+
+        if dhash is not None:
+            best = None
+            for _, candidate in self._local.items():
+                if candidate['dhash'] is None:
+                    continue
+                distance = hamming_distance(dhash, candidate['dhash'])
+                if distance <= self.threshold and (best is None or distance < best[0]):
+                    best = (distance, candidate)
+            if best is not None:
+                self._count('perceptual_hits')
+                return dict(best[1]['result']), 'perceptual'
+
+        if self._shared is not None:
+            try:
+                found = self._shared.lookup(image_hash, dhash, self.threshold)
+            except Exception as e:
+                log.error("Error reading shared analysis cache", error=str(e))
+                found = None
+            if found is not None:
+                result, distance = found
+                self._local.set(image_hash, {'result': result, 'dhash': dhash})
+                self._count('shared_hits')
+                return dict(result), 'exact' if distance == 0 else 'perceptual'
+
+        self._count('misses')
+        return None, None
+
+    def store(self, image_hash, dhash, result):
+        """Cache a parsed analysis for this image"""
+        result = dict(result)
+        self._local.set(image_hash, {'result': result, 'dhash': dhash})
+
+        if self._shared is not None:
+            try:
+                self._shared.store(image_hash, dhash, result)
+                with self._stats_lock:
+                    self._stores += 1
+                    prune = self._stores % _PRUNE_EVERY == 0
+                if prune:
+                    self._shared.prune()
+            except Exception as e:
+                log.error("Error writing shared analysis cache", error=str(e))
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['local'] = self._local.stats()
+        stats['shared_backend'] = type(self._shared).__name__ if self._shared else None
+        stats['hamming_threshold'] = self.threshold
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_analysis_cache():
+    """Return the process-wide analysis cache, or None if disabled"""
+    global _cache
+    if not ANALYSIS_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnalysisCache()
+    return _cache
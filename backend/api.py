@@ -1,24 +1,137 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response, url_for, send_file, stream_with_context
 from flask_cors import CORS
 import base64
+import hashlib
 import os
 import tempfile
 import json
-from groq import Groq
 from dotenv import load_dotenv
 import subprocess
 import platform
-from database import create_tables, save_food_analysis, get_recent_analyses
+import threading
+import time
+import uuid
+import contextvars
+from functools import lru_cache
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from database import create_tables, queue_food_analysis, queue_food_analyses, get_recent_analyses, get_analysis_image, get_analysis_images, get_pool_stats, get_write_behind_stats, MAX_HISTORY_LIMIT
+from image_store import save_image, load_image, hash_image, guess_content_type, get_image_store
+from image_processing import (
+    create_thumbnail, compute_dhash, prefilter_image, preprocess_for_vision, submit_preprocess_for_vision, get_preprocess_stats,
+    PREFILTER_ENABLED, VISION_VARIANT
+)
+from analysis_cache import get_analysis_cache
+from caching import TTLLRUCache
+from audio_cache import get_audio_cache, audio_cache_key, AUDIO_CONTENT_TYPES
+from json_utils import StreamingJSONFieldParser, Schema, SchemaError, extract_json
+from metrics import (
+    stage, current_route, observe_request, record_upstream_error, record_parse_fallback, record_cache,
+    record_keyword_spotting, record_prefilter, record_token_usage, record_vision_route, start_token_usage, token_usage,
+    render_metrics
+)
+from keyword_spotting import keyword_spotting_available, spot_keywords
+from structured_log import get_logger
+from pipeline import (
+    Emit, FileResponse, GroqCall, GroqStream, NextChunk, Spawn, StreamedResponse, drive_pipeline, run_pipeline
+)
+from upstream import upstream_stats
+from groq_client import model_timeout, VISION_MODEL, VISION_FAST_MODEL, SCRIPT_MODEL, TTS_MODEL, TRANSCRIPTION_MODEL
 
 # Load environment variables
 load_dotenv()
 
+log = get_logger('api')
+
+# Uploads up to this size stay in memory; larger ones spill to a temporary file
+UPLOAD_SPOOL_MAX_BYTES = int(os.getenv('UPLOAD_SPOOL_MAX_BYTES', 8 * 1024 * 1024))
+
+class SpooledUploadRequest(Request):
+    """Request that buffers uploaded files in memory instead of always writing them to disk"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_BYTES, mode='rb+')
+
 app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend integration
+app.request_class = SpooledUploadRequest
+CORS(app, expose_headers=['X-Next-Cursor', 'Link', 'X-Cache', 'X-Audio-Id'])  # Enable CORS for frontend integration
+
+@app.before_request
+def start_request_timer():
+    """Label metrics and logs with the matched route, start the request timer and token count"""
+    request.environ['snackoverflow.started'] = time.perf_counter()
+    current_route.set(request.url_rule.rule if request.url_rule else 'unmatched')
+    start_token_usage()
+
+@app.after_request
+def record_request_latency(response):
+    started = request.environ.get('snackoverflow.started')
+    if started is not None:
+        observe_request(current_route.get(), request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+def submit_with_context(executor, fn, *args):
+    """Submit to an executor, carrying the current route label into the worker thread"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
 
 # Initialize database tables on startup
 create_tables()
 
+# Batch analysis settings
+ANALYZE_BATCH_CONCURRENCY = int(os.getenv('ANALYZE_BATCH_CONCURRENCY', 4))
+ANALYZE_BATCH_MAX_FILES = int(os.getenv('ANALYZE_BATCH_MAX_FILES', 50))
+
+# Shared by all batch requests so total upstream concurrency stays bounded
+batch_executor = ThreadPoolExecutor(max_workers=ANALYZE_BATCH_CONCURRENCY, thread_name_prefix='analyze-batch')
+
+# Background audio summaries for /analyze-with-audio
+AUDIO_SUMMARY_CONCURRENCY = int(os.getenv('AUDIO_SUMMARY_CONCURRENCY', 4))
+AUDIO_JOB_TTL = int(os.getenv('AUDIO_JOB_TTL', 600))
+# 'llm' writes the narration with the script model; 'template' skips that call
+AUDIO_SCRIPT_MODE = os.getenv('AUDIO_SCRIPT_MODE', 'llm').lower()
+
+audio_executor = ThreadPoolExecutor(max_workers=AUDIO_SUMMARY_CONCURRENCY, thread_name_prefix='audio-summary')
+audio_jobs = TTLLRUCache(max_entries=4096, ttl=AUDIO_JOB_TTL)
+
+# Recipe cache keyed on the canonical basket (names, freshness, shelf-life bucket)
+RECIPE_CACHE_ENABLED = os.getenv('RECIPE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RECIPE_CACHE_TTL = int(os.getenv('RECIPE_CACHE_TTL', 3600))
+RECIPE_CACHE_MAX_ENTRIES = int(os.getenv('RECIPE_CACHE_MAX_ENTRIES', 512))
+# Serve expired recipes instantly (for up to RECIPE_CACHE_STALE_TTL more seconds) and refresh them in the background
+RECIPE_CACHE_STALE_WHILE_REVALIDATE = os.getenv('RECIPE_CACHE_STALE_WHILE_REVALIDATE', 'false').lower() in ('1', 'true', 'yes')
+RECIPE_CACHE_STALE_TTL = int(os.getenv('RECIPE_CACHE_STALE_TTL', 86400))
+
+recipe_cache = TTLLRUCache(
+    max_entries=RECIPE_CACHE_MAX_ENTRIES,
+    ttl=RECIPE_CACHE_TTL + (RECIPE_CACHE_STALE_TTL if RECIPE_CACHE_STALE_WHILE_REVALIDATE else 0)
+)
+recipe_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='recipe-refresh')
+_recipe_refreshes = set()
+_recipe_refreshes_lock = threading.Lock()
+
+# Comparisons rank up to COMPARE_MAX_ITEMS images in one vision call; results are
+# cached by the set of image hashes, so the same pair in either order is a hit
+COMPARE_MAX_ITEMS = int(os.getenv('COMPARE_MAX_ITEMS', 5))
+COMPARE_CACHE_ENABLED = os.getenv('COMPARE_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+COMPARE_CACHE_TTL = int(os.getenv('COMPARE_CACHE_TTL', 86400))
+COMPARE_CACHE_MAX_ENTRIES = int(os.getenv('COMPARE_CACHE_MAX_ENTRIES', 1024))
+
+comparison_cache = TTLLRUCache(max_entries=COMPARE_CACHE_MAX_ENTRIES, ttl=COMPARE_CACHE_TTL)
+image_load_executor = ThreadPoolExecutor(max_workers=COMPARE_MAX_ITEMS, thread_name_prefix='image-load')
+
+# How analysis and recipe calls ask for JSON: 'schema' (structured output
+# against the response schema), 'object' (JSON mode, schema in the prompt)
+# or 'off' (prompt only)
+JSON_RESPONSE_MODE = os.getenv('JSON_RESPONSE_MODE', 'schema').lower()
+# max_tokens = estimated size of a complete response x this factor
+JSON_MAX_TOKENS_HEADROOM = float(os.getenv('JSON_MAX_TOKENS_HEADROOM', 1.25))
+
+# Image analysis routing: 'tiered' asks VISION_FAST_MODEL first and escalates to
+# VISION_MODEL when its reply is invalid or below the confidence threshold; 'off'
+# always uses VISION_MODEL. Streamed analyses always use VISION_MODEL.
+VISION_ROUTING = os.getenv('VISION_ROUTING', 'tiered').lower()
+VISION_ESCALATE_CONFIDENCE = float(os.getenv('VISION_ESCALATE_CONFIDENCE', 0.7))
+
 # Voice command mappings for accessibility
 VOICE_COMMANDS = {
     "analyze": ["analyze", "scan", "check food", "examine", "process image"],
@@ -31,91 +144,232 @@ VOICE_COMMANDS = {
     "repeat": ["repeat", "say again", "read again"]
 }
 
+# Phrases the local keyword spotter listens for
+VOICE_COMMAND_PHRASES = tuple(phrase for variations in VOICE_COMMANDS.values() for phrase in variations)
+
 def encode_image_to_base64(image_path):
     """Convert image file to base64 string"""
     try:
         with open(image_path, "rb") as image_file:
             return base64.b64encode(image_file.read()).decode('utf-8')
     except Exception as e:
-        print(f"Error reading image: {e}")
+        log.error("Error reading image", error=str(e))
         return None
 
+ANALYSIS_SCHEMA = Schema({
+    "fruit_name": ('str', None, {"max_tokens": 6}),
+    "freshness_level": ('int', 0, {"minimum": 1, "maximum": 10}),
+    "freshness_state": ('str', "Unable to assess", {"enum": ["Fresh", "Ripe", "Overripe", "Spoiled"]}),
+    "visual_indicators": ('str', "", {"description": "color, texture, blemishes", "max_tokens": 24}),
+    "should_buy": ('bool', False),
+    "best_use": ('str', "Unable to determine", {"enum": ["Eat now", "Wait a few days", "Use for cooking", "Avoid"]}),
+    "shelf_life_days": ('int', 0),
+    "calories": ('int', 0),
+    "nutrition_highlights": ('str', "", {"description": "key vitamins and minerals"}),
+    "health_benefits": ('str', ""),
+    "purchase_recommendation": ('str', "", {"description": "Buy/Skip with reason", "max_tokens": 20}),
+    "storage_method": ('str', ""),
+    "food_pun": ('str', None, {"description": "pun on the food name if should_buy, else null"}),
+    "confidence": ('number', 0, {"description": "0-1, how sure you are of the food and its freshness", "max_tokens": 3}),
+}, required=("fruit_name",))
+
+# A reply cut off early is only used if it got as far as these; missing ones would silently become defaults
+REPAIRED_ANALYSIS_SCHEMA = Schema(
+    ANALYSIS_SCHEMA.fields,
+    required=("fruit_name", "freshness_level", "should_buy", "shelf_life_days", "calories")
+)
+
+ANALYSIS_INSTRUCTIONS = "You assess food photos for a grocery shopping assistant. Describe the food in the image."
+
+# Returned (with the raw response) when no analysis can be recovered
+NO_FOOD_ANALYSIS = {
+    "fruit_name": "No food detected",
+    "freshness_level": 0,
+    "freshness_state": "Unable to assess",
+    "visual_indicators": "No clear food item identified in the image",
+    "should_buy": False,
+    "best_use": "Unable to determine",
+    "shelf_life_days": 0,
+    "calories": 0,
+    "nutrition_highlights": "No nutritional information available",
+    "health_benefits": "No food item identified",
+    "purchase_recommendation": "No food detected - please try with a clearer image",
+    "storage_method": "Not applicable",
+    "food_pun": None,
+    "confidence": 0,
+}
+
+def encode_image_for_vision(image_bytes):
+    """Downscale and re-encode an image for the vision model; returns (base64_image, content_type)"""
+    with stage('preprocess'):
+        processed_bytes, content_type = preprocess_for_vision(image_bytes)
+    with stage('base64_encode'):
+        return base64.b64encode(processed_bytes).decode('utf-8'), content_type
+
+@lru_cache(maxsize=None)
+def json_output_settings(name, stream=False):
+    """(system prompt, response_format, max_tokens) for a JSON-producing call, built once per kind
+    
+    The system prompt is identical for every call of a kind so the provider
+    can reuse the cached prefix. Streaming calls can't use JSON mode, so they
+    carry the schema in the prompt instead.
+    """
+    schema, instructions = JSON_OUTPUTS[name]
+    mode = 'off' if stream else JSON_RESPONSE_MODE
+    max_tokens = int(schema.token_budget() * JSON_MAX_TOKENS_HEADROOM)
+    
+    if mode == 'schema':
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": name, "schema": schema.json_schema()}
+        }
+        return f"{instructions} Reply with the JSON object only.", response_format, max_tokens
+    
+    schema_text = json.dumps(schema.json_schema(), separators=(',', ':'))
+    system_prompt = f"{instructions} Reply with one JSON object only, matching this JSON Schema: {schema_text}"
+    response_format = {"type": "json_object"} if mode == 'object' else None
+    return system_prompt, response_format, max_tokens
+
+def json_output_request(name, user_content, model, temperature, stream=False):
+    """Chat completion arguments for a call whose reply is a JSON object of kind `name`"""
+    system_prompt, response_format, max_tokens = json_output_settings(name, stream)
+    request_args = {
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ],
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "timeout": model_timeout(model),
+    }
+    if response_format:
+        request_args["response_format"] = response_format
+    if stream:
+        request_args["stream"] = True
+    return request_args
+
+def build_analysis_request(base64_image, content_type='image/jpeg', stream=False, model=VISION_MODEL):
+    """Chat completion arguments for the vision analysis of one image"""
+    return json_output_request(
+        'food_analysis',
+        [
+            {
+                "type": "text",
+                "text": "Analyze this food."
+            },
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:{content_type};base64,{base64_image}"
+                }
+            }
+        ],
+        model,
+        temperature=0.1,
+        stream=stream
+    )
+
 def analyze_nutrition_with_groq(image_path, groq_api_key):
     """Analyze image for nutritional information using Groq"""
     
-    # Initialize Groq client
-    client = Groq(api_key=groq_api_key)
-    
-    # Convert image to base64
-    base64_image = encode_image_to_base64(image_path)
-    if not base64_image:
+    try:
+        with open(image_path, "rb") as image_file:
+            image_bytes = image_file.read()
+    except Exception as e:
+        log.error("Error reading image", error=str(e))
         return None
     
+    # Downscale and convert image to base64
+    base64_image, content_type = encode_image_for_vision(image_bytes)
+    return analyze_base64_image_with_groq(base64_image, groq_api_key, content_type)
+
+def vision_tiers():
+    """Vision models to try for an analysis, cheapest first"""
+    if VISION_ROUTING == 'tiered' and VISION_FAST_MODEL != VISION_MODEL:
+        return (VISION_FAST_MODEL, VISION_MODEL)
+    return (VISION_MODEL,)
+
+def escalation_reason(result):
+    """Check a lower-tier reply: returns (reason, analysis)
+    
+    reason says why the next model should redo it ('error', 'invalid',
+    'low_confidence') or is None to accept it; analysis is the validated
+    analysis, or None if the reply didn't parse.
+    """
+    if not result:
+        return 'error', None
     try:
-        # Create chat completion with vision
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Analyze this food image and provide a JSON response with the following structure:
-
-{
-  "fruit_name": "Name of the food item",
-  "freshness_level": 8,
-  "freshness_state": "Fresh/Ripe/Overripe/Spoiled",
-  "visual_indicators": "Description of color, texture, blemishes",
-  "should_buy": true,
-  "best_use": "Eat now/Wait a few days/Use for cooking/Avoid",
-  "shelf_life_days": 3,
-  "calories": 105,
-  "nutrition_highlights": "Key vitamins and minerals",
-  "health_benefits": "Notable health benefits",
-  "purchase_recommendation": "Buy/Skip with reasoning",
-  "storage_method": "Best storage method after purchase",
-  "food_pun": "A clever pun using the food name (only if should_buy is true, otherwise null)"
-}
+        parsed, how = extract_json(result)
+        analysis = ANALYSIS_SCHEMA.validate(parsed)
+    except (json.JSONDecodeError, SchemaError):
+        return 'invalid', None
+    if how == 'repaired':
+        return 'invalid', None
+    if analysis['confidence'] < VISION_ESCALATE_CONFIDENCE:
+        return 'low_confidence', analysis
+    return None, analysis
 
-IMPORTANT: 
-- Respond ONLY with valid JSON. Do not include any text before or after the JSON object.
-- If should_buy is true, include a clever pun using the food name in the food_pun field.
-- If should_buy is false, set food_pun to null.
-- Make the puns fun and food-related!"""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            model="meta-llama/llama-4-maverick-17b-128e-instruct",
-            temperature=0.1,
-            max_tokens=1000,
-        )
-        
+def request_vision_analysis(model, base64_image, content_type):
+    """Pipeline: one vision analysis call; returns the reply text, or None if the call failed"""
+    try:
+        with stage('vision', model):
+            chat_completion = yield GroqCall(model, 'chat.completions.create', build_analysis_request(base64_image, content_type, model=model))
+        record_token_usage(model, chat_completion.usage)
         return chat_completion.choices[0].message.content
         
     except Exception as e:
-        print(f"Error with Groq API: {e}")
+        record_upstream_error(model, e)
+        log.error("Error with Groq API", model=model, error=str(e))
         return None
 
-def create_natural_audio_script(fruit_name, nutrition_info, should_buy, groq_api_key):
-    """Use Groq to create a natural, conversational audio script"""
+def route_vision_analysis(base64_image, content_type='image/jpeg'):
+    """Pipeline: analyze an image with the cheapest vision tier that gives a confident, valid answer
     
-    client = Groq(api_key=groq_api_key)
+    Returns (response_text, model, analysis); response_text is None if every
+    tier failed. analysis is the reply already parsed while routing, or None
+    if it still needs parsing (see finish_analysis).
+    """
+    *lower_tiers, top_tier = vision_tiers()
+    for model in lower_tiers:
+        result = yield from request_vision_analysis(model, base64_image, content_type)
+        reason, analysis = escalation_reason(result)
+        record_vision_route(model, reason or 'accepted')
+        if reason is None:
+            return result, model, analysis
+        log.info("Escalating analysis", model=model, reason=reason, to_model=top_tier)
     
-    try:
-        # Use Groq to restructure the information into a natural sentence
-        response = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""Convert this produce analysis into a single, natural-sounding sentence for audio narration:
+    result = yield from request_vision_analysis(top_tier, base64_image, content_type)
+    record_vision_route(top_tier, 'accepted' if result else 'error')
+    return result, top_tier, None
+
+def prefilter_result(reason):
+    """Count a pre-filter decision; returns the 'No food detected' analysis for a rejected image, else None"""
+    record_prefilter(reason or 'passed')
+    if reason is None:
+        return None
+    log.info("Image rejected by pre-filter", reason=reason)
+    return {**NO_FOOD_ANALYSIS, "prefilter": reason}
+
+def prefilter_analysis(image_bytes):
+    """Run the local pre-filter before any model call; see prefilter_result"""
+    if not PREFILTER_ENABLED:
+        return None
+    with stage('prefilter'):
+        reason = prefilter_image(image_bytes)
+    return prefilter_result(reason)
+
+def analyze_base64_image_with_groq(base64_image, groq_api_key, content_type='image/jpeg'):
+    """Analyze an already base64-encoded image using Groq"""
+    return run_pipeline(route_vision_analysis(base64_image, content_type), groq_api_key)[0]
+
+def build_audio_script_request(fruit_name, nutrition_info, should_buy):
+    """Chat completion arguments for turning an analysis into one spoken sentence"""
+    return {
+        "messages": [
+            {
+                "role": "user",
+                "content": f"""Convert this produce analysis into a single, natural-sounding sentence for audio narration:
 
 Fruit: {fruit_name}
 Nutrition: {nutrition_info}
@@ -126,647 +380,1295 @@ Create a conversational sentence that sounds like a helpful friend giving advice
 - "These bananas appear ripe and are great for potassium, so I'd recommend buying them for a healthy snack."
 
 Keep it under 25 words and make it sound natural for speech."""
-                }
-            ],
-            model="llama-3.1-8b-instant",
-            temperature=0.3,
-            max_tokens=100
-        )
-        
-        natural_script = response.choices[0].message.content.strip()
-        
-        # Clean up any extra quotes or formatting
-        natural_script = natural_script.replace('"', '').replace("'", "'").strip()
+            }
+        ],
+        "model": SCRIPT_MODEL,
+        "temperature": 0.3,
+        "max_tokens": 100,
+        "timeout": model_timeout(SCRIPT_MODEL),
+    }
+
+def clean_audio_script(script):
+    """Clean up any extra quotes or formatting in a generated script"""
+    return script.strip().replace('"', '').replace("'", "'").strip()
+
+def fallback_audio_script(fruit_name, nutrition_info, should_buy):
+    """Simple script used when the script model call fails"""
+    return f"This looks like {fruit_name}. {nutrition_info}. {should_buy}"
+
+def create_natural_audio_script(fruit_name, nutrition_info, should_buy):
+    """Pipeline: use Groq to create a natural, conversational audio script"""
+    
+    try:
+        # Use Groq to restructure the information into a natural sentence
+        with stage('audio_script', SCRIPT_MODEL):
+            response = yield GroqCall(
+                SCRIPT_MODEL, 'chat.completions.create',
+                build_audio_script_request(fruit_name, nutrition_info, should_buy)
+            )
         
-        return natural_script
+        record_token_usage(SCRIPT_MODEL, response.usage)
+        return clean_audio_script(response.choices[0].message.content)
         
     except Exception as e:
-        print(f"Error creating natural script: {e}")
+        record_upstream_error(SCRIPT_MODEL, e)
+        log.warning("Error creating natural script, using template", model=SCRIPT_MODEL, error=str(e))
         # Fallback to simple format
-        return f"This looks like {fruit_name}. {nutrition_info}. {should_buy}"
+        return fallback_audio_script(fruit_name, nutrition_info, should_buy)
+
+TTS_VOICE = "Celeste-PlayAI"
+TTS_FORMAT = "wav"
+# Formats PlayAI TTS can return; 'opus' is served as Ogg/Opus
+TTS_FORMATS = {'wav': 'wav', 'mp3': 'mp3', 'ogg': 'ogg', 'opus': 'ogg', 'flac': 'flac'}
+
+# Playing clips on the API host (macOS afplay) blocks the request for the whole clip
+SERVER_AUDIO_PLAYBACK = os.getenv('SERVER_AUDIO_PLAYBACK', 'false').lower() in ('1', 'true', 'yes')
+
+def resolve_speech_format(requested_format):
+    """Map a requested audio format to a TTS response_format, or None if unsupported"""
+    return TTS_FORMATS.get((requested_format or TTS_FORMAT).lower())
+
+def build_speech_request(text, response_format=TTS_FORMAT):
+    """Speech synthesis arguments for Groq PlayAI TTS"""
+    return {
+        "model": TTS_MODEL,
+        "voice": TTS_VOICE,
+        "input": text,
+        "response_format": response_format,
+        "timeout": model_timeout(TTS_MODEL),
+    }
 
-def create_audio_summary(fruit_name, nutrition_info, should_buy, groq_api_key):
-    """Generate audio summary using Groq PlayAI TTS"""
+def speech_cache_key(text, response_format=TTS_FORMAT):
+    """Audio cache key for text spoken with the configured voice"""
+    return audio_cache_key(text, TTS_VOICE, TTS_MODEL, response_format)
+
+def synthesize_speech(text, response_format=TTS_FORMAT):
+    """Pipeline: return (audio_hash, file_path, cache_status), calling the TTS model only on a cache miss"""
+    cache = get_audio_cache()
+    audio_hash = speech_cache_key(text, response_format)
     
-    # Create natural-sounding script using another API call
-    print("🤖 Creating natural audio script...")
-    summary_text = create_natural_audio_script(fruit_name, nutrition_info, should_buy, groq_api_key)
+    speech_file_path = cache.get(audio_hash, response_format)
+    if speech_file_path:
+        record_cache('audio', 'hit')
+        log.info("Audio cache hit", audio_id=audio_hash)
+        return audio_hash, speech_file_path, 'hit'
+    record_cache('audio', 'miss')
     
-    print(f"\n🔊 AUDIO SUMMARY:")
-    print(f"Text: {summary_text}")
+    try:
+        with stage('tts', TTS_MODEL):
+            audio_bytes = yield GroqCall(TTS_MODEL, 'audio.speech.create', build_speech_request(text, response_format), read=True)
+    except Exception as e:
+        record_upstream_error(TTS_MODEL, e)
+        raise
+    
+    with stage('audio_cache_write'):
+        speech_file_path = cache.put(audio_hash, response_format, audio_bytes)
     
-    # Initialize Groq client for TTS
-    client = Groq(api_key=groq_api_key)
+    log.info("Audio saved", audio_id=audio_hash, path=speech_file_path, bytes=len(audio_bytes))
+    return audio_hash, speech_file_path, 'miss'
+
+def stream_speech(text, response_format=TTS_FORMAT):
+    """Pipeline: emit synthesized audio chunks as they arrive from the TTS API, caching the full clip at the end"""
+    chunks = []
     
     try:
-        # Generate speech using Groq's PlayAI TTS
-        response = client.audio.speech.create(
-            model="playai-tts",
-            voice="Celeste-PlayAI",
-            input=summary_text,
-            response_format="wav"
-        )
-        
-        # Save audio file
-        speech_file_path = "produce_summary.wav"
-        response.write_to_file(speech_file_path)
-        
-        print(f"🎵 Audio saved as: {speech_file_path}")
-        
-        return speech_file_path
+        with stage('tts_stream', TTS_MODEL):
+            stream = yield GroqStream(
+                TTS_MODEL, 'audio.speech.with_streaming_response.create',
+                build_speech_request(text, response_format), binary=True
+            )
+            while True:
+                chunk = yield NextChunk(stream)
+                if chunk is None:
+                    break
+                chunks.append(chunk)
+                yield Emit(chunk)
+    except Exception as e:
+        record_upstream_error(TTS_MODEL, e)
+        raise
+    
+    try:
+        audio_hash = speech_cache_key(text, response_format)
+        speech_file_path = get_audio_cache().put(audio_hash, response_format, b''.join(chunks))
+        log.info("Audio saved", audio_id=audio_hash, path=speech_file_path)
+    except Exception as e:
+        log.error("Error caching streamed audio", error=str(e))
+
+def wants_audio_stream(req, data):
+    """Whether the client wants the audio itself (?stream=1, "stream": true or Accept: audio/*)"""
+    if req.args.get('stream', '').lower() in ('1', 'true', 'yes') or data.get('stream') is True:
+        return True
+    best = req.accept_mimetypes.best
+    return bool(best) and best.startswith('audio/')
+
+def audio_response_fields(audio_hash, speech_file_path, base_url):
+    """JSON fields pointing the client at a cached clip"""
+    return {
+        'audio_id': audio_hash,
+        'audio_url': f"{base_url.rstrip('/')}/audio/{audio_hash}",
+        'audio_file': speech_file_path,
+    }
+
+def log_tts_error(e):
+    """Log a TTS error with a hint when the PlayAI terms haven't been accepted"""
+    fields = {'model': TTS_MODEL, 'error': str(e)}
+    if "model_terms_required" in str(e):
+        fields['hint'] = "Please accept PlayAI TTS terms at: https://console.groq.com/playground?model=playai-tts"
+    log.error("TTS error", **fields)
+
+def play_audio_on_server(speech_file_path):
+    """Play an audio file on the server host (macOS only)"""
+    system = platform.system().lower()
+    
+    if system == "darwin":  # macOS
+        with stage('server_playback'):
+            subprocess.run(["afplay", speech_file_path], check=True)
+        log.info("Audio playback completed", path=speech_file_path)
+    else:
+        log.info("Server playback unsupported on this platform", path=speech_file_path)
+
+def create_audio_summary(fruit_name, nutrition_info, should_buy, script_mode='llm'):
+    """Pipeline: generate audio summary using Groq PlayAI TTS; returns (audio_hash, file_path) or None
+    
+    script_mode='template' skips the script model and speaks the fixed template.
+    """
+    
+    if script_mode == 'template':
+        summary_text = fallback_audio_script(fruit_name, nutrition_info, should_buy)
+    else:
+        # Create natural-sounding script using another API call
+        summary_text = yield from create_natural_audio_script(fruit_name, nutrition_info, should_buy)
+    
+    log.info("Audio summary script", script_mode=script_mode, text=summary_text)
+    
+    try:
+        # Generate speech using Groq's PlayAI TTS (or reuse the cached clip)
+        audio_hash, speech_file_path, _ = yield from synthesize_speech(summary_text)
+        return audio_hash, speech_file_path
         
     except Exception as e:
-        print(f"❌ TTS Error: {e}")
-        if "model_terms_required" in str(e):
-            print("   Please accept PlayAI TTS terms at: https://console.groq.com/playground?model=playai-tts")
+        log_tts_error(e)
         return None
 
+def resolve_audio_script_mode(requested_mode):
+    """Script mode for an audio summary: 'template' or 'llm', defaulting to AUDIO_SCRIPT_MODE"""
+    mode = (requested_mode or AUDIO_SCRIPT_MODE).lower()
+    return mode if mode in ('llm', 'template') else AUDIO_SCRIPT_MODE
+
+def audio_summary_inputs(parsed_result):
+    """(fruit_name, nutrition_info, should_buy) for the spoken summary of an analysis"""
+    return (
+        parsed_result.get('fruit_name', 'Food Item'),
+        parsed_result.get('nutrition_highlights', 'Good source of nutrients'),
+        parsed_result.get('purchase_recommendation', 'Analysis provided'),
+    )
+
+def create_audio_job():
+    """Register a pending audio summary and return its id"""
+    job_id = uuid.uuid4().hex
+    audio_jobs.set(job_id, {'status': 'pending'})
+    return job_id
+
+def finish_audio_job(job_id, audio):
+    """Record the outcome of create_audio_summary for a job"""
+    if audio:
+        audio_hash, speech_file_path = audio
+        audio_jobs.set(job_id, {'status': 'ready', 'audio_id': audio_hash, 'audio_file': speech_file_path})
+    else:
+        audio_jobs.set(job_id, {'status': 'failed'})
+
+def run_audio_job(job_id, fruit_name, nutrition_info, should_buy, script_mode):
+    """Pipeline: produce an audio summary in the background"""
+    try:
+        audio = yield from create_audio_summary(fruit_name, nutrition_info, should_buy, script_mode)
+    except Exception:
+        log.exception("Error creating audio summary", job_id=job_id)
+        audio = None
+    finish_audio_job(job_id, audio)
+
+def audio_job_fields(job_id, base_url):
+    """JSON fields pointing the client at a pending audio summary"""
+    return {
+        'audio_job': {
+            'id': job_id,
+            'status': 'pending',
+            'status_url': f"{base_url.rstrip('/')}/audio-jobs/{job_id}",
+        }
+    }
+
 def parse_groq_response(response_text):
-    """Parse the Groq response and extract JSON or create structured data"""
+    """Parse the Groq response into an analysis, or a 'No food detected' result with the raw text
+    
+    Analyses recovered from truncated or malformed JSON are marked
+    'repaired' and must include the REPAIRED_ANALYSIS_SCHEMA core fields.
+    """
     try:
-        # Try to find JSON in the response
-        response_text = response_text.strip()
-        
-        # If it starts and ends with curly braces, try to parse as JSON
-        if response_text.startswith('{') and response_text.endswith('}'):
-            return json.loads(response_text)
+        parsed, how = extract_json(response_text)
+        if how != 'repaired':
+            return ANALYSIS_SCHEMA.validate(parsed)
         
-        # If not, try to extract JSON from the text
-        start_idx = response_text.find('{')
-        end_idx = response_text.rfind('}')
+        analysis = REPAIRED_ANALYSIS_SCHEMA.validate(parsed)
+        analysis['repaired'] = True
+        record_parse_fallback('analysis_repaired')
+        log.info("Repaired malformed analysis JSON")
+        return analysis
         
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            json_str = response_text[start_idx:end_idx + 1]
-            return json.loads(json_str)
-        
-        # If no JSON found, create a structured response from the text
-        return {
-            "fruit_name": "No food detected",
-            "freshness_level": 0,
-            "freshness_state": "Unable to assess",
-            "visual_indicators": "No clear food item identified in the image",
-            "should_buy": False,
-            "best_use": "Unable to determine",
-            "shelf_life_days": 0,
-            "calories": 0,
-            "nutrition_highlights": "No nutritional information available",
-            "health_benefits": "No food item identified",
-            "purchase_recommendation": "No food detected - please try with a clearer image",
-            "storage_method": "Not applicable",
-            "food_pun": None,
-            "raw_analysis": response_text
-        }
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
+    except (json.JSONDecodeError, SchemaError) as e:
+        log.warning("JSON parsing error", error=str(e))
         # Return structured data with the raw response
-        return {
-            "fruit_name": "No food detected",
-            "freshness_level": 0,
-            "freshness_state": "Unable to assess",
-            "visual_indicators": "No clear food item identified in the image",
-            "should_buy": False,
-            "best_use": "Unable to determine",
-            "shelf_life_days": 0,
-            "calories": 0,
-            "nutrition_highlights": "No nutritional information available",
-            "health_benefits": "No food item identified",
-            "purchase_recommendation": "No food detected - please try with a clearer image",
-            "storage_method": "Not applicable",
-            "food_pun": None,
-            "raw_analysis": response_text
-        }
+        return {**NO_FOOD_ANALYSIS, "raw_analysis": response_text.strip()}
 
-def generate_recipes_with_groq(selected_foods, groq_api_key):
-    """Generate recipes using Groq based on selected food items"""
+def build_recipe_request(selected_foods):
+    """Chat completion arguments for generating recipes from selected foods"""
+    # One compact line per food; the schema and guidelines live in the shared system prompt
+    food_list = "\n".join(
+        f"- {food['name']}: {food['quality']}, {food['calories']} kcal, {food['nutrition']}, "
+        f"best use {food['bestUse']}, {food['shelfLife']} days left"
+        for food in selected_foods
+    )
     
-    # Initialize Groq client
-    client = Groq(api_key=groq_api_key)
+    return json_output_request(
+        'recipes',
+        f"Foods from my recent scans:\n{food_list}",
+        VISION_MODEL,
+        temperature=0.3
+    )
+
+def generate_recipes_with_groq(selected_foods):
+    """Pipeline: generate recipes using Groq based on selected food items"""
     
     try:
-        # Create a detailed prompt for recipe generation
-        food_details = []
-        for food in selected_foods:
-            food_details.append(f"""
-- {food['name']} (Freshness: {food['quality']}, Calories: {food['calories']}, 
-  Nutrition: {food['nutrition']}, Best Use: {food['bestUse']}, 
-  Shelf Life: {food['shelfLife']} days)
-""")
-        
-        food_list = "\n".join(food_details)
-        
         # Create chat completion for recipe generation
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": f"""Based on these food items from my recent scans, generate 3 creative and practical recipes:
-
-{food_list}
-
-Please provide a JSON response with the following structure:
-
-{{
-  "recipes": [
-    {{
-      "name": "Recipe Name",
-      "description": "Brief description of the recipe",
-      "ingredients": [
-        {{
-          "item": "Food item name",
-          "amount": "Quantity needed",
-          "notes": "Any special preparation notes"
-        }}
-      ],
-      "instructions": [
-        "Step 1",
-        "Step 2",
-        "Step 3"
-      ],
-      "cooking_time": "15 minutes",
-      "difficulty": "Easy/Medium/Hard",
-      "calories_per_serving": 250,
-      "servings": 2,
-      "tips": "Helpful cooking tips",
-      "why_this_recipe": "Why this recipe works well with these ingredients"
-    }}
-  ],
-  "summary": {{
-    "total_calories": 750,
-    "nutrition_benefits": "Combined nutritional benefits",
-    "freshness_considerations": "How to use ingredients based on their freshness"
-  }}
-}}
-
-IMPORTANT GUIDELINES:
-- Consider the freshness state of ingredients (use fresher items first)
-- Account for shelf life when planning cooking order
-- Make recipes practical and achievable
-- Include any additional common ingredients needed
-- Focus on healthy, nutritious combinations
-- Consider dietary restrictions and preferences
-- Make instructions clear and step-by-step
-
-Respond ONLY with valid JSON. Do not include any text before or after the JSON object."""
-                }
-            ],
-            model="meta-llama/llama-4-maverick-17b-128e-instruct",
-            temperature=0.3,
-            max_tokens=2000,
-        )
+        with stage('recipe', VISION_MODEL):
+            chat_completion = yield GroqCall(VISION_MODEL, 'chat.completions.create', build_recipe_request(selected_foods))
+        record_token_usage(VISION_MODEL, chat_completion.usage)
         
         response_content = chat_completion.choices[0].message.content
-        print(f"Raw Groq response: {response_content[:500]}...")  # Log first 500 chars
+        log.debug("Raw Groq response", model=VISION_MODEL, response=response_content[:500])
         
         return response_content
         
     except Exception as e:
-        print(f"Error with Groq API for recipe generation: {e}")
+        record_upstream_error(VISION_MODEL, e)
+        log.error("Error with Groq API for recipe generation", model=VISION_MODEL, error=str(e))
+        return None
+    
+def shelf_life_bucket(days):
+    """Coarse shelf-life bucket so a basket a day older still hits the recipe cache"""
+    try:
+        days = float(days)
+    except (TypeError, ValueError):
+        return 'unknown'
+    for limit, bucket in ((1, '0-1'), (3, '2-3'), (7, '4-7'), (14, '8-14')):
+        if days <= limit:
+            return bucket
+    return '15+'
+
+def recipe_cache_key(selected_foods):
+    """Cache key for a basket: sorted names with freshness and shelf-life bucket"""
+    basket = sorted(
+        (
+            ' '.join(str(food.get('name', '')).lower().split()),
+            str(food.get('quality', '')).strip().lower(),
+            shelf_life_bucket(food.get('shelfLife'))
+        )
+        for food in selected_foods
+    )
+    payload = json.dumps([VISION_MODEL, JSON_RESPONSE_MODE, basket])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def lookup_cached_recipes(key):
+    """Return (recipes, 'hit'|'stale'|'miss'); 'stale' only in stale-while-revalidate mode"""
+    if not RECIPE_CACHE_ENABLED:
+        return None, 'miss'
+    recipes, age = recipe_cache.get_with_age(key)
+    if recipes is None:
+        record_cache('recipes', 'miss')
+        return None, 'miss'
+    if age > RECIPE_CACHE_TTL:
+        record_cache('recipes', 'stale')
+        return recipes, 'stale'
+    record_cache('recipes', 'hit')
+    return recipes, 'hit'
+
+def store_recipes(key, result, recipes):
+    """Cache parsed recipes (not the canned fallback used when the reply had no JSON)"""
+    if RECIPE_CACHE_ENABLED and '{' in result:
+        recipe_cache.set(key, recipes)
+
+def claim_recipe_refresh(key):
+    """Whether the caller should refresh this basket (False if a refresh is already running)"""
+    with _recipe_refreshes_lock:
+        if key in _recipe_refreshes:
+            return False
+        _recipe_refreshes.add(key)
+        return True
+
+def release_recipe_refresh(key):
+    with _recipe_refreshes_lock:
+        _recipe_refreshes.discard(key)
+
+def refresh_recipes(key, selected_foods):
+    """Pipeline: regenerate a stale cache entry in the background"""
+    try:
+        result = yield from generate_recipes_with_groq(selected_foods)
+        if result:
+            store_recipes(key, result, parse_recipe_response(result))
+            log.info("Refreshed cached recipes", foods=len(selected_foods))
+    except Exception:
+        log.exception("Error refreshing cached recipes")
+    finally:
+        release_recipe_refresh(key)
+
+class MissingImageError(LookupError):
+    """A compared analysis or its stored image doesn't exist"""
+
+def parse_analysis_ids(value):
+    """List of positive analysis ids from a JSON array, or None if it isn't one"""
+    if not isinstance(value, list):
+        return None
+    try:
+        analysis_ids = [int(analysis_id) for analysis_id in value]
+    except (TypeError, ValueError):
+        return None
+    return analysis_ids if all(analysis_id > 0 for analysis_id in analysis_ids) else None
+
+def analysis_compare_items(analysis_ids):
+    """Compare items for stored analyses; their image bytes are loaded later, in parallel
+    
+    Raises MissingImageError if an analysis doesn't exist or has no image.
+    """
+    with stage('db_query'):
+        image_refs = get_analysis_images(analysis_ids)
+    if image_refs is None:
+        raise RuntimeError("Database unavailable")
+    
+    items = []
+    for analysis_id in analysis_ids:
+        if analysis_id not in image_refs:
+            raise MissingImageError(f"Analysis {analysis_id} not found")
+        image_hash, legacy_image_data = image_refs[analysis_id]
+        if image_hash:
+            items.append({'analysis_id': analysis_id, 'image_hash': image_hash, 'image_bytes': None})
+        elif legacy_image_data:
+            image_bytes = base64.b64decode(legacy_image_data)
+            items.append({'analysis_id': analysis_id, 'image_hash': hash_image(image_bytes), 'image_bytes': image_bytes})
+        else:
+            raise MissingImageError(f"No image stored for analysis {analysis_id}")
+    return items
+
+def upload_compare_items(uploads):
+    """Compare items for uploaded files, or None if any file is missing"""
+    if not uploads or any(upload is None or upload.filename == '' for upload in uploads):
+        return None
+    with stage('upload'):
+        items = [{'analysis_id': None, 'image_bytes': upload.read()} for upload in uploads]
+    with stage('hash'):
+        for item in items:
+            item['image_hash'] = hash_image(item['image_bytes'])
+    return items
+
+def load_compare_image(item):
+    """(image_bytes, content_type, is_vision_variant) for a compare item
+    
+    Stored images come from their preprocessed vision variant when one was
+    kept by an earlier comparison; content_type is None if the bytes still
+    need preprocessing.
+    """
+    if item['image_bytes'] is not None:
+        return item['image_bytes'], None, False
+    
+    variant_bytes = load_image(item['image_hash'], VISION_VARIANT)
+    if variant_bytes:
+        record_cache('vision_variant', 'hit')
+        return variant_bytes, guess_content_type(variant_bytes), True
+    record_cache('vision_variant', 'miss')
+    
+    image_bytes = load_image(item['image_hash'])
+    if not image_bytes:
+        raise MissingImageError(f"No image stored for analysis {item['analysis_id']}")
+    return image_bytes, None, False
+
+def store_vision_variants(items, loaded, processed):
+    """Keep the preprocessed copy of stored images so the next comparison skips decoding them"""
+    for item, (image_bytes, _, is_variant), (processed_bytes, _) in zip(items, loaded, processed):
+        # Uploads aren't in the store, and unchanged bytes mean preprocessing was skipped
+        if is_variant or item['image_bytes'] is not None or processed_bytes is image_bytes:
+            continue
+        try:
+            get_image_store().put(item['image_hash'], processed_bytes, VISION_VARIANT)
+        except Exception as e:
+            log.error("Error storing vision variant", image_hash=item['image_hash'], error=str(e))
+
+def encode_compare_images(items):
+    """Load, downscale and base64-encode compare images in parallel; returns [(base64_image, content_type)]"""
+    with stage('image_load'):
+        futures = [submit_with_context(image_load_executor, load_compare_image, item) for item in items]
+        loaded = [future.result() for future in futures]
+    
+    with stage('preprocess'):
+        futures = [
+            None if content_type else submit_preprocess_for_vision(image_bytes)
+            for image_bytes, content_type, _ in loaded
+        ]
+        processed = [
+            future.result() if future else (image_bytes, content_type)
+            for (image_bytes, content_type, _), future in zip(loaded, futures)
+        ]
+    
+    with stage('image_store'):
+        store_vision_variants(items, loaded, processed)
+    with stage('base64_encode'):
+        return [(base64.b64encode(image_bytes).decode('utf-8'), content_type) for image_bytes, content_type in processed]
+
+def comparison_cache_key(items):
+    """Cache key for a comparison: the image hashes in sorted order, so request order doesn't matter"""
+    payload = json.dumps([VISION_MODEL, JSON_RESPONSE_MODE, sorted(item['image_hash'] for item in items)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def lookup_cached_comparison(key):
+    """Return a cached comparison, or None"""
+    if not COMPARE_CACHE_ENABLED:
         return None
+    comparison = comparison_cache.get(key)
+    record_cache('comparison', 'miss' if comparison is None else 'hit')
+    return comparison
+
+def store_comparison(key, comparison):
+    if COMPARE_CACHE_ENABLED:
+        comparison_cache.set(key, comparison)
+
+def build_comparison_request(images):
+    """Chat completion arguments for ranking fruit images [(base64_image, content_type)] in one call"""
+    content = [{"type": "text", "text": f"Rank these {len(images)} foods."}]
+    for number, (base64_image, content_type) in enumerate(images, start=1):
+        content.append({"type": "text", "text": f"Image {number}:"})
+        content.append({"type": "image_url", "image_url": {"url": f"data:{content_type};base64,{base64_image}"}})
     
-def compare_fruits_with_groq(image_path1, image_path2, groq_api_key):
-    """Compare two fruit images and decide which is better using Groq"""
+    return json_output_request('comparison', content, VISION_MODEL, temperature=0.1)
 
-    # Initialize Groq client
-    client = Groq(api_key=groq_api_key)
+def parse_comparison_response(result, items):
+    """Parse a ranking into {'ranking': [... by image_hash], 'summary'}
+    
+    items must be in the order the images were sent. Raises
+    json.JSONDecodeError or SchemaError if the reply can't be recovered.
+    """
+    comparison, how = extract_json(result)
+    if how == 'repaired':
+        record_parse_fallback('comparison_repaired')
+        log.info("Repaired malformed comparison JSON")
+    comparison = COMPARISON_SCHEMA.validate(comparison)
+    
+    ranking, ranked = [], set()
+    for entry in comparison['ranking']:
+        position = entry['image'] - 1
+        if 0 <= position < len(items) and position not in ranked:
+            ranked.add(position)
+            ranking.append({
+                'image_hash': items[position]['image_hash'],
+                'fruit_name': entry['fruit_name'],
+                'score': entry['score'],
+                'reason': entry['reason'],
+            })
+    if not ranking:
+        raise SchemaError("Ranking doesn't reference any of the images")
+    
+    # Images the model left out rank last
+    ranking.extend(
+        {'image_hash': item['image_hash'], 'fruit_name': '', 'score': 0, 'reason': ''}
+        for position, item in enumerate(items) if position not in ranked
+    )
+    return {'ranking': ranking, 'summary': comparison['summary']}
 
-    # Helper to encode an image file to base64
-    def _b64(path):
-        b64 = encode_image_to_base64(path)
-        if not b64:
-            raise ValueError(f"Couldn’t encode {path}")
-        return b64
+def comparison_fields(comparison, items):
+    """Response fields for a comparison, with `index` pointing into the request's items"""
+    unmatched = list(range(len(items)))
+    ranking = []
+    for rank, entry in enumerate(comparison['ranking'], start=1):
+        index = next(index for index in unmatched if items[index]['image_hash'] == entry['image_hash'])
+        unmatched.remove(index)
+        ranking.append({
+            'rank': rank,
+            'index': index,
+            'analysis_id': items[index]['analysis_id'],
+            'fruit_name': entry['fruit_name'],
+            'score': entry['score'],
+            'reason': entry['reason'],
+        })
+    
+    best = ranking[0]
+    summary = comparison['summary'] or f"{best['fruit_name'] or 'The first pick'} is the best choice. {best['reason']}".strip()
+    return {'ranking': ranking, 'winner': best['index'], 'summary': summary}
 
+def compare_images(items):
+    """Pipeline: rank compare items in one vision call, using the comparison cache
+    
+    Returns (comparison, cache_status); comparison is None if the Groq call
+    failed. Raises json.JSONDecodeError or SchemaError for unusable replies.
+    """
+    key = comparison_cache_key(items)
+    comparison = lookup_cached_comparison(key)
+    if comparison is not None:
+        return comparison, 'hit'
+    
+    # Images go to the model in hash order, so a cached ranking fits any request order
+    items = sorted(items, key=lambda item: item['image_hash'])
+    images = encode_compare_images(items)
+    
     try:
-        # Encode both images
-        img1_b64 = _b64(image_path1)
-        img2_b64 = _b64(image_path2)
+        with stage('vision', VISION_MODEL):
+            resp = yield GroqCall(VISION_MODEL, 'chat.completions.create', build_comparison_request(images))
+        record_token_usage(VISION_MODEL, resp.usage)
+        result = resp.choices[0].message.content
+    except Exception as e:
+        record_upstream_error(VISION_MODEL, e)
+        log.error("Error with Groq API", model=VISION_MODEL, error=str(e))
+        return None, 'miss'
+    
+    with stage('parse'):
+        comparison = parse_comparison_response(result, items)
+    store_comparison(key, comparison)
+    return comparison, 'miss'
+
+def lookup_cached_analysis(image_bytes):
+    """Look up a cached analysis for the same or a near-identical photo
+    
+    Returns (image_hash, dhash, cached_result); cached_result is None on a miss.
+    """
+    cache = get_analysis_cache()
+    with stage('hash'):
+        image_hash = hash_image(image_bytes)
+        dhash = compute_dhash(image_bytes) if cache else None
+    
+    if cache:
+        with stage('cache_lookup'):
+            cached_result, match = cache.lookup(image_hash, dhash)
+        if cached_result is not None:
+            record_cache('analysis', 'hit')
+            log.info("Analysis cache hit", match=match, image_hash=image_hash)
+            cached_result['cache_match'] = match
+            return image_hash, dhash, cached_result
+        record_cache('analysis', 'miss')
+    
+    return image_hash, dhash, None
+
+def finish_analysis(result, image_hash, dhash, model=VISION_MODEL, parsed_result=None):
+    """Parse a vision model response (unless routing already did) and cache the parsed analysis"""
+    log.debug("Groq response", model=model, response=result[:200])
+    
+    # Parse the response
+    if parsed_result is None:
+        with stage('parse'):
+            parsed_result = parse_groq_response(result)
+    parsed_result['vision_model'] = model
+    
+    if 'raw_analysis' in parsed_result:
+        record_parse_fallback('analysis')
+    log.info("Parsed analysis", fruit_name=parsed_result.get('fruit_name'), fallback='raw_analysis' in parsed_result)
+    
+    # Don't cache the fallback for unparseable responses, or a repaired reply a rescan could get in full
+    cache = get_analysis_cache()
+    if cache and 'raw_analysis' not in parsed_result and not parsed_result.get('repaired'):
+        with stage('cache_store'):
+            cache.store(image_hash, dhash, parsed_result)
+    
+    return parsed_result
+
+def analyze_with_cache(image_bytes):
+    """Pipeline: analyze an image, reusing the cached result for the same or a near-identical photo
+    
+    Returns (parsed_result, cache_status) where cache_status is 'hit' or 'miss'.
+    parsed_result is None if the Groq call failed.
+    """
+    image_hash, dhash, cached_result = lookup_cached_analysis(image_bytes)
+    if cached_result is not None:
+        return cached_result, 'hit'
+    
+    rejected = prefilter_analysis(image_bytes)
+    if rejected is not None:
+        return rejected, 'miss'
+    
+    base64_image, content_type = encode_image_for_vision(image_bytes)
+    result, model, analysis = yield from route_vision_analysis(base64_image, content_type)
+    if not result:
+        return None, 'miss'
+    
+    return finish_analysis(result, image_hash, dhash, model, analysis), 'miss'
+
+def store_analysis(parsed_result, image_filename, image_bytes):
+    """Store the image and save the analysis row, adding its id to parsed_result"""
+    # Store the raw image bytes in the content-addressed image store
+    with stage('image_store'):
+        image_hash = save_image(image_bytes)
+    
+    # Save to database (queued for the background writer when write-behind is on)
+    with stage('db_insert'):
+        db_id = queue_food_analysis(parsed_result, image_filename, image_hash)
+    if db_id:
+        parsed_result['id'] = db_id
+        log.info("Analysis saved", analysis_id=db_id, image_hash=image_hash)
+    else:
+        log.warning("Failed to save to database, but analysis completed", image_hash=image_hash)
+    
+    return db_id
+
+RECIPE_SCHEMA = Schema({
+    "recipes": ([Schema({
+        "name": ('str', None, {"max_tokens": 8}),
+        "description": ('str', ""),
+        "ingredients": ([Schema({
+            "item": ('str', None, {"max_tokens": 5}),
+            "amount": ('str', "", {"max_tokens": 4}),
+            "notes": ('str', "", {"max_tokens": 8}),
+        }, required=("item",))], [], {"maxItems": 6}),
+        "instructions": (['str'], [], {"maxItems": 6, "max_tokens": 100}),
+        "cooking_time": ('str', "", {"max_tokens": 4}),
+        "difficulty": ('str', "", {"enum": ["Easy", "Medium", "Hard"]}),
+        "calories_per_serving": ('int', 0),
+        "servings": ('int', 0),
+        "tips": ('str', ""),
+        "why_this_recipe": ('str', ""),
+    }, required=("name",))], None, {"minItems": 3, "maxItems": 3}),
+    "summary": (Schema({
+        "total_calories": ('int', 0),
+        "nutrition_benefits": ('str', ""),
+        "freshness_considerations": ('str', ""),
+    }), {}),
+}, required=("recipes",))
+
+RECIPE_INSTRUCTIONS = (
+    "You are a home cook's assistant. Suggest 3 practical, healthy recipes using the listed foods "
+    "plus common pantry items. Use the least fresh items first and keep steps short and clear."
+)
 
-        # Build the chat prompt + two image attachments
-        messages = [
+COMPARISON_SCHEMA = Schema({
+    "ranking": ([Schema({
+        "image": ('int', None, {"description": "image number", "minimum": 1, "maximum": COMPARE_MAX_ITEMS}),
+        "fruit_name": ('str', "", {"max_tokens": 6}),
+        "score": ('int', 0, {"minimum": 1, "maximum": 10}),
+        "reason": ('str', "", {"max_tokens": 24}),
+    }, required=("image",))], None, {"minItems": 2, "maxItems": COMPARE_MAX_ITEMS}),
+    "summary": ('str', "", {"description": "one audio-friendly sentence naming the best food and why", "max_tokens": 32}),
+}, required=("ranking",))
+
+COMPARISON_INSTRUCTIONS = (
+    "You compare food photos for a grocery shopping assistant. Rank every image from best to worst on "
+    "sweetness, freshness and overall quality. Refer to images by number in the ranking and by food name in the summary."
+)
+
+JSON_OUTPUTS = {
+    'food_analysis': (ANALYSIS_SCHEMA, ANALYSIS_INSTRUCTIONS),
+    'recipes': (RECIPE_SCHEMA, RECIPE_INSTRUCTIONS),
+    'comparison': (COMPARISON_SCHEMA, COMPARISON_INSTRUCTIONS),
+}
+
+def parse_recipe_response(result):
+    """Parse the recipe JSON from a Groq response; raises json.JSONDecodeError or SchemaError if it can't be recovered"""
+    if '{' in result:
+        recipes, how = extract_json(result)
+        if how == 'repaired':
+            record_parse_fallback('recipe_repaired')
+            log.info("Repaired malformed recipe JSON")
+        return RECIPE_SCHEMA.validate(recipes)
+    
+    # If no JSON found, create a fallback response
+    record_parse_fallback('recipe')
+    log.warning("No valid JSON found in recipe response, creating fallback")
+    fallback_result = {
+        "recipes": [
             {
-                "role": "user",
-                "content": [
+                "name": "Simple Recipe",
+                "description": "A simple recipe using your selected ingredients",
+                "ingredients": [
                     {
-                        "type": "text",
-                        "text": (
-                            "Here are two fruit images. "
-                            "Please tell me **which fruit is better in terms of sweetness, freshness, and overall quality** and give a "
-                            "one-sentence reason. "
-                            "Keep your answer super brief (audio-friendly)."
-                        )
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{img1_b64}"}
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{img2_b64}"}
+                        "item": "Selected ingredients",
+                        "amount": "As available",
+                        "notes": "Use based on freshness"
                     }
-                ]
+                ],
+                "instructions": [
+                    "Wash and prepare your ingredients",
+                    "Combine ingredients in a bowl",
+                    "Serve fresh and enjoy!"
+                ],
+                "cooking_time": "10 minutes",
+                "difficulty": "Easy",
+                "calories_per_serving": 200,
+                "servings": 2,
+                "tips": "Use freshest ingredients first",
+                "why_this_recipe": "Simple preparation to preserve nutrients"
             }
-        ]
+        ],
+        "summary": {
+            "total_calories": 400,
+            "nutrition_benefits": "Fresh ingredients provide essential nutrients",
+            "freshness_considerations": "Use ingredients based on their freshness level"
+        }
+    }
+    return fallback_result
 
-        resp = client.chat.completions.create(
-            messages=messages,
-            model="meta-llama/llama-4-maverick-17b-128e-instruct",
-            temperature=0.1,
-            max_tokens=100,
-        )
-        return resp.choices[0].message.content
+def stream_chunk_usage(chunk):
+    """Token usage carried by a streamed chunk (Groq sends it on the last one), or None"""
+    x_groq = getattr(chunk, 'x_groq', None)
+    return getattr(x_groq, 'usage', None) or getattr(chunk, 'usage', None)
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_event_stream(req):
+    """Whether the client opted into streaming (?stream=1 or Accept: text/event-stream)"""
+    if req.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return req.accept_mimetypes.best == 'text/event-stream'
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def stream_analysis_events(image_filename, image_bytes):
+    """Pipeline: stream an analysis as Server-Sent Events
+    
+    Emits a 'field' event for each top-level field as soon as the model has
+    finished writing it, then a 'result' event with the full analysis and its
+    database id. Failures, including a stream that breaks off part-way, are
+    reported as an 'error' event.
+    """
+    image_hash, dhash, cached_result = lookup_cached_analysis(image_bytes)
+    rejected = prefilter_analysis(image_bytes) if cached_result is None else None
+    
+    if cached_result is not None or rejected is not None:
+        parsed_result, cache_status = (cached_result, 'hit') if cached_result is not None else (rejected, 'miss')
+        for key, value in parsed_result.items():
+            yield Emit(sse_event('field', {'field': key, 'value': value}))
+    else:
+        base64_image, content_type = encode_image_for_vision(image_bytes)
+        parser = StreamingJSONFieldParser()
+        chunks = []
+        failed = False
+        
+        try:
+            with stage('vision_stream', VISION_MODEL):
+                stream = yield GroqStream(VISION_MODEL, 'chat.completions.create', build_analysis_request(base64_image, content_type, stream=True))
+                while True:
+                    chunk = yield NextChunk(stream)
+                    if chunk is None:
+                        break
+                    record_token_usage(VISION_MODEL, stream_chunk_usage(chunk))
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    chunks.append(delta)
+                    for key, value in parser.feed(delta):
+                        yield Emit(sse_event('field', {'field': key, 'value': value}))
+        except Exception as e:
+            failed = True
+            record_upstream_error(VISION_MODEL, e)
+            log.error("Error with Groq API", model=VISION_MODEL, error=str(e), chunks=len(chunks))
+        
+        # A stream cut off mid-reply is a partial analysis: don't store or cache it
+        if failed or not chunks:
+            yield Emit(sse_event('error', {'error': 'Failed to analyze image'}))
+            return
+        
+        parsed_result, cache_status = finish_analysis(''.join(chunks), image_hash, dhash), 'miss'
+    
+    store_analysis(parsed_result, image_filename, image_bytes)
+    parsed_result['cache'] = cache_status
+    parsed_result['usage'] = token_usage()
+    yield Emit(sse_event('result', parsed_result))
+
+def respond(steps):
+    """Run a route pipeline and turn its result into a Flask response"""
+    result = run_pipeline(steps)
+    if isinstance(result, FileResponse):
+        response = send_file(result.path, mimetype=result.mimetype, conditional=True, etag=result.etag)
+    elif isinstance(result, StreamedResponse):
+        body = drive_pipeline(result.steps)
+        if result.on_error:
+            try:
+                first_chunk = next(body, b'')
+            except Exception as e:
+                return result.on_error(e)
+            body = chain([first_chunk], body)
+        response = Response(stream_with_context(body), mimetype=result.mimetype)
+    else:
+        return result
+    response.headers.update(result.headers)
+    return response
 
+def comparison_response(items):
+    """Pipeline: JSON response ranking compare items (shared by /compare-fruits and /compare)"""
+    log.info("Comparing foods", items=len(items), analysis_ids=[item['analysis_id'] for item in items])
+    
+    try:
+        comparison, cache_status = yield from compare_images(items)
+    except (json.JSONDecodeError, SchemaError) as e:
+        record_parse_fallback('comparison_error')
+        log.error("Error parsing comparison JSON", error=str(e))
+        return {'error': 'Failed to parse comparison response'}, 500
+    
+    if comparison is None:
+        return {'error': 'Failed to compare fruits'}, 500
+    
+    fields = comparison_fields(comparison, items)
+    log.info("Comparison result", winner=fields['winner'], cache=cache_status)
+    # 'result' is the sentence /compare-fruits has always returned
+    body = {'result': fields['summary'], **fields, 'cache': cache_status, 'usage': token_usage()}
+    return body, 200, {'X-Cache': cache_status.upper()}
+
+def compare_fruits_pipeline(req, files, data):
+    """Pipeline for /compare-fruits"""
+    try:
+        if req.is_json:
+            # Stored scans: reuse their images instead of re-uploading them
+            analysis_ids = parse_analysis_ids((data or {}).get('analysis_ids'))
+            if not analysis_ids or len(analysis_ids) != 2:
+                return {'error': 'Two analysis_ids are required'}, 400
+            items = None
+        else:
+            # Check if two image files are in request
+            if 'image1' not in files or 'image2' not in files:
+                return {'error': 'Two image files are required'}, 400
+            items = upload_compare_items([files['image1'], files['image2']])
+            if not items:
+                return {'error': 'Both image files are required'}, 400
+        
+        # Get API key from environment variable
+        if not os.getenv('GROQ_API_KEY'):
+            return {'error': 'GROQ_API_KEY not configured'}, 500
+        
+        if items is None:
+            items = analysis_compare_items(analysis_ids)
+        return (yield from comparison_response(items))
+    
+    except MissingImageError as e:
+        return {'error': str(e)}, 404
     except Exception as e:
-        print(f"Error with Groq API: {e}")
-        return None
+        log.exception("Server error")
+        return {'error': f'Server error: {str(e)}'}, 500
 
 @app.route('/compare-fruits', methods=['POST'])
 def compare_fruits():
-    """API endpoint to compare two fruit images"""
+    """API endpoint to compare two fruit images (uploads image1/image2, or JSON analysis_ids of two scans)"""
+    return respond(compare_fruits_pipeline(request, request.files, request.get_json(silent=True)))
+
+def compare_pipeline(req, files, data):
+    """Pipeline for /compare"""
     try:
-        # Check if two image files are in request
-        if 'image1' not in request.files or 'image2' not in request.files:
-            return jsonify({'error': 'Two image files are required'}), 400
+        if req.is_json:
+            analysis_ids = parse_analysis_ids((data or {}).get('analysis_ids'))
+            if analysis_ids is None:
+                return {'error': 'analysis_ids must be a list of analysis ids'}, 400
+            count = len(analysis_ids)
+        else:
+            uploads = files.getlist('images')
+            count = len(uploads)
         
-        file1 = request.files['image1']
-        file2 = request.files['image2']
-        if file1.filename == '' or file2.filename == '':
-            return jsonify({'error': 'Both image files are required'}), 400
+        if not 2 <= count <= COMPARE_MAX_ITEMS:
+            return {'error': f'Between 2 and {COMPARE_MAX_ITEMS} items can be compared'}, 400
         
         # Get API key from environment variable
-        api_key = os.getenv('GROQ_API_KEY')
-        if not api_key:
-            return jsonify({'error': 'GROQ_API_KEY not configured'}), 500
+        if not os.getenv('GROQ_API_KEY'):
+            return {'error': 'GROQ_API_KEY not configured'}, 500
         
-        # Save uploaded files temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file1:
-            file1.save(temp_file1.name)
-            temp_path1 = temp_file1.name
-            
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file2:
-            file2.save(temp_file2.name)
-            temp_path2 = temp_file2.name
+        if req.is_json:
+            items = analysis_compare_items(analysis_ids)
+        else:
+            items = upload_compare_items(uploads)
+            if not items:
+                return {'error': 'Every image file must be non-empty'}, 400
+        return (yield from comparison_response(items))
+    
+    except MissingImageError as e:
+        return {'error': str(e)}, 404
+    except Exception as e:
+        log.exception("Server error")
+        return {'error': f'Server error: {str(e)}'}, 500
+
+@app.route('/compare', methods=['POST'])
+def compare():
+    """API endpoint to rank 2 to COMPARE_MAX_ITEMS foods in one model call (JSON analysis_ids, or 'images' uploads)"""
+    return respond(compare_pipeline(request, request.files, request.get_json(silent=True)))
+
+def analyze_food_pipeline(req, files):
+    """Pipeline for /analyze"""
+    try:
+        # Check if image file is in request
+        if 'image' not in files:
+            return {'error': 'No image file provided'}, 400
         
-        try:
-            print(f"Comparing fruits: {file1.filename} and {file2.filename}")
-            
-            # Compare the fruits
-            result = compare_fruits_with_groq(temp_path1, temp_path2, api_key)
+        file = files['image']
+        if file.filename == '':
+            return {'error': 'No image file selected'}, 400
+        
+        # Get API key from environment variable
+        if not os.getenv('GROQ_API_KEY'):
+            return {'error': 'GROQ_API_KEY not configured'}, 500
+        
+        log.info("Analyzing image", filename=file.filename)
+        
+        # Read the upload once; the same bytes go to the model and the image store
+        with stage('upload'):
+            image_bytes = file.read()
+        
+        # Opt-in streaming: send fields as soon as the model produces them
+        if wants_event_stream(req):
+            return StreamedResponse(stream_analysis_events(file.filename, image_bytes), 'text/event-stream', SSE_HEADERS)
+        
+        # Analyze the image (or reuse a cached analysis of the same product)
+        parsed_result, cache_status = yield from analyze_with_cache(image_bytes)
+        
+        if parsed_result:
+            store_analysis(parsed_result, file.filename, image_bytes)
             
-            if result:
-                print(f"Groq response: {result}")
-                return jsonify({'result': result})
-            else:
-                return jsonify({'error': 'Failed to compare fruits'}), 500
-                
-        finally:
-            # Clean up temporary files
-            if os.path.exists(temp_path1):
-                os.unlink(temp_path1)
-            if os.path.exists(temp_path2):
-                os.unlink(temp_path2)
+            parsed_result['cache'] = cache_status
+            parsed_result['usage'] = token_usage()
+            return parsed_result, 200, {'X-Cache': cache_status.upper()}
+        else:
+            return {'error': 'Failed to analyze image'}, 500
                 
     except Exception as e:
-        print(f"Server error: {str(e)}")
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        log.exception("Server error")
+        return {'error': f'Server error: {str(e)}'}, 500
 
 @app.route('/analyze', methods=['POST'])
 def analyze_food():
-    """API endpoint to analyze food images"""
+    """API endpoint to analyze food images (add ?stream=1 for Server-Sent Events)"""
+    return respond(analyze_food_pipeline(request, request.files))
+
+def analyze_and_store(image_bytes, groq_api_key):
+    """/analyze-batch worker: analyze one image and store it if the analysis succeeded"""
+    parsed_result, cache_status = run_pipeline(analyze_with_cache(image_bytes), groq_api_key)
+    image_hash = None
+    if parsed_result:
+        with stage('image_store'):
+            image_hash = save_image(image_bytes)
+    return parsed_result, cache_status, image_hash
+
+@app.route('/analyze-batch', methods=['POST'])
+def analyze_food_batch():
+    """API endpoint to analyze many food images in one request
+    
+    Accepts several files under the 'images' form field. Images are analyzed
+    and stored concurrently (up to ANALYZE_BATCH_CONCURRENCY at a time), the
+    rows are saved together (through the write-behind queue when enabled), and
+    per-item results are returned in input order.
+    """
     try:
-        # Check if image file is in request
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+        files = [file for file in request.files.getlist('images') if file.filename != '']
+        if not files:
+            return jsonify({'error': 'No image files provided'}), 400
         
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'error': 'No image file selected'}), 400
+        if len(files) > ANALYZE_BATCH_MAX_FILES:
+            return jsonify({'error': f'Too many images (max {ANALYZE_BATCH_MAX_FILES})'}), 400
         
         # Get API key from environment variable
         api_key = os.getenv('GROQ_API_KEY')
         if not api_key:
             return jsonify({'error': 'GROQ_API_KEY not configured'}), 500
         
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            file.save(temp_file.name)
-            temp_path = temp_file.name
+        log.info("Analyzing batch", images=len(files))
         
-        try:
-            print(f"Analyzing image: {file.filename}")
+        with stage('upload'):
+            uploads = [(file.filename, file.read()) for file in files]
+        futures = [
+            submit_with_context(batch_executor, analyze_and_store, image_bytes, api_key)
+            for _, image_bytes in uploads
+        ]
+        
+        results = []
+        to_save = []
+        for index, ((filename, image_bytes), future) in enumerate(zip(uploads, futures)):
+            try:
+                parsed_result, cache_status, image_hash = future.result()
+            except Exception as e:
+                log.error("Error analyzing batch image", filename=filename, error=str(e))
+                parsed_result, cache_status, image_hash = None, 'miss', None
             
-            # Analyze the image
-            result = analyze_nutrition_with_groq(temp_path, api_key)
+            if not parsed_result:
+                results.append({'index': index, 'filename': filename, 'error': 'Failed to analyze image'})
+                continue
             
-            if result:
-                print(f"Groq response: {result[:200]}...")  # Log first 200 chars
-                
-                # Parse the response
-                parsed_result = parse_groq_response(result)
-                
-                print(f"Parsed result: {parsed_result}")
-                
-                # Convert image to base64 for storage
-                image_base64 = None
-                try:
-                    with open(temp_path, "rb") as image_file:
-                        image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
-                except Exception as e:
-                    print(f"Error converting image to base64: {e}")
-                
-                # Save to database
-                db_id = save_food_analysis(parsed_result, file.filename, image_base64)
-                if db_id:
-                    parsed_result['id'] = db_id
-                    print(f"✅ Analysis saved to database with ID: {db_id}")
-                else:
-                    print("⚠️ Failed to save to database, but analysis completed")
-                
-                return jsonify(parsed_result)
-            else:
-                return jsonify({'error': 'Failed to analyze image'}), 500
-                
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-                
+            parsed_result['cache'] = cache_status
+            results.append({'index': index, 'filename': filename, 'result': parsed_result})
+            to_save.append((parsed_result, filename, image_hash))
+        
+        with stage('db_insert'):
+            db_ids = queue_food_analyses(to_save) or [None] * len(to_save)
+        for (parsed_result, _, _), db_id in zip(to_save, db_ids):
+            if db_id:
+                parsed_result['id'] = db_id
+        unsaved = db_ids.count(None)
+        if unsaved:
+            log.warning("Failed to save batch to database, but analysis completed", rows=unsaved)
+        
+        failed = sum(1 for item in results if 'error' in item)
+        return jsonify({
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed,
+            'usage': token_usage()
+        })
+        
     except Exception as e:
-        print(f"Server error: {str(e)}")
+        log.exception("Server error")
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
-@app.route('/analyze-with-audio', methods=['POST'])
-def analyze_food_with_audio():
-    """API endpoint to analyze food images and generate audio summary"""
+def analyze_food_with_audio_pipeline(req, files, form):
+    """Pipeline for /analyze-with-audio"""
     try:
         # Check if image file is in request
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+        if 'image' not in files:
+            return {'error': 'No image file provided'}, 400
         
-        file = request.files['image']
+        file = files['image']
         if file.filename == '':
-            return jsonify({'error': 'No image file selected'}), 400
+            return {'error': 'No image file selected'}, 400
         
         # Get API key from environment variable
-        api_key = os.getenv('GROQ_API_KEY')
-        if not api_key:
-            return jsonify({'error': 'GROQ_API_KEY not configured'}), 500
+        if not os.getenv('GROQ_API_KEY'):
+            return {'error': 'GROQ_API_KEY not configured'}, 500
         
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            file.save(temp_file.name)
-            temp_path = temp_file.name
+        log.info("Analyzing image with audio", filename=file.filename)
         
-        try:
-            print(f"Analyzing image with audio: {file.filename}")
+        with stage('upload'):
+            image_bytes = file.read()
+        
+        # Analyze the image (or reuse a cached analysis of the same product)
+        parsed_result, cache_status = yield from analyze_with_cache(image_bytes)
+        
+        if parsed_result:
+            parsed_result['cache'] = cache_status
             
-            # Analyze the image
-            result = analyze_nutrition_with_groq(temp_path, api_key)
+            # Generate audio summary in the background; the client polls for it
+            script_mode = resolve_audio_script_mode(req.args.get('audio_script') or form.get('audio_script'))
+            job_id = create_audio_job()
+            yield Spawn(run_audio_job(job_id, *audio_summary_inputs(parsed_result), script_mode), audio_executor)
             
-            if result:
-                print(f"Groq response: {result[:200]}...")  # Log first 200 chars
-                
-                # Parse the response
-                parsed_result = parse_groq_response(result)
-                
-                print(f"Parsed result: {parsed_result}")
-                
-                # Generate audio summary
-                fruit_name = parsed_result.get('fruit_name', 'Food Item')
-                nutrition_info = parsed_result.get('nutrition_highlights', 'Good source of nutrients')
-                should_buy = parsed_result.get('purchase_recommendation', 'Analysis provided')
-                
-                audio_file_path = create_audio_summary(fruit_name, nutrition_info, should_buy, api_key)
-                
-                # Add audio file path to response if successful
-                if audio_file_path:
-                    parsed_result['audio_file'] = audio_file_path
-                    parsed_result['audio_text'] = f"Audio summary generated for {fruit_name}"
-                
-                return jsonify(parsed_result)
-            else:
-                return jsonify({'error': 'Failed to analyze image'}), 500
-                
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+            parsed_result.update(audio_job_fields(job_id, req.host_url))
+            parsed_result['audio_text'] = f"Audio summary generating for {parsed_result.get('fruit_name', 'Food Item')}"
+            
+            return parsed_result
+        else:
+            return {'error': 'Failed to analyze image'}, 500
                 
     except Exception as e:
-        print(f"Server error: {str(e)}")
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        log.exception("Server error")
+        return {'error': f'Server error: {str(e)}'}, 500
 
-@app.route('/generate-audio', methods=['POST'])
-def generate_audio_from_text():
-    """API endpoint to generate audio from text using Groq TTS"""
+@app.route('/analyze-with-audio', methods=['POST'])
+def analyze_food_with_audio():
+    """API endpoint to analyze food images and generate audio summary
+    
+    The analysis is returned as soon as it is ready; the audio summary is
+    produced in the background and polled at audio_job.status_url. Add
+    ?audio_script=template to skip the narration model call.
+    """
+    return respond(analyze_food_with_audio_pipeline(request, request.files, request.form))
+
+def tts_error_response(e):
+    """JSON 500 for a failed TTS call"""
+    log_tts_error(e)
+    return {'error': f'TTS Error: {str(e)}'}, 500
+
+def generate_audio_pipeline(req, data):
+    """Pipeline for /generate-audio"""
     try:
-        # Get JSON data from request
-        data = request.get_json()
         if not data or 'text' not in data:
-            return jsonify({'error': 'No text provided'}), 400
+            return {'error': 'No text provided'}, 400
         
         text = data['text']
+        response_format = resolve_speech_format(data.get('format'))
+        if not response_format:
+            return {'error': f"format must be one of: {', '.join(TTS_FORMATS)}"}, 400
         
         # Get API key from environment variable
-        api_key = os.getenv('GROQ_API_KEY')
-        if not api_key:
-            return jsonify({'error': 'GROQ_API_KEY not configured'}), 500
-        
-        print(f"🎤 Generating audio for text: {text}")
+        if not os.getenv('GROQ_API_KEY'):
+            return {'error': 'GROQ_API_KEY not configured'}, 500
         
-        # Generate audio using Groq PlayAI TTS
-        client = Groq(api_key=api_key)
+        log.info("Generating audio", text=text, format=response_format)
         
         try:
-            # Generate speech using Groq's PlayAI TTS
-            response = client.audio.speech.create(
-                model="playai-tts",
-                voice="Celeste-PlayAI",
-                input=text,
-                response_format="wav"
-            )
-            
-            # Save audio file
-            speech_file_path = "produce_summary.wav"
-            response.write_to_file(speech_file_path)
+            if wants_audio_stream(req, data):
+                return speech_stream_response(text, response_format)
             
-            print(f"🎵 Audio saved as: {speech_file_path}")
+            # Generate speech using Groq's PlayAI TTS (or reuse the cached clip)
+            audio_hash, speech_file_path, cache_status = yield from synthesize_speech(text, response_format)
             
-            # Play the audio file
-            print("🔊 Playing audio...")
-            system = platform.system().lower()
+            # Play the audio file on the server only when explicitly enabled
+            if SERVER_AUDIO_PLAYBACK:
+                play_audio_on_server(speech_file_path)
             
-            if system == "darwin":  # macOS
-                subprocess.run(["afplay", speech_file_path], check=True)
-                print("✅ Audio playback completed")
-            else:
-                print(f"💡 Please play manually: open {speech_file_path}")
-            
-            return jsonify({
-                'audio_file': speech_file_path,
+            return {
+                **audio_response_fields(audio_hash, speech_file_path, req.host_url),
+                'cache': cache_status,
                 'text': text,
-                'message': 'Audio generated and played successfully'
-            })
+                'message': 'Audio generated and played successfully' if SERVER_AUDIO_PLAYBACK else 'Audio generated successfully'
+            }
             
         except Exception as e:
-            print(f"❌ TTS Error: {e}")
-            if "model_terms_required" in str(e):
-                print("   Please accept PlayAI TTS terms at: https://console.groq.com/playground?model=playai-tts")
-            return jsonify({'error': f'TTS Error: {str(e)}'}), 500
+            return tts_error_response(e)
                 
     except Exception as e:
-        print(f"Server error: {str(e)}")
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        log.exception("Server error")
+        return {'error': f'Server error: {str(e)}'}, 500
 
-@app.route('/generate-recipes', methods=['POST'])
-def generate_recipes():
-    """API endpoint to generate recipes based on selected food items"""
+@app.route('/generate-audio', methods=['POST'])
+def generate_audio_from_text():
+    """API endpoint to generate audio from text using Groq TTS
+    
+    Returns JSON with the cached clip's URL, or with ?stream=1 / "stream": true
+    the audio itself, streamed as it arrives from the TTS API. "format" picks
+    wav (default), mp3, opus or flac.
+    """
+    return respond(generate_audio_pipeline(request, request.get_json(silent=True)))
+
+def speech_stream_response(text, response_format):
+    """Audio response for /generate-audio: the cached file, or chunks streamed from the TTS API"""
+    audio_hash = speech_cache_key(text, response_format)
+    mimetype = AUDIO_CONTENT_TYPES[response_format]
+    
+    speech_file_path = get_audio_cache().get(audio_hash, response_format)
+    if speech_file_path:
+        record_cache('audio', 'hit')
+        return FileResponse(speech_file_path, mimetype, etag=audio_hash, headers={'X-Audio-Id': audio_hash, 'X-Cache': 'HIT'})
+    
+    record_cache('audio', 'miss')
+    # The first chunk is read before the headers go out, so upstream errors become a JSON 500, not a truncated body
+    return StreamedResponse(
+        stream_speech(text, response_format), mimetype,
+        headers={'X-Audio-Id': audio_hash, 'X-Cache': 'MISS'},
+        on_error=tts_error_response
+    )
+
+def generate_recipes_pipeline(data):
+    """Pipeline for /generate-recipes"""
     try:
-        # Get JSON data from request
-        data = request.get_json()
         if not data or 'selectedFoods' not in data:
-            return jsonify({'error': 'No selected foods provided'}), 400
+            return {'error': 'No selected foods provided'}, 400
         
         selected_foods = data['selectedFoods']
         
         if not selected_foods or len(selected_foods) == 0:
-            return jsonify({'error': 'No food items selected'}), 400
+            return {'error': 'No food items selected'}, 400
         
         # Get API key from environment variable
-        api_key = os.getenv('GROQ_API_KEY')
-        if not api_key:
-            return jsonify({'error': 'GROQ_API_KEY not configured'}), 500
-        
-        print(f"🍳 Generating recipes for {len(selected_foods)} selected foods...")
+        if not os.getenv('GROQ_API_KEY'):
+            return {'error': 'GROQ_API_KEY not configured'}, 500
         
-        # Generate recipes using Groq
-        result = generate_recipes_with_groq(selected_foods, api_key)
+        # Same basket as a recent request: reuse its recipes
+        cache_key = recipe_cache_key(selected_foods)
+        recipes, cache_status = lookup_cached_recipes(cache_key)
+        if cache_status == 'stale' and claim_recipe_refresh(cache_key):
+            yield Spawn(refresh_recipes(cache_key, selected_foods), recipe_refresh_executor)
         
-        if result:
-            print(f"Recipe generation response: {result[:200]}...")  # Log first 200 chars
+        if recipes is None:
+            log.info("Generating recipes", foods=len(selected_foods))
+            
+            # Generate recipes using Groq
+            result = yield from generate_recipes_with_groq(selected_foods)
+            if not result:
+                return {'error': 'Failed to generate recipes'}, 500
+            
+            log.debug("Recipe generation response", response=result[:200])
             
             # Parse the response
             try:
-                # Try to find JSON in the response
-                response_text = result.strip()
-                
-                # If it starts and ends with curly braces, try to parse as JSON
-                if response_text.startswith('{') and response_text.endswith('}'):
-                    parsed_result = json.loads(response_text)
-                    return jsonify(parsed_result)
-                
-                # If not, try to extract JSON from the text
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}')
-                
-                if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx + 1]
-                    parsed_result = json.loads(json_str)
-                    return jsonify(parsed_result)
-                
-                # If no JSON found, create a fallback response
-                print("No valid JSON found in response, creating fallback")
-                fallback_result = {
-                    "recipes": [
-                        {
-                            "name": "Simple Recipe",
-                            "description": "A simple recipe using your selected ingredients",
-                            "ingredients": [
-                                {
-                                    "item": "Selected ingredients",
-                                    "amount": "As available",
-                                    "notes": "Use based on freshness"
-                                }
-                            ],
-                            "instructions": [
-                                "Wash and prepare your ingredients",
-                                "Combine ingredients in a bowl",
-                                "Serve fresh and enjoy!"
-                            ],
-                            "cooking_time": "10 minutes",
-                            "difficulty": "Easy",
-                            "calories_per_serving": 200,
-                            "servings": 2,
-                            "tips": "Use freshest ingredients first",
-                            "why_this_recipe": "Simple preparation to preserve nutrients"
-                        }
-                    ],
-                    "summary": {
-                        "total_calories": 400,
-                        "nutrition_benefits": "Fresh ingredients provide essential nutrients",
-                        "freshness_considerations": "Use ingredients based on their freshness level"
-                    }
-                }
-                return jsonify(fallback_result)
-                
-            except json.JSONDecodeError as e:
-                print(f"Error parsing recipe JSON: {e}")
-                print(f"Full response: {result}")
-                return jsonify({'error': 'Failed to parse recipe response'}), 500
+                with stage('parse'):
+                    recipes = parse_recipe_response(result)
+            except (json.JSONDecodeError, SchemaError) as e:
+                record_parse_fallback('recipe_error')
+                log.error("Error parsing recipe JSON", error=str(e), response=result)
+                return {'error': 'Failed to parse recipe response'}, 500
+            
+            store_recipes(cache_key, result, recipes)
         else:
-            return jsonify({'error': 'Failed to generate recipes'}), 500
+            log.info("Recipe cache hit", foods=len(selected_foods), cache=cache_status)
+        
+        return {**recipes, 'cache': cache_status, 'usage': token_usage()}, 200, {'X-Cache': cache_status.upper()}
             
     except Exception as e:
-        print(f"Server error in recipe generation: {str(e)}")
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        log.exception("Server error in recipe generation")
+        return {'error': f'Server error: {str(e)}'}, 500
 
-@app.route('/transcribe-audio', methods=['POST'])
-def transcribe_audio_endpoint():
-    """API endpoint to transcribe audio using Groq Whisper"""
+@app.route('/generate-recipes', methods=['POST'])
+def generate_recipes():
+    """API endpoint to generate recipes based on selected food items"""
+    return respond(generate_recipes_pipeline(request.get_json(silent=True)))
+
+def transcribe_audio_pipeline(files):
+    """Pipeline for /transcribe-audio"""
     try:
         # Check if audio file is in request
-        if 'audio' not in request.files:
-            return jsonify({'error': 'No audio file provided'}), 400
+        if 'audio' not in files:
+            return {'error': 'No audio file provided'}, 400
         
-        file = request.files['audio']
+        file = files['audio']
         if file.filename == '':
-            return jsonify({'error': 'No audio file selected'}), 400
+            return {'error': 'No audio file selected'}, 400
         
         # Get API key from environment variable
-        api_key = os.getenv('GROQ_API_KEY')
-        if not api_key:
-            return jsonify({'error': 'GROQ_API_KEY not configured'}), 500
+        if not os.getenv('GROQ_API_KEY'):
+            return {'error': 'GROQ_API_KEY not configured'}, 500
         
-        # Save uploaded audio file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            file.save(temp_file.name)
-            temp_path = temp_file.name
+        log.info("Transcribing audio", filename=file.filename)
         
-        try:
-            print(f"Transcribing audio: {file.filename}")
-            
-            # Initialize Groq client
-            client = Groq(api_key=api_key)
-            
-            # Transcribe using Groq Whisper
-            with open(temp_path, "rb") as audio_file:
-                transcription = client.audio.transcriptions.create(
-                    file=audio_file,
-                    model="whisper-large-v3-turbo",
-                    response_format="text",
-                    language="en"
-                )
-            
-            transcribed_text = transcription
-            print(f"Transcription result: {transcribed_text}")
-            
-            # Analyze for voice commands
-            voice_command = analyze_voice_command(transcribed_text)
-            
-            return jsonify({
-                'transcription': transcribed_text,
-                'voice_command': voice_command,
-                'success': True
-            })
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+        with stage('upload'):
+            audio_bytes = file.read()
+        
+        # Known commands are recognized locally; anything else goes to Whisper
+        transcribed_text = spot_voice_command(audio_bytes)
+        engine = 'keyword_spotting'
+        
+        if transcribed_text is None:
+            # Transcribe using Groq Whisper, uploading the in-memory recording directly
+            audio_upload = (file.filename or 'audio.wav', audio_bytes)
+            try:
+                with stage('transcription', TRANSCRIPTION_MODEL):
+                    transcribed_text = yield GroqCall(TRANSCRIPTION_MODEL, 'audio.transcriptions.create', build_transcription_request(audio_upload))
+            except Exception as e:
+                record_upstream_error(TRANSCRIPTION_MODEL, e)
+                raise
+            engine = 'whisper'
+        
+        log.info("Transcription result", transcription=transcribed_text, engine=engine)
+        
+        # Analyze for voice commands
+        voice_command = analyze_voice_command(transcribed_text)
+        
+        return {
+            'transcription': transcribed_text,
+            'voice_command': voice_command,
+            'engine': engine,
+            'success': True
+        }
                 
     except Exception as e:
-        print(f"Transcription error: {str(e)}")
-        return jsonify({'error': f'Transcription error: {str(e)}'}), 500
+        log.exception("Transcription error")
+        return {'error': f'Transcription error: {str(e)}'}, 500
+
+@app.route('/transcribe-audio', methods=['POST'])
+def transcribe_audio_endpoint():
+    """API endpoint to transcribe audio using Groq Whisper"""
+    return respond(transcribe_audio_pipeline(request.files))
+
+def build_transcription_request(audio_file):
+    """Whisper transcription arguments; audio_file is a file object or (filename, bytes)"""
+    return {
+        "file": audio_file,
+        "model": TRANSCRIPTION_MODEL,
+        "response_format": "text",
+        "language": "en",
+        "timeout": model_timeout(TRANSCRIPTION_MODEL),
+    }
+
+def spot_voice_command(audio_bytes):
+    """The command phrase in a clip if the local keyword spotter recognizes it, else None (use Whisper)"""
+    if not keyword_spotting_available():
+        return None
+    with stage('keyword_spotting'):
+        text = spot_keywords(audio_bytes, VOICE_COMMAND_PHRASES)
+    record_keyword_spotting('matched' if text else 'fallback')
+    return text
 
 def analyze_voice_command(text):
     """Analyze transcribed text for voice commands"""
@@ -842,8 +1744,8 @@ def get_accessibility_status():
         'keyboard_navigation_enabled': True,
         'screen_reader_support': True,
         'available_commands': list(VOICE_COMMANDS.keys()),
-        'whisper_model': 'whisper-large-v3-turbo',
-        'tts_model': 'playai-tts'
+        'whisper_model': TRANSCRIPTION_MODEL,
+        'tts_model': TTS_MODEL
     })
 
 @app.route('/health', methods=['GET'])
@@ -851,12 +1753,111 @@ def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'message': 'SnackOverflow API is running'})
 
+@app.route('/health/db-pool', methods=['GET'])
+def db_pool_stats():
+    """Database connection pool statistics"""
+    return jsonify(get_pool_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics (request and per-stage latency, cache, parse and upstream error counters)"""
+    rendered = render_metrics()
+    if rendered is None:
+        return jsonify({'error': 'Metrics unavailable (install prometheus_client)'}), 503
+    body, content_type = rendered
+    return Response(body, mimetype=content_type)
+
+@app.route('/health/write-behind', methods=['GET'])
+def write_behind_stats():
+    """Write-behind queue statistics (null when write-behind is disabled)"""
+    return jsonify({'write_behind': get_write_behind_stats()})
+
+@app.route('/health/cache', methods=['GET'])
+def cache_stats():
+    """Analysis, audio, recipe and comparison cache statistics"""
+    cache = get_analysis_cache()
+    return jsonify({
+        'analysis_cache': cache.stats() if cache else None,
+        'audio_cache': get_audio_cache().stats(),
+        'recipe_cache': recipe_cache.stats() if RECIPE_CACHE_ENABLED else None,
+        'comparison_cache': comparison_cache.stats() if COMPARE_CACHE_ENABLED else None
+    })
+
+@app.route('/audio/<audio_hash>', methods=['GET'])
+def get_cached_audio(audio_hash):
+    """Serve a cached TTS clip (supports Range requests for seeking)"""
+    speech_file_path, response_format = get_audio_cache().find(audio_hash)
+    if not speech_file_path:
+        return jsonify({'error': 'Audio not found'}), 404
+    
+    # Content-addressed, so the bytes behind this URL never change
+    response = send_file(
+        speech_file_path,
+        mimetype=AUDIO_CONTENT_TYPES[response_format],
+        conditional=True,
+        etag=audio_hash
+    )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/audio-jobs/<job_id>', methods=['GET'])
+def get_audio_job(job_id):
+    """Status of a background audio summary; includes audio_url once ready"""
+    job = audio_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Audio job not found'}), 404
+    
+    body = {'id': job_id, 'status': job['status']}
+    if job['status'] == 'ready':
+        body.update(audio_response_fields(job['audio_id'], job['audio_file'], request.host_url))
+        return jsonify(body)
+    if job['status'] == 'failed':
+        body['error'] = 'Failed to generate audio summary'
+        return jsonify(body), 500
+    return jsonify(body), 202
+
+@app.route('/health/preprocess', methods=['GET'])
+def preprocess_stats():
+    """Vision image preprocessing statistics (before/after bytes)"""
+    return jsonify(get_preprocess_stats())
+
+@app.route('/health/upstream', methods=['GET'])
+def upstream_health():
+    """Per-model Groq rate limit, circuit breaker and hedging state"""
+    return jsonify(upstream_stats())
+
+def format_history_cursor(analysis):
+    """Build the '<created_at>,<id>' pagination cursor for a history row"""
+    created_at = analysis['created_at']
+    if hasattr(created_at, 'isoformat'):
+        created_at = created_at.isoformat()
+    return f"{created_at},{analysis['id']}"
+
+def parse_history_cursor(cursor):
+    """Parse a '<created_at>,<id>' cursor into (datetime, id); raises ValueError if malformed"""
+    from datetime import datetime
+    created_at, _, analysis_id = cursor.rpartition(',')
+    return datetime.fromisoformat(created_at), int(analysis_id)
+
 @app.route('/analyses/recent', methods=['GET'])
 def get_recent_food_analyses():
-    """Get recent food analyses from database"""
+    """Get recent food analyses from database, newest first
+    
+    Pages with ?before=<created_at,id>; the cursor for the next page is
+    returned in the X-Next-Cursor header.
+    """
     try:
-        limit = request.args.get('limit', 10, type=int)
-        analyses = get_recent_analyses(limit)
+        limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_HISTORY_LIMIT)
+        
+        before = None
+        if request.args.get('before'):
+            try:
+                before = parse_history_cursor(request.args['before'])
+            except ValueError:
+                return jsonify({'error': "before must be '<created_at>,<id>'"}), 400
+        
+        with stage('db_query'):
+            analyses = get_recent_analyses(limit, before)
         
         # Format for frontend
         formatted_analyses = []
@@ -879,13 +1880,21 @@ def get_recent_food_analyses():
             else:
                 time_ago = f"{minutes} minutes ago"
             
+            # Images are fetched separately so the list stays small
+            image_url = None
+            thumbnail_url = None
+            if analysis.get('image_hash') or analysis.get('has_legacy_image'):
+                image_url = url_for('get_analysis_image_file', analysis_id=analysis['id'], _external=True)
+                thumbnail_url = url_for('get_analysis_image_file', analysis_id=analysis['id'], size='thumb', _external=True)
+            
             formatted_analysis = {
                 'id': analysis['id'],
                 'name': analysis['fruit_name'],
                 'calories': analysis['calories'],
                 'nutrition': analysis['nutrition_highlights'],
                 'quality': analysis['freshness_state'],
-                'image': f"data:image/jpeg;base64,{analysis['image_data']}" if analysis['image_data'] else None,
+                'image': image_url,
+                'thumbnail': thumbnail_url,
                 'timestamp': time_ago,
                 'shouldBuy': analysis['should_buy'],
                 'bestUse': analysis['best_use'],
@@ -893,15 +1902,90 @@ def get_recent_food_analyses():
                 'healthBenefits': analysis['health_benefits'],
                 'purchaseRecommendation': analysis['purchase_recommendation'],
                 'storageMethod': analysis['storage_method'],
-                'foodPun': analysis['food_pun']
+                'foodPun': analysis['food_pun'],
+                'cursor': format_history_cursor(analysis)
             }
             formatted_analyses.append(formatted_analysis)
         
-        return jsonify(formatted_analyses)
+        response = jsonify(formatted_analyses)
+        
+        # A full page means there may be older rows
+        if len(analyses) == limit:
+            next_cursor = formatted_analyses[-1]['cursor']
+            response.headers['X-Next-Cursor'] = next_cursor
+            next_url = url_for('get_recent_food_analyses', limit=limit, before=next_cursor, _external=True)
+            response.headers['Link'] = f'<{next_url}>; rel="next"'
+        
+        return response
         
     except Exception as e:
-        print(f"Error fetching recent analyses: {e}")
+        log.error("Error fetching recent analyses", error=str(e))
         return jsonify({'error': 'Failed to fetch analyses'}), 500
 
+def immutable_image_response(response, etag):
+    """Mark a stored image response as cacheable forever and answer conditional requests"""
+    # Content-addressed, so the bytes behind this URL never change
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+@app.route('/analyses/<int:analysis_id>/image', methods=['GET'])
+def get_analysis_image_file(analysis_id):
+    """Serve the stored image for an analysis; ?size=thumb serves a cached thumbnail"""
+    size = request.args.get('size', 'full')
+    if size not in ('full', 'thumb'):
+        return jsonify({'error': "size must be 'full' or 'thumb'"}), 400
+    
+    try:
+        with stage('db_query'):
+            image_ref = get_analysis_image(analysis_id)
+        if not image_ref:
+            return jsonify({'error': 'Analysis not found'}), 404
+        
+        image_hash, legacy_image_data = image_ref
+        stored_hash = image_hash
+        if stored_hash and size == 'thumb':
+            # A cached thumbnail is served without reading the original
+            with stage('image_load'):
+                thumbnail = load_image(image_hash, 'thumb')
+            if thumbnail:
+                response = Response(thumbnail, mimetype=guess_content_type(thumbnail))
+                return immutable_image_response(response, f"{image_hash}-thumb")
+        
+        image_bytes = None
+        if image_hash:
+            with stage('image_load'):
+                image_bytes = load_image(image_hash)
+        elif legacy_image_data:
+            image_bytes = base64.b64decode(legacy_image_data)
+            image_hash = hash_image(image_bytes)
+        
+        if not image_bytes:
+            return jsonify({'error': 'No image stored for this analysis'}), 404
+        
+        etag = image_hash
+        if size == 'thumb':
+            # Thumbnails are generated once and kept next to the original
+            # (already looked up above, unless the hash was just computed from legacy data)
+            thumbnail = None if stored_hash else load_image(image_hash, 'thumb')
+            if thumbnail is None:
+                with stage('thumbnail'):
+                    thumbnail = create_thumbnail(image_bytes)
+                if thumbnail:
+                    try:
+                        get_image_store().put(image_hash, thumbnail, 'thumb')
+                    except Exception as e:
+                        log.error("Error caching thumbnail", image_hash=image_hash, error=str(e))
+            if thumbnail:
+                image_bytes = thumbnail
+                etag = f"{image_hash}-thumb"
+        
+        response = Response(image_bytes, mimetype=guess_content_type(image_bytes))
+        return immutable_image_response(response, etag)
+        
+    except Exception as e:
+        log.error("Error serving analysis image", analysis_id=analysis_id, error=str(e))
+        return jsonify({'error': 'Failed to load image'}), 500
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Async (ASGI) serving mode for the SnackOverflow API
+
+The routes that wait on Groq (vision, script, TTS, Whisper) run the same
+request pipelines as api.py, driven by pipeline.run_pipeline_async: Groq
+calls are awaited on the AsyncGroq client and the local steps run in worker
+threads, so a single process can keep hundreds of analyses in flight instead
+of pinning one worker thread per request. Every other route is served by the
+regular Flask app from api.py.
+
+Run with:
+    hypercorn asgi:application --bind 0.0.0.0:5000 --workers 4
+"""
+
+import asyncio
+import time
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, g, request, send_file
+from quart_cors import cors
+from api import (
+    app as flask_app,
+    analyze_food_pipeline,
+    analyze_food_with_audio_pipeline,
+    compare_fruits_pipeline,
+    compare_pipeline,
+    generate_audio_pipeline,
+    generate_recipes_pipeline,
+    transcribe_audio_pipeline,
+)
+from metrics import current_route, observe_request, start_token_usage
+from pipeline import FileResponse, StreamedResponse, run_pipeline_async, stream_pipeline_async
+
+quart_app = cors(Quart(__name__), allow_origin='*', expose_headers=['X-Cache', 'X-Audio-Id'])
+
+# Paths handled by the async app; everything else goes to Flask
+ASYNC_ROUTES = {
+    '/analyze',
+    '/analyze-with-audio',
+    '/compare',
+    '/compare-fruits',
+    '/generate-audio',
+    '/generate-recipes',
+    '/transcribe-audio',
+}
+
+@quart_app.before_request
+async def start_request_timer():
+    """Label metrics and logs with the matched route, start the request timer and token count"""
+    g.request_started = time.perf_counter()
+    current_route.set(request.url_rule.rule if request.url_rule else 'unmatched')
+    start_token_usage()
+
+@quart_app.after_request
+async def record_request_latency(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        observe_request(current_route.get(), request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+async def prepend_chunk(first_chunk, chunks):
+    yield first_chunk
+    async for chunk in chunks:
+        yield chunk
+
+async def respond_async(steps):
+    """Async version of api.respond"""
+    result = await run_pipeline_async(steps)
+    if isinstance(result, FileResponse):
+        if result.etag is None:
+            response = await send_file(result.path, mimetype=result.mimetype, conditional=True)
+        else:
+            # Quart's send_file has no etag argument; validate against ours as Flask does
+            response = await send_file(result.path, mimetype=result.mimetype, add_etags=False)
+            response.set_etag(result.etag)
+            await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+    elif isinstance(result, StreamedResponse):
+        body = stream_pipeline_async(result.steps)
+        if result.on_error:
+            try:
+                first_chunk = await body.__anext__()
+            except StopAsyncIteration:
+                first_chunk = b''
+            except Exception as e:
+                return result.on_error(e)
+            body = prepend_chunk(first_chunk, body)
+        response = Response(body, mimetype=result.mimetype)
+    else:
+        return result
+    response.headers.update(result.headers)
+    return response
+
+@quart_app.route('/analyze', methods=['POST'])
+async def analyze_food():
+    """Async /analyze (same pipeline as api.analyze_food)"""
+    return await respond_async(analyze_food_pipeline(request, await request.files))
+
+@quart_app.route('/analyze-with-audio', methods=['POST'])
+async def analyze_food_with_audio():
+    """Async /analyze-with-audio (same pipeline as api.analyze_food_with_audio)"""
+    return await respond_async(analyze_food_with_audio_pipeline(request, await request.files, await request.form))
+
+@quart_app.route('/compare-fruits', methods=['POST'])
+async def compare_fruits():
+    """Async /compare-fruits (same pipeline as api.compare_fruits)"""
+    return await respond_async(compare_fruits_pipeline(request, await request.files, await request.get_json(silent=True)))
+
+@quart_app.route('/compare', methods=['POST'])
+async def compare():
+    """Async /compare (same pipeline as api.compare)"""
+    return await respond_async(compare_pipeline(request, await request.files, await request.get_json(silent=True)))
+
+@quart_app.route('/generate-audio', methods=['POST'])
+async def generate_audio_from_text():
+    """Async /generate-audio (same pipeline as api.generate_audio_from_text)"""
+    return await respond_async(generate_audio_pipeline(request, await request.get_json(silent=True)))
+
+@quart_app.route('/generate-recipes', methods=['POST'])
+async def generate_recipes():
+    """Async /generate-recipes (same pipeline as api.generate_recipes)"""
+    return await respond_async(generate_recipes_pipeline(await request.get_json(silent=True)))
+
+@quart_app.route('/transcribe-audio', methods=['POST'])
+async def transcribe_audio_endpoint():
+    """Async /transcribe-audio (same pipeline as api.transcribe_audio_endpoint)"""
+    return await respond_async(transcribe_audio_pipeline(await request.files))
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+async def application(scope, receive, send):
+    """ASGI entry point: async routes go to Quart, the rest to the Flask app"""
+    if scope['type'] == 'http' and scope['path'] not in ASYNC_ROUTES:
+        await flask_asgi(scope, receive, send)
+    else:
+        await quart_app(scope, receive, send)
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = ['0.0.0.0:5000']
+    asyncio.run(serve(application, config))
@@ -0,0 +1,158 @@
+"""
+Content-addressed TTS audio cache for SnackOverflow
+Synthesized speech is stored once per (text, voice, model, format) as a file
+named by its SHA-256 key, so repeated phrases (the voice tutorial, common
+result sentences) skip the TTS model and concurrent requests never share a file.
+The directory is kept under AUDIO_CACHE_MAX_BYTES by evicting the least
+recently used files.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+AUDIO_CACHE_DIR = os.getenv(
+    'AUDIO_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audio_cache')
+)
+AUDIO_CACHE_MAX_BYTES = int(os.getenv('AUDIO_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+AUDIO_CONTENT_TYPES = {
+    'wav': 'audio/wav',
+    'mp3': 'audio/mpeg',
+    'ogg': 'audio/ogg',
+    'flac': 'audio/flac',
+}
+
+_AUDIO_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def audio_cache_key(text, voice, model, response_format):
+    """SHA-256 key for a synthesized clip"""
+    payload = json.dumps([text, voice, model, response_format], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def is_audio_hash(value):
+    """Whether value looks like an audio cache key"""
+    return bool(_AUDIO_HASH_PATTERN.match(value or ''))
+
+class AudioCache:
+    """Audio files under <root>/<hash[:2]>/<hash>.<format>, LRU-bounded by total size
+
+    File mtimes double as the LRU clock: a hit touches the file, eviction
+    removes the oldest files first.
+    """
+
+    def __init__(self, root=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _path(self, audio_hash, response_format):
+        return os.path.join(self.root, audio_hash[:2], f"{audio_hash}.{response_format}")
+
+    def _files(self):
+        if not os.path.isdir(self.root):
+            return []
+        files = []
+        for directory in os.scandir(self.root):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.is_file() and not entry.name.startswith('.tmp-'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def find(self, audio_hash):
+        """Return (path, response_format) for a cached clip, or (None, None)"""
+        if not is_audio_hash(audio_hash):
+            return None, None
+        for response_format in AUDIO_CONTENT_TYPES:
+            path = self._path(audio_hash, response_format)
+            if os.path.exists(path):
+                return path, response_format
+        return None, None
+
+    def get(self, audio_hash, response_format):
+        """Return the path of a cached clip (marking it recently used), or None"""
+        path = self._path(audio_hash, response_format)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+        with self._lock:
+            self._stats['hits'] += 1
+        return path
+
+    def put(self, audio_hash, response_format, audio_bytes):
+        """Store a clip and return its path"""
+        path = self._path(audio_hash, response_format)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file first so readers never see a partial clip
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(audio_bytes)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._files())
+            else:
+                self._total_bytes += len(audio_bytes)
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=path)
+        return path
+
+    def _evict(self, keep):
+        # Recount from disk so files removed by other processes don't skew the total
+        files = sorted(self._files())
+        self._total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self._total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._files())
+            stats = dict(self._stats)
+            stats['total_bytes'] = self._total_bytes
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_audio_cache():
+    """Return the process-wide audio cache"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AudioCache()
+    return _cache
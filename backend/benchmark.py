@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark harness for the SnackOverflow API
+Starts the fake Groq server (fake_groq.py), a MySQL server (a throwaway
+mysqld, or an existing one from .env) and the API itself, then drives
+/analyze, /analyses/recent, /generate-recipes and /transcribe-audio at each
+concurrency level. For every scenario and level it reports p50/p95/p99
+latency, requests per second, errors and the API process memory.
+
+Without a reachable MySQL server the run goes ahead without one: scenarios
+that only measure the database (/analyses/recent) are skipped and /analyze
+runs without saving rows, which the result file records as "mysql": "none".
+
+Results are written as JSON together with the git commit and the settings
+used, so runs can be compared across commits:
+
+    python benchmark.py --concurrency 1,8,32 --requests 200
+    python benchmark.py --compare benchmark_results/<baseline>.json
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import requests
+import mysql.connector
+from mysql.connector import Error
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BACKEND_DIR, 'benchmark_results')
+DEFAULT_IMAGE = os.path.join(BACKEND_DIR, 'img', 'apple.webp')
+
+# Bump when scenarios or measurements change so old results aren't compared blindly
+BENCHMARK_VERSION = 1
+
+SCENARIOS = ('analyze', 'recent', 'recipes', 'transcribe')
+# Scenarios that measure nothing but MySQL; skipped when no server is reachable
+DB_SCENARIOS = ('recent',)
+
+SELECTED_FOODS = [
+    {'name': 'Apple', 'quality': 'Fresh', 'calories': 95, 'nutrition': 'Fiber, vitamin C',
+     'bestUse': 'Eat now', 'shelfLife': 7},
+    {'name': 'Banana', 'quality': 'Ripe', 'calories': 105, 'nutrition': 'Potassium',
+     'bestUse': 'Eat now', 'shelfLife': 2},
+    {'name': 'Spinach', 'quality': 'Fresh', 'calories': 7, 'nutrition': 'Iron, vitamin K',
+     'bestUse': 'Use for cooking', 'shelfLife': 4},
+]
+
+def free_port():
+    """An unused local TCP port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for(check, timeout, what):
+    """Poll check() until it returns truthy or the timeout expires"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {what}")
+
+def git_info():
+    """Commit hash and whether the working tree has uncommitted changes"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except Exception:
+        return {'commit': None, 'dirty': None}
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and its children (Linux only), or None"""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as children:
+                    pending.extend(int(child) for child in children.read().split())
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        if total == 0:
+            return None
+    return total
+
+class MemorySampler:
+    """Samples the API process RSS in the background while a scenario runs"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval)
+
+    def summary(self):
+        if not self.samples:
+            return None
+        return {
+            'peak_mb': round(max(self.samples) / (1024 * 1024), 1),
+            'end_mb': round(self.samples[-1] / (1024 * 1024), 1),
+        }
+
+class ThrowawayMySQL:
+    """A mysqld (MySQL 8) with an empty data directory, removed on exit"""
+
+    def __init__(self, mysqld):
+        self.mysqld = mysqld
+        self.port = free_port()
+        self.datadir = tempfile.mkdtemp(prefix='snackoverflow-bench-mysql-')
+        self.process = None
+
+    def start(self):
+        base_args = [self.mysqld, '--no-defaults', f'--datadir={self.datadir}']
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            base_args.append('--user=root')
+
+        print(f"🗄️ Initializing throwaway MySQL in {self.datadir}...")
+        subprocess.run(base_args + ['--initialize-insecure'], check=True, capture_output=True)
+        self.process = subprocess.Popen(
+            base_args + [
+                f'--port={self.port}',
+                '--bind-address=127.0.0.1',
+                f'--socket={os.path.join(self.datadir, "mysqld.sock")}',
+                '--mysqlx=OFF',
+                '--skip-log-bin',
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        wait_for(lambda: self.connect().close() or True, 60, 'MySQL to start')
+        return {'MYSQL_HOST': '127.0.0.1', 'MYSQL_PORT': str(self.port), 'MYSQL_USER': 'root', 'MYSQL_PASSWORD': ''}
+
+    def connect(self):
+        return mysql.connector.connect(host='127.0.0.1', port=self.port, user='root', password='')
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.datadir, ignore_errors=True)
+
+def create_database(mysql_env, database):
+    """Create an empty benchmark database, dropping any previous one"""
+    connection = None
+    cursor = None
+    try:
+        connection = mysql.connector.connect(
+            host=mysql_env['MYSQL_HOST'],
+            port=int(mysql_env['MYSQL_PORT']),
+            user=mysql_env['MYSQL_USER'],
+            password=mysql_env['MYSQL_PASSWORD'],
+        )
+        cursor = connection.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS `{database}`")
+        cursor.execute(f"CREATE DATABASE `{database}`")
+    finally:
+        if cursor:
+            cursor.close()
+        if connection and connection.is_connected():
+            connection.close()
+
+def start_process(args, env, name):
+    """Start a helper process whose output goes to a log file in the run directory"""
+    log_path = os.path.join(env['SNACKOVERFLOW_BENCH_DIR'], f"{name}.log")
+    log_file = open(log_path, 'wb')
+    process = subprocess.Popen(args, cwd=BACKEND_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    process.log_path = log_path
+    return process
+
+def stop_process(process):
+    if process and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def silent_wav_bytes(seconds=1.0):
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        wav_file.writeframes(b'\x00\x00' * int(16000 * seconds))
+    return output.getvalue()
+
+def build_scenarios(base_url, image_bytes, image_name):
+    """Map each scenario to a function that sends one request with a session"""
+    audio_bytes = silent_wav_bytes()
+
+    return {
+        'analyze': lambda session: session.post(
+            f"{base_url}/analyze", files={'image': (image_name, image_bytes)}
+        ),
+        'recent': lambda session: session.get(f"{base_url}/analyses/recent", params={'limit': 20}),
+        'recipes': lambda session: session.post(
+            f"{base_url}/generate-recipes", json={'selectedFoods': SELECTED_FOODS}
+        ),
+        'transcribe': lambda session: session.post(
+            f"{base_url}/transcribe-audio", files={'audio': ('recording.wav', audio_bytes, 'audio/wav')}
+        ),
+    }
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def run_level(send, concurrency, total_requests, server_pid):
+    """Send total_requests requests from `concurrency` workers and summarize them"""
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                response = send(session)
+                response.content
+                error = None if response.status_code < 400 else str(response.status_code)
+            except requests.RequestException as e:
+                error = type(e).__name__
+            elapsed = time.perf_counter() - started
+            with lock:
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+                else:
+                    latencies.append(elapsed)
+
+    with MemorySampler(server_pid) as memory:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        wall_seconds = time.perf_counter() - started
+
+    latencies.sort()
+    to_ms = lambda value: round(value * 1000, 1) if value is not None else None
+    return {
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'succeeded': len(latencies),
+        'errors': errors,
+        'wall_seconds': round(wall_seconds, 3),
+        'rps': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        'latency_ms': {
+            'p50': to_ms(percentile(latencies, 0.50)),
+            'p95': to_ms(percentile(latencies, 0.95)),
+            'p99': to_ms(percentile(latencies, 0.99)),
+            'mean': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': to_ms(latencies[-1] if latencies else None),
+        },
+        'memory': memory.summary(),
+    }
+
+def compare_results(baseline, current, threshold):
+    """Return regressions of p95 latency or throughput beyond threshold (a fraction)"""
+    if baseline.get('benchmark_version') != current.get('benchmark_version'):
+        print("⚠️ Baseline was produced by a different benchmark version; comparison may be meaningless")
+
+    baseline_levels = {
+        (result['scenario'], result['concurrency']): result for result in baseline.get('results', [])
+    }
+    regressions = []
+    for result in current['results']:
+        key = (result['scenario'], result['concurrency'])
+        before = baseline_levels.get(key)
+        if not before:
+            continue
+
+        old_p95, new_p95 = before['latency_ms']['p95'], result['latency_ms']['p95']
+        old_rps, new_rps = before['rps'], result['rps']
+        p95_change = (new_p95 - old_p95) / old_p95 if old_p95 and new_p95 is not None else None
+        rps_change = (new_rps - old_rps) / old_rps if old_rps and new_rps is not None else None
+
+        p95_text = f"{p95_change:+.1%}" if p95_change is not None else 'n/a'
+        rps_text = f"{rps_change:+.1%}" if rps_change is not None else 'n/a'
+        print(f"   {key[0]} c={key[1]}: p95 {old_p95} → {new_p95} ms ({p95_text}), "
+              f"rps {old_rps} → {new_rps} ({rps_text})")
+
+        if p95_change is not None and p95_change > threshold:
+            regressions.append(f"{key[0]} c={key[1]}: p95 {old_p95} → {new_p95} ms")
+        if rps_change is not None and rps_change < -threshold:
+            regressions.append(f"{key[0]} c={key[1]}: rps {old_rps} → {new_rps}")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the SnackOverflow API against a fake Groq server')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help='comma-separated concurrency levels')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario and concurrency level')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed requests per scenario before measuring')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask',
+                        help='flask: threaded Flask app; asgi: hypercorn asgi:application')
+    parser.add_argument('--workers', type=int, default=1, help='hypercorn worker processes (asgi only)')
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='image uploaded to /analyze')
+    parser.add_argument('--analysis-cache', action='store_true',
+                        help='leave the analysis cache on (every /analyze after the first is a cache hit)')
+    parser.add_argument('--mysqld', default=None,
+                        help='mysqld binary for a throwaway server (default: one on PATH, else MYSQL_* from .env)')
+    parser.add_argument('--use-existing-mysql', action='store_true', help='use the MYSQL_* server from .env')
+    parser.add_argument('--database', default='snackoverflow_bench',
+                        help='database created (and dropped first) for the run')
+    parser.add_argument('--chat-latency', default=None, help='fake Groq chat latency spec, e.g. lognormal:1.2,0.35')
+    parser.add_argument('--tts-latency', default=None, help='fake Groq TTS latency spec')
+    parser.add_argument('--whisper-latency', default=None, help='fake Groq Whisper latency spec')
+    parser.add_argument('--seed', type=int, default=1234, help='seed for the fake Groq latency draws')
+    parser.add_argument('--error-rate', default=None, help='fraction of fake Groq calls that return 503')
+    parser.add_argument('--rate-limit-rate', default=None, help='fraction of fake Groq calls that return 429')
+    parser.add_argument('--output', default=None, help='result file (default: benchmark_results/<commit>-<time>.json)')
+    parser.add_argument('--compare', default=None, help='baseline result file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative p95/RPS change that counts as a regression (default 0.10)')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    with open(args.image, 'rb') as image_file:
+        image_bytes = image_file.read()
+
+    run_dir = tempfile.mkdtemp(prefix='snackoverflow-bench-')
+    mysql_server = None
+    fake_groq = None
+    api_server = None
+
+    try:
+        # MySQL: a throwaway mysqld when one is available, otherwise the configured server
+        mysqld = args.mysqld or (None if args.use_existing_mysql else shutil.which('mysqld'))
+        if mysqld:
+            mysql_server = ThrowawayMySQL(mysqld)
+            mysql_env = mysql_server.start()
+        else:
+            mysql_env = {
+                'MYSQL_HOST': os.getenv('MYSQL_HOST', 'localhost'),
+                'MYSQL_PORT': os.getenv('MYSQL_PORT', '3306'),
+                'MYSQL_USER': os.getenv('MYSQL_USER', 'root'),
+                'MYSQL_PASSWORD': os.getenv('MYSQL_PASSWORD', ''),
+            }
+            print(f"🗄️ Using MySQL at {mysql_env['MYSQL_HOST']}:{mysql_env['MYSQL_PORT']}")
+        mysql_mode = 'throwaway' if mysql_server else 'existing'
+        try:
+            create_database(mysql_env, args.database)
+        except Error as e:
+            skipped = [name for name in scenarios if name in DB_SCENARIOS]
+            print(f"⚠️ No MySQL server reachable at {mysql_env['MYSQL_HOST']}:{mysql_env['MYSQL_PORT']} ({e})")
+            print(f"   Skipping DB-bound scenarios ({', '.join(skipped) or 'none selected'}); /analyze runs without "
+                  f"saving rows. Put mysqld on PATH, pass --mysqld, or set MYSQL_* in .env to include them.")
+            scenarios = [name for name in scenarios if name not in DB_SCENARIOS]
+            mysql_mode = 'none'
+
+        env = dict(os.environ)
+        env.update(mysql_env)
+        env.update({
+            'SNACKOVERFLOW_BENCH_DIR': run_dir,
+            'MYSQL_DB': args.database,
+            'IMAGE_STORE_DIR': os.path.join(run_dir, 'images'),
+            'AUDIO_CACHE_DIR': os.path.join(run_dir, 'audio'),
+            'ANALYSIS_CACHE_ENABLED': 'true' if args.analysis_cache else 'false',
+            'ANALYSIS_CACHE_SHARED': 'none',
+            'SERVER_AUDIO_PLAYBACK': 'false',
+            'LOG_LEVEL': 'WARNING',
+            'PYTHONUNBUFFERED': '1',
+        })
+
+        # Fake Groq
+        groq_port = free_port()
+        fake_groq_args = [sys.executable, 'fake_groq.py', '--port', str(groq_port), '--seed', str(args.seed)]
+        for flag, value in (('--chat-latency', args.chat_latency), ('--tts-latency', args.tts_latency),
+                            ('--whisper-latency', args.whisper_latency), ('--error-rate', args.error_rate),
+                            ('--rate-limit-rate', args.rate_limit_rate)):
+            if value:
+                fake_groq_args += [flag, value]
+        fake_groq = start_process(fake_groq_args, env, 'fake_groq')
+        groq_url = f"http://127.0.0.1:{groq_port}"
+        wait_for(lambda: requests.get(f"{groq_url}/stats", timeout=1).ok, 15, 'fake Groq server')
+        fake_groq_config = requests.get(f"{groq_url}/stats", timeout=5).json()['config']
+
+        env['GROQ_API_KEY'] = 'benchmark-fake-key'
+        env['GROQ_BASE_URL'] = groq_url
+
+        # API under test
+        api_port = free_port()
+        if args.server == 'asgi':
+            api_args = ['hypercorn', 'asgi:application', '--bind', f'127.0.0.1:{api_port}',
+                        '--workers', str(args.workers)]
+        else:
+            api_args = [sys.executable, '-c',
+                        f"from api import app; app.run(host='127.0.0.1', port={api_port}, threaded=True)"]
+        api_server = start_process(api_args, env, 'api')
+        base_url = f"http://127.0.0.1:{api_port}"
+        wait_for(lambda: requests.get(f"{base_url}/health", timeout=1).ok, 60, 'API server')
+        print(f"🚀 API ({args.server}) on {base_url}, fake Groq on {groq_url}, logs in {run_dir}")
+
+        senders = build_scenarios(base_url, image_bytes, os.path.basename(args.image))
+        results = []
+        for name in scenarios:
+            session = requests.Session()
+            for _ in range(args.warmup):
+                senders[name](session)
+
+            for level in levels:
+                print(f"⏱️ {name} at concurrency {level} ({args.requests} requests)...")
+                result = run_level(senders[name], level, args.requests, api_server.pid)
+                result['scenario'] = name
+                results.append(result)
+                latency = result['latency_ms']
+                print(f"   p50 {latency['p50']} ms, p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+                      f"{result['rps']} req/s, errors {sum(result['errors'].values())}, memory {result['memory']}")
+
+        report = {
+            'benchmark_version': BENCHMARK_VERSION,
+            'git': git_info(),
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'host': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'config': {
+                'server': args.server,
+                'workers': args.workers if args.server == 'asgi' else 1,
+                'requests': args.requests,
+                'warmup': args.warmup,
+                'concurrency': levels,
+                'analysis_cache': args.analysis_cache,
+                'image_bytes': len(image_bytes),
+                'mysql': mysql_mode,
+                'fake_groq': fake_groq_config,
+            },
+            'upstream_calls': requests.get(f"{groq_url}/stats", timeout=5).json()['counts'],
+            'results': results,
+        }
+
+        output = args.output
+        if not output:
+            os.makedirs(RESULTS_DIR, exist_ok=True)
+            commit = (report['git']['commit'] or 'unknown')[:12]
+            output = os.path.join(RESULTS_DIR, f"{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        with open(output, 'w') as result_file:
+            json.dump(report, result_file, indent=2)
+        print(f"✅ Results written to {output}")
+
+        if args.compare:
+            with open(args.compare) as baseline_file:
+                baseline = json.load(baseline_file)
+            print(f"📊 Compared with {args.compare} (commit {baseline.get('git', {}).get('commit')}):")
+            baseline_mysql = baseline.get('config', {}).get('mysql')
+            if (baseline_mysql == 'none') != (mysql_mode == 'none'):
+                print(f"⚠️ Baseline ran with mysql={baseline_mysql}, this run with mysql={mysql_mode}; "
+                      f"/analyze latencies are not comparable")
+            regressions = compare_results(baseline, report, args.threshold)
+            if regressions:
+                print("❌ Regressions:")
+                for regression in regressions:
+                    print(f"   {regression}")
+                sys.exit(1)
+            print("✅ No regressions beyond threshold")
+
+    except Error as e:
+        sys.exit(f"MySQL error: {e}")
+    finally:
+        stop_process(api_server)
+        stop_process(fake_groq)
+        if mysql_server:
+            mysql_server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -1,32 +1,263 @@
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, errorcode
+from mysql.connector.errors import PoolError
+import atexit
 import os
+import queue
+import threading
+import time
 from dotenv import load_dotenv
+from structured_log import get_logger
 
 # Load environment variables
 load_dotenv()
 
+log = get_logger('database')
+
+# Hard cap on history page size
+MAX_HISTORY_LIMIT = int(os.getenv('MAX_HISTORY_LIMIT', 100))
+
+# Connection pool settings
+POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.getenv('MYSQL_POOL_MAX_OVERFLOW', 10))
+POOL_TIMEOUT = float(os.getenv('MYSQL_POOL_TIMEOUT', 10))
+POOL_PRE_PING = os.getenv('MYSQL_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+POOL_RECYCLE = int(os.getenv('MYSQL_POOL_RECYCLE', 1800))
+
+# Write-behind settings (off by default: saves are synchronous)
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', 1000))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 50))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 0.5))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', 5))
+WRITE_BEHIND_RETRY_BACKOFF = float(os.getenv('WRITE_BEHIND_RETRY_BACKOFF', 0.5))
+# How long a request waits for queue space before writing synchronously itself
+WRITE_BEHIND_ENQUEUE_TIMEOUT = float(os.getenv('WRITE_BEHIND_ENQUEUE_TIMEOUT', 0.05))
+WRITE_BEHIND_SHUTDOWN_TIMEOUT = float(os.getenv('WRITE_BEHIND_SHUTDOWN_TIMEOUT', 30))
+ID_BLOCK_SIZE = int(os.getenv('ID_BLOCK_SIZE', 100))
+
+# analysis_cache splits each dHash into this many indexed 8-bit bands; two hashes
+# less than DHASH_BANDS bits apart share at least one band
+DHASH_BANDS = 8
+
+def _connect():
+    """Open a new raw MySQL connection"""
+    return mysql.connector.connect(
+        host=os.getenv('MYSQL_HOST', 'localhost'),
+        user=os.getenv('MYSQL_USER', 'root'),
+        password=os.getenv('MYSQL_PASSWORD', ''),
+        database=os.getenv('MYSQL_DB', 'snackoverflow'),
+        port=int(os.getenv('MYSQL_PORT', 3306))
+    )
+
+class PooledConnection:
+    """Connection borrowed from the pool; close() hands it back instead of closing it"""
+
+    def __init__(self, pool, connection, overflow=False):
+        self._pool = pool
+        self._connection = connection
+        self._overflow = overflow
+        self.created_at = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        """Return the connection to the pool"""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            pool.release(self)
+
+class ConnectionPool:
+    """Thread-safe MySQL connection pool shared by the Flask worker threads
+
+    Keeps up to `size` idle connections around and allows `max_overflow`
+    extra connections under load, which are closed again when returned.
+    Connections are pinged on checkout so a MySQL restart is handled by
+    transparently reconnecting instead of failing the request.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, timeout=POOL_TIMEOUT,
+                 pre_ping=POOL_PRE_PING, recycle=POOL_RECYCLE):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.recycle = recycle
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size + max_overflow)
+        self._checked_out = 0
+        self._overflow = 0
+        self._stats = {
+            'connections_created': 0,
+            'reconnects': 0,
+            'recycled': 0,
+            'checkouts': 0,
+            'wait_timeouts': 0,
+            'total_wait_seconds': 0.0,
+        }
+
+    def _new_connection(self, overflow=False):
+        connection = PooledConnection(self, _connect(), overflow=overflow)
+        with self._lock:
+            self._stats['connections_created'] += 1
+        return connection
+
+    def _is_stale(self, connection):
+        return self.recycle > 0 and time.monotonic() - connection.created_at > self.recycle
+
+    def _discard(self, connection):
+        try:
+            connection._connection.close()
+        except Error:
+            pass
+
+    def acquire(self):
+        """Borrow a connection, waiting up to `timeout` seconds for a free slot"""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['wait_timeouts'] += 1
+            raise PoolError(msg=f"Connection pool exhausted (size={self.size}, max_overflow={self.max_overflow})")
+
+        try:
+            connection = None
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                pass
+
+            if connection is not None and self._is_stale(connection):
+                self._discard(connection)
+                connection = None
+                with self._lock:
+                    self._stats['recycled'] += 1
+
+            if connection is not None and self.pre_ping:
+                try:
+                    # Reconnects in place if the server went away
+                    connection._connection.ping(reconnect=True, attempts=2, delay=0)
+                except Error:
+                    self._discard(connection)
+                    connection = None
+                    with self._lock:
+                        self._stats['reconnects'] += 1
+
+            if connection is None:
+                with self._lock:
+                    overflow = self._checked_out >= self.size
+                connection = self._new_connection(overflow=overflow)
+            else:
+                connection._pool = self
+
+            with self._lock:
+                self._checked_out += 1
+                if connection._overflow:
+                    self._overflow += 1
+                self._stats['checkouts'] += 1
+                self._stats['total_wait_seconds'] += time.monotonic() - started
+            return connection
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, connection):
+        """Give a connection back; overflow and broken connections are closed"""
+        with self._lock:
+            self._checked_out -= 1
+            if connection._overflow:
+                self._overflow -= 1
+
+        try:
+            keep = not connection._overflow
+            if keep:
+                try:
+                    # End any open transaction so the next borrower sees fresh data
+                    connection._connection.rollback()
+                except Error:
+                    keep = False
+
+            if keep:
+                try:
+                    self._idle.put_nowait(connection)
+                except queue.Full:
+                    keep = False
+
+            if not keep:
+                self._discard(connection)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        """Snapshot of pool usage for sizing decisions"""
+        with self._lock:
+            stats = dict(self._stats)
+            checkouts = stats['checkouts']
+            total_wait = stats.pop('total_wait_seconds')
+            stats.update({
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'checked_out': self._checked_out,
+                'overflow_in_use': self._overflow,
+                'idle': self._idle.qsize(),
+                'avg_wait_ms': round(total_wait / checkouts * 1000, 3) if checkouts else 0.0,
+            })
+        return stats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def get_pool_stats():
+    """Return connection pool statistics"""
+    return get_connection_pool().stats()
+
 def get_database_connection():
-    """Create and return a MySQL database connection"""
+    """Borrow a MySQL database connection from the shared pool"""
     try:
-        connection = mysql.connector.connect(
-            host=os.getenv('MYSQL_HOST', 'localhost'),
-            user=os.getenv('MYSQL_USER', 'root'),
-            password=os.getenv('MYSQL_PASSWORD', ''),
-            database=os.getenv('MYSQL_DB', 'snackoverflow'),
-            port=int(os.getenv('MYSQL_PORT', 3306))
-        )
-        return connection
+        return get_connection_pool().acquire()
     except Error as e:
-        print(f"Error connecting to MySQL: {e}")
+        log.error("Error connecting to MySQL", error=str(e))
         return None
 
+def column_exists(cursor, table, column):
+    """Check whether a column exists in the current database"""
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """,
+        (table, column)
+    )
+    return cursor.fetchone()[0] > 0
+
+def index_exists(cursor, table, index):
+    """Check whether an index exists in the current database"""
+    cursor.execute(
+        """
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """,
+        (table, index)
+    )
+    return cursor.fetchone()[0] > 0
+
 def create_tables():
     """Create the necessary tables if they don't exist"""
     connection = get_database_connection()
     if not connection:
         return False
     
+    cursor = None
     try:
         cursor = connection.cursor()
         
@@ -48,100 +279,554 @@ def create_tables():
             storage_method TEXT,
             food_pun TEXT,
             image_filename VARCHAR(255),
-            image_data LONGTEXT,
+            image_hash CHAR(64),
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
         """
         
         cursor.execute(create_table_query)
+        
+        # Tables created before the image store keep base64 image_data until migrated
+        if not column_exists(cursor, 'food_analyses', 'image_hash'):
+            cursor.execute("ALTER TABLE food_analyses ADD COLUMN image_hash CHAR(64) AFTER image_filename")
+        
+        # Keyset pagination index for history (ORDER BY created_at DESC, id DESC)
+        if not index_exists(cursor, 'food_analyses', 'idx_food_analyses_created_id'):
+            cursor.execute("CREATE INDEX idx_food_analyses_created_id ON food_analyses (created_at, id)")
+        
+        # Content-addressed image blobs (used when IMAGE_STORE_BACKEND=mysql)
+        create_images_table_query = """
+        CREATE TABLE IF NOT EXISTS food_images (
+            sha256 CHAR(64) NOT NULL,
+            variant VARCHAR(32) NOT NULL DEFAULT 'original',
+            content_type VARCHAR(64),
+            byte_size INT,
+            data LONGBLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (sha256, variant)
+        )
+        """
+        
+        cursor.execute(create_images_table_query)
+        
+        # Shared analysis result cache (used when ANALYSIS_CACHE_SHARED=mysql)
+        create_cache_table_query = """
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            sha256 CHAR(64) PRIMARY KEY,
+            dhash BIGINT,
+            result JSON NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_analysis_cache_last_hit (last_hit_at)
+        )
+        """
+        
+        cursor.execute(create_cache_table_query)
+        
+        # Perceptual lookups only compare rows that share a dHash band
+        for band in range(DHASH_BANDS):
+            column = f"dhash_band{band}"
+            if not column_exists(cursor, 'analysis_cache', column):
+                cursor.execute(
+                    f"ALTER TABLE analysis_cache ADD COLUMN {column} TINYINT UNSIGNED "
+                    f"AS ((dhash >> {8 * band}) & 255) STORED, ADD INDEX idx_analysis_cache_{column} ({column})"
+                )
+        
+        # Id sequence for food_analyses: next unallocated id, handed out in blocks
+        create_id_blocks_table_query = """
+        CREATE TABLE IF NOT EXISTS id_blocks (
+            name VARCHAR(64) PRIMARY KEY,
+            next_id BIGINT NOT NULL
+        )
+        """
+        
+        cursor.execute(create_id_blocks_table_query)
+        seed_id_sequence(cursor)
         connection.commit()
-        print("✅ Database tables created successfully")
+        log.info("Database tables created")
         return True
         
     except Error as e:
-        print(f"Error creating tables: {e}")
+        log.error("Error creating tables", error=str(e))
         return False
     finally:
-        if connection.is_connected():
+        if cursor:
             cursor.close()
-            connection.close()
+        connection.close()
+
+# Ids come from allocate_id_block, so a duplicate key is a real error and fails the insert
+INSERT_ANALYSIS_WITH_ID_QUERY = """
+INSERT INTO food_analyses (
+    id, fruit_name, freshness_level, freshness_state, visual_indicators,
+    should_buy, best_use, shelf_life_days, calories, nutrition_highlights,
+    health_benefits, purchase_recommendation, storage_method, food_pun,
+    image_filename, image_hash
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
 
-def save_food_analysis(analysis_data, image_filename=None, image_data=None):
-    """Save food analysis to database"""
+def analysis_values(analysis_data, image_filename=None, image_hash=None):
+    """Row values for INSERT_ANALYSIS_WITH_ID_QUERY, after the id"""
+    return (
+        analysis_data.get('fruit_name'),
+        analysis_data.get('freshness_level'),
+        analysis_data.get('freshness_state'),
+        analysis_data.get('visual_indicators'),
+        analysis_data.get('should_buy'),
+        analysis_data.get('best_use'),
+        analysis_data.get('shelf_life_days'),
+        analysis_data.get('calories'),
+        analysis_data.get('nutrition_highlights'),
+        analysis_data.get('health_benefits'),
+        analysis_data.get('purchase_recommendation'),
+        analysis_data.get('storage_method'),
+        analysis_data.get('food_pun'),
+        image_filename,
+        image_hash
+    )
+
+def save_food_analysis(analysis_data, image_filename=None, image_hash=None):
+    """Save food analysis to database under an id from the id allocator"""
+    try:
+        analysis_id = get_id_allocator().next_id()
+        insert_analyses_with_ids([(analysis_id, analysis_data, image_filename, image_hash)])
+        log.info("Food analysis saved", analysis_id=analysis_id)
+        return analysis_id
+        
+    except Error as e:
+        log.error("Error saving to database", error=str(e))
+        return None
+
+def save_food_analyses_batch(analyses):
+    """Save several analyses with one multi-row INSERT
+    
+    analyses is a list of (analysis_data, image_filename, image_hash) tuples.
+    Ids come from the id allocator (explicit ids, not AUTO_INCREMENT).
+    Returns the inserted ids in the same order, or None on failure.
+    """
+    if not analyses:
+        return []
+    
+    try:
+        allocator = get_id_allocator()
+        rows = [(allocator.next_id(),) + tuple(analysis) for analysis in analyses]
+        insert_analyses_with_ids(rows)
+        inserted_ids = [row[0] for row in rows]
+        log.info("Food analyses saved", rows=len(inserted_ids), analysis_ids=inserted_ids)
+        return inserted_ids
+        
+    except Error as e:
+        log.error("Error saving batch to database", error=str(e))
+        return None
+
+# Errors worth retrying: lost connections, deadlocks, lock waits, too many connections
+TRANSIENT_ERROR_CODES = {
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+    errorcode.ER_CON_COUNT_ERROR,
+    errorcode.ER_LOCK_DEADLOCK,
+    errorcode.ER_LOCK_WAIT_TIMEOUT,
+}
+
+def is_transient_error(error):
+    """Whether a MySQL error is likely to succeed on retry"""
+    return isinstance(error, PoolError) or getattr(error, 'errno', None) in TRANSIENT_ERROR_CODES
+
+def seed_id_sequence(cursor, name='food_analyses'):
+    """Start a table's id_blocks sequence past its existing rows, or move it there
+    
+    Rows written with AUTO_INCREMENT before every insert used the sequence
+    may sit past next_id; this runs at startup so they are never reissued.
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO id_blocks (name, next_id)
+        SELECT * FROM (SELECT %s AS name, COALESCE(MAX(id), 0) + 1 AS next_id FROM {name}) AS seed
+        ON DUPLICATE KEY UPDATE next_id = GREATEST(id_blocks.next_id, seed.next_id)
+        """,
+        (name,)
+    )
+
+def allocate_id_block(name='food_analyses', size=ID_BLOCK_SIZE):
+    """Reserve `size` consecutive ids for a table; returns (first_id, end_id)
+    
+    The id_blocks row is locked, read and advanced in one transaction, so
+    concurrent reservations wait on the row lock instead of overlapping.
+    Every food_analyses insert takes its id from here. Raises Error on failure.
+    """
     connection = get_database_connection()
     if not connection:
-        return None
+        raise Error(msg="No database connection for id allocation")
     
+    cursor = None
     try:
         cursor = connection.cursor()
         
-        insert_query = """
-        INSERT INTO food_analyses (
-            fruit_name, freshness_level, freshness_state, visual_indicators,
-            should_buy, best_use, shelf_life_days, calories, nutrition_highlights,
-            health_benefits, purchase_recommendation, storage_method, food_pun,
-            image_filename, image_data
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        
-        values = (
-            analysis_data.get('fruit_name'),
-            analysis_data.get('freshness_level'),
-            analysis_data.get('freshness_state'),
-            analysis_data.get('visual_indicators'),
-            analysis_data.get('should_buy'),
-            analysis_data.get('best_use'),
-            analysis_data.get('shelf_life_days'),
-            analysis_data.get('calories'),
-            analysis_data.get('nutrition_highlights'),
-            analysis_data.get('health_benefits'),
-            analysis_data.get('purchase_recommendation'),
-            analysis_data.get('storage_method'),
-            analysis_data.get('food_pun'),
-            image_filename,
-            image_data
-        )
+        cursor.execute("SELECT next_id FROM id_blocks WHERE name = %s FOR UPDATE", (name,))
+        row = cursor.fetchone()
+        if row is None:
+            connection.rollback()
+            seed_id_sequence(cursor, name)
+            connection.commit()
+            cursor.execute("SELECT next_id FROM id_blocks WHERE name = %s FOR UPDATE", (name,))
+            row = cursor.fetchone()
         
-        cursor.execute(insert_query, values)
+        first_id = row[0]
+        end_id = first_id + size
+        cursor.execute("UPDATE id_blocks SET next_id = %s WHERE name = %s", (end_id, name))
         connection.commit()
+        return first_id, end_id
         
-        # Get the inserted ID
-        inserted_id = cursor.lastrowid
-        print(f"✅ Food analysis saved to database with ID: {inserted_id}")
-        return inserted_id
-        
-    except Error as e:
-        print(f"Error saving to database: {e}")
-        return None
     finally:
-        if connection.is_connected():
+        if cursor:
             cursor.close()
-            connection.close()
+        connection.close()
+
+class IdBlockAllocator:
+    """Hands out ids from blocks reserved in the id_blocks table"""
+    
+    def __init__(self, name='food_analyses', block_size=ID_BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self._next_id = 0
+        self._end_id = 0
+        self._lock = threading.Lock()
+    
+    def next_id(self):
+        """Return an unused id, reserving a new block when the current one runs out"""
+        with self._lock:
+            if self._next_id >= self._end_id:
+                self._next_id, self._end_id = allocate_id_block(self.name, self.block_size)
+            allocated_id = self._next_id
+            self._next_id += 1
+            return allocated_id
+
+_id_allocator = None
+_id_allocator_lock = threading.Lock()
 
-def get_recent_analyses(limit=10):
-    """Get recent food analyses from database"""
+def get_id_allocator():
+    """Return the process-wide food_analyses id allocator"""
+    global _id_allocator
+    if _id_allocator is None:
+        with _id_allocator_lock:
+            if _id_allocator is None:
+                _id_allocator = IdBlockAllocator()
+    return _id_allocator
+
+def insert_analyses_with_ids(rows):
+    """Insert (id, analysis_data, image_filename, image_hash) rows in one statement; raises Error"""
+    connection = get_database_connection()
+    if not connection:
+        raise Error(msg="No database connection for analysis insert")
+    
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        # mysql-connector rewrites executemany() INSERTs into a single multi-row statement
+        cursor.executemany(
+            INSERT_ANALYSIS_WITH_ID_QUERY,
+            [(row_id,) + analysis_values(data, filename, image_hash) for row_id, data, filename, image_hash in rows]
+        )
+        connection.commit()
+    finally:
+        if cursor:
+            cursor.close()
+        connection.close()
+
+class WriteBehindQueue:
+    """Bounded queue of analysis rows drained by a background writer thread
+    
+    The writer batches up to `batch_size` rows per INSERT and retries transient
+    MySQL errors with exponential backoff. submit() returns False when the
+    queue stays full, so callers can fall back to a synchronous write.
+    """
+    
+    def __init__(self, max_size=WRITE_BEHIND_QUEUE_SIZE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, max_retries=WRITE_BEHIND_MAX_RETRIES,
+                 retry_backoff=WRITE_BEHIND_RETRY_BACKOFF):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stats_lock = threading.Lock()
+        self._stats = {'queued': 0, 'written': 0, 'batches': 0, 'retries': 0, 'failed': 0, 'rejected': 0}
+        self._thread = threading.Thread(target=self._run, name='analysis-writer', daemon=True)
+        self._thread.start()
+    
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+    
+    def submit(self, row, timeout=WRITE_BEHIND_ENQUEUE_TIMEOUT):
+        """Queue an (id, analysis_data, image_filename, image_hash) row; False if the queue is full"""
+        try:
+            self._queue.put(row, timeout=timeout)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('queued')
+        return True
+    
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                insert_analyses_with_ids(batch)
+                self._count('written', len(batch))
+                self._count('batches')
+                return
+            except Error as e:
+                if not is_transient_error(e) or attempt == self.max_retries:
+                    ids = [row[0] for row in batch]
+                    log.error("Write-behind failed", analysis_ids=ids, error=str(e))
+                    self._count('failed', len(batch))
+                    return
+                self._count('retries')
+                time.sleep(self.retry_backoff * (2 ** attempt))
+            except Exception as e:
+                # Anything else (a bad row, a driver bug) must not kill the writer thread
+                ids = [row[0] for row in batch]
+                log.error("Write-behind failed", analysis_ids=ids, error=repr(e))
+                self._count('failed', len(batch))
+                return
+    
+    def flush(self, timeout=None):
+        """Wait until every queued row has been written (or given up on); returns False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.unfinished_tasks
+        stats['max_size'] = self._queue.maxsize
+        return stats
+
+_write_behind = None
+_write_behind_lock = threading.Lock()
+
+def get_write_behind_queue():
+    """Return the process-wide write-behind queue, or None if write-behind is disabled"""
+    global _write_behind
+    if not WRITE_BEHIND_ENABLED:
+        return None
+    if _write_behind is None:
+        with _write_behind_lock:
+            if _write_behind is None:
+                _write_behind = WriteBehindQueue()
+                atexit.register(flush_write_behind)
+    return _write_behind
+
+def flush_write_behind(timeout=WRITE_BEHIND_SHUTDOWN_TIMEOUT):
+    """Write out queued analyses; registered to run at interpreter shutdown"""
+    if _write_behind is None:
+        return True
+    pending = _write_behind.stats()['pending']
+    if pending:
+        log.info("Flushing queued analyses", pending=pending)
+    flushed = _write_behind.flush(timeout)
+    if not flushed:
+        log.warning("Write-behind flush timed out", unsaved=_write_behind.stats()['pending'])
+    return flushed
+
+def get_write_behind_stats():
+    """Write-behind queue statistics, or None if disabled"""
+    write_behind = get_write_behind_queue()
+    return write_behind.stats() if write_behind else None
+
+def queue_food_analysis(analysis_data, image_filename=None, image_hash=None):
+    """Save a food analysis, returning its id without waiting for the INSERT when write-behind is on
+    
+    The id comes from the id allocator and the row is written by the
+    background writer. If the queue is full the row is written synchronously
+    instead (backpressure). With write-behind off this is save_food_analysis.
+    """
+    write_behind = get_write_behind_queue()
+    if write_behind is None:
+        return save_food_analysis(analysis_data, image_filename, image_hash)
+    
+    try:
+        analysis_id = get_id_allocator().next_id()
+    except Error as e:
+        log.error("Error allocating analysis id", error=str(e))
+        return None
+    
+    row = (analysis_id, dict(analysis_data), image_filename, image_hash)
+    if write_behind.submit(row):
+        return analysis_id
+    
+    try:
+        insert_analyses_with_ids([row])
+        return analysis_id
+    except Error as e:
+        log.error("Error saving to database", error=str(e))
+        return None
+
+def queue_food_analyses(analyses):
+    """Batch version of queue_food_analysis; returns the ids in order (None for rows that failed)
+    
+    analyses is a list of (analysis_data, image_filename, image_hash) tuples.
+    Rows the queue turns away are written together in one synchronous INSERT.
+    With write-behind off this is save_food_analyses_batch.
+    """
+    write_behind = get_write_behind_queue()
+    if write_behind is None:
+        return save_food_analyses_batch(analyses)
+    
+    try:
+        allocator = get_id_allocator()
+        rows = [(allocator.next_id(), dict(data), filename, image_hash) for data, filename, image_hash in analyses]
+    except Error as e:
+        log.error("Error allocating analysis ids", error=str(e))
+        return None
+    
+    rejected = [row for row in rows if not write_behind.submit(row)]
+    failed = set()
+    if rejected:
+        try:
+            insert_analyses_with_ids(rejected)
+        except Error as e:
+            log.error("Error saving batch to database", error=str(e))
+            failed = {row[0] for row in rejected}
+    return [None if row[0] in failed else row[0] for row in rows]
+
+# Columns the history list needs; image payloads are served separately
+HISTORY_COLUMNS = """
+    id, fruit_name, freshness_state, should_buy, best_use, shelf_life_days,
+    calories, nutrition_highlights, health_benefits, purchase_recommendation,
+    storage_method, food_pun, image_hash, created_at
+"""
+
+_legacy_image_column = None
+
+def has_legacy_image_column(cursor):
+    """Whether food_analyses still has the pre-image-store image_data column"""
+    global _legacy_image_column
+    if _legacy_image_column is None:
+        _legacy_image_column = column_exists(cursor, 'food_analyses', 'image_data')
+    return _legacy_image_column
+
+def get_recent_analyses(limit=10, before=None):
+    """Get recent food analyses from database, without image payloads
+    
+    Results are ordered newest first. Pass before=(created_at, id) from the
+    last row of the previous page to fetch the next page.
+    """
     connection = get_database_connection()
     if not connection:
         return []
     
+    limit = max(1, min(limit, MAX_HISTORY_LIMIT))
+    
+    cursor = None
     try:
         cursor = connection.cursor(dictionary=True)
         
-        select_query = """
-        SELECT * FROM food_analyses 
-        ORDER BY created_at DESC 
+        # Unmigrated rows only have base64 image_data; flag them without fetching it
+        legacy_image = (
+            ", image_data IS NOT NULL AS has_legacy_image"
+            if has_legacy_image_column(cursor) else ""
+        )
+        
+        # Seek past the cursor instead of OFFSET so deep pages stay cheap
+        where_clause = ""
+        params = []
+        if before:
+            before_created_at, before_id = before
+            where_clause = "WHERE created_at < %s OR (created_at = %s AND id < %s)"
+            params = [before_created_at, before_created_at, before_id]
+        
+        select_query = f"""
+        SELECT {HISTORY_COLUMNS}{legacy_image} FROM food_analyses 
+        {where_clause}
+        ORDER BY created_at DESC, id DESC 
         LIMIT %s
         """
         
-        cursor.execute(select_query, (limit,))
+        cursor.execute(select_query, (*params, limit))
         results = cursor.fetchall()
         
         return results
         
     except Error as e:
-        print(f"Error fetching analyses: {e}")
+        log.error("Error fetching analyses", error=str(e))
         return []
     finally:
-        if connection.is_connected():
+        if cursor:
+            cursor.close()
+        connection.close()
+
+def get_analysis_image(analysis_id):
+    """Get (image_hash, legacy_base64) for an analysis, or None if it doesn't exist"""
+    connection = get_database_connection()
+    if not connection:
+        return None
+    
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        
+        legacy_image = ", image_data" if has_legacy_image_column(cursor) else ", NULL"
+        cursor.execute(
+            f"SELECT image_hash{legacy_image} FROM food_analyses WHERE id = %s",
+            (analysis_id,)
+        )
+        row = cursor.fetchone()
+        return (row[0], row[1]) if row else None
+        
+    except Error as e:
+        log.error("Error fetching analysis image", analysis_id=analysis_id, error=str(e))
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        connection.close()
+
+def get_analysis_images(analysis_ids):
+    """Map each existing analysis id to (image_hash, legacy_base64) in one query, or None on error"""
+    connection = get_database_connection()
+    if not connection:
+        return None
+    
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        
+        legacy_image = ", image_data" if has_legacy_image_column(cursor) else ", NULL"
+        placeholders = ', '.join(['%s'] * len(analysis_ids))
+        cursor.execute(
+            f"SELECT id, image_hash{legacy_image} FROM food_analyses WHERE id IN ({placeholders})",
+            tuple(analysis_ids)
+        )
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        
+    except Error as e:
+        log.error("Error fetching analysis images", error=str(e))
+        return None
+    finally:
+        if cursor:
             cursor.close()
-            connection.close() 
\ No newline at end of file
+        connection.close()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Groq API, used by benchmark.py
+Serves the OpenAI-compatible endpoints the app calls (chat completions with
+and without streaming, speech, transcriptions) with canned responses after a
+latency drawn from a configurable distribution, so load tests measure our
+code rather than the network or the upstream models.
+
+Point the app at it with GROQ_BASE_URL=http://127.0.0.1:<port>.
+
+Latency specs (seconds):
+    fixed:0.8
+    uniform:0.5,1.5
+    normal:1.0,0.2
+    lognormal:1.0,0.4     (median, sigma)
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CHAT_LATENCY = os.getenv('FAKE_GROQ_CHAT_LATENCY', 'lognormal:1.2,0.35')
+DEFAULT_TTS_LATENCY = os.getenv('FAKE_GROQ_TTS_LATENCY', 'lognormal:0.6,0.3')
+DEFAULT_WHISPER_LATENCY = os.getenv('FAKE_GROQ_WHISPER_LATENCY', 'lognormal:0.4,0.3')
+DEFAULT_ERROR_RATE = float(os.getenv('FAKE_GROQ_ERROR_RATE', 0))
+DEFAULT_RATE_LIMIT_RATE = float(os.getenv('FAKE_GROQ_RATE_LIMIT_RATE', 0))
+DEFAULT_RETRY_AFTER = float(os.getenv('FAKE_GROQ_RETRY_AFTER', 0.5))
+
+ANALYSIS_RESPONSE = {
+    "fruit_name": "Apple",
+    "freshness_level": 8,
+    "freshness_state": "Fresh",
+    "visual_indicators": "Bright red skin, firm texture, no visible blemishes",
+    "should_buy": True,
+    "best_use": "Eat now",
+    "shelf_life_days": 7,
+    "calories": 95,
+    "nutrition_highlights": "Fiber, vitamin C, potassium",
+    "health_benefits": "Supports digestion and heart health",
+    "purchase_recommendation": "Buy - crisp and fresh",
+    "storage_method": "Refrigerate in the crisper drawer",
+    "food_pun": "This one is the apple of your eye!",
+    "confidence": 0.9
+}
+
+RECIPE_RESPONSE = {
+    "recipes": [
+        {
+            "name": f"Benchmark Recipe {index}",
+            "description": "A quick recipe using the selected foods",
+            "ingredients": [
+                {"item": "Apple", "amount": "2", "notes": "Sliced"},
+                {"item": "Banana", "amount": "1", "notes": "Mashed"}
+            ],
+            "instructions": ["Prepare the fruit", "Combine", "Serve"],
+            "cooking_time": "10 minutes",
+            "difficulty": "Easy",
+            "calories_per_serving": 250,
+            "servings": 2,
+            "tips": "Use the ripest fruit first",
+            "why_this_recipe": "Uses the ingredients closest to spoiling"
+        }
+        for index in range(1, 4)
+    ],
+    "summary": {
+        "total_calories": 750,
+        "nutrition_benefits": "Fiber and vitamins",
+        "freshness_considerations": "Use the banana today"
+    }
+}
+
+COMPARISON_RESPONSE = {
+    "ranking": [
+        {"image": 1, "fruit_name": "Apple", "score": 8, "reason": "Firm with bright, even color"},
+        {"image": 2, "fruit_name": "Apple", "score": 6, "reason": "A few soft spots near the stem"}
+    ],
+    "summary": "The brighter apple is the better pick, it is firmer and fresher."
+}
+
+AUDIO_SCRIPT_RESPONSE = "Great news, this apple is fresh and ready to eat. It has about 95 calories and plenty of fiber."
+TRANSCRIPTION_RESPONSE = "analyze this apple"
+
+def parse_latency(spec):
+    """Return sampler(rng) -> seconds for a latency spec like 'lognormal:1.0,0.4'"""
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',') if value.strip()]
+    kind = kind.strip().lower()
+
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == 'normal' and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal' and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+def silent_wav(seconds):
+    """WAV bytes of silence, sized like a real clip of this length"""
+    output = io.BytesIO()
+    with wave.open(output, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(24000)
+        wav_file.writeframes(b'\x00\x00' * int(24000 * seconds))
+    return output.getvalue()
+
+class FakeGroqServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, chat_latency, tts_latency, whisper_latency, error_rate=0.0, seed=None,
+                 rate_limit_rate=0.0, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(address, FakeGroqHandler)
+        self.latency = {
+            'chat': parse_latency(chat_latency),
+            'tts': parse_latency(tts_latency),
+            'whisper': parse_latency(whisper_latency),
+        }
+        self.config = {
+            'chat_latency': chat_latency,
+            'tts_latency': tts_latency,
+            'whisper_latency': whisper_latency,
+            'error_rate': error_rate,
+            'rate_limit_rate': rate_limit_rate,
+            'retry_after': retry_after,
+            'seed': seed,
+        }
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {'chat': 0, 'chat_stream': 0, 'tts': 0, 'whisper': 0, 'errors': 0, 'rate_limited': 0}
+
+    def sample(self, kind):
+        """Draw a latency and how this call fails: None, 'error' (503) or 'rate_limit' (429)"""
+        with self._lock:
+            latency, draw = self.latency[kind](self._rng), self._rng.random()
+        if draw < self.error_rate:
+            return latency, 'error'
+        if draw < self.error_rate + self.rate_limit_rate:
+            return latency, 'rate_limit'
+        return latency, None
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_upstream_error(self, failure):
+        if failure == 'rate_limit':
+            self.server.count('rate_limited')
+            return self._send(429, {'error': {'message': 'Rate limit reached (fake)', 'type': 'rate_limit_exceeded'}},
+                              headers={'retry-after-ms': str(int(self.server.retry_after * 1000))})
+        self.server.count('errors')
+        self._send(503, {'error': {'message': 'Service unavailable (fake)', 'type': 'service_unavailable'}})
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, {'counts': self.server.counts, 'config': self.server.config})
+        else:
+            self._send(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split('?')[0]
+
+        if path.endswith('/chat/completions'):
+            self._chat_completion(json.loads(body or b'{}'))
+        elif path.endswith('/audio/speech'):
+            self._speech(json.loads(body or b'{}'))
+        elif path.endswith('/audio/transcriptions'):
+            self._transcription(body)
+        else:
+            self._send(404, {'error': {'message': f'Unknown endpoint {path}'}})
+
+    def _chat_content(self, request):
+        """Return (canned reply, prompt text) for a chat request"""
+        messages = request.get('messages') or []
+        parts = []
+        for message in messages:
+            content = message.get('content')
+            if isinstance(content, list):
+                parts.extend(part.get('type', '') + ' ' + str(part.get('text', '')) for part in content)
+            else:
+                parts.append(str(content))
+        prompt = ' '.join(parts)
+
+        response_format = request.get('response_format') or {}
+        schema_name = (response_format.get('json_schema') or {}).get('name')
+        # Structured output replies are compact, prompt-only JSON tends to be pretty-printed
+        indent = None if response_format else 2
+
+        if schema_name == 'comparison' or 'Rank these' in prompt:
+            return json.dumps(COMPARISON_RESPONSE, indent=indent), prompt
+        if schema_name == 'food_analysis' or 'image_url' in prompt:
+            return json.dumps(ANALYSIS_RESPONSE, indent=indent), prompt
+        if schema_name == 'recipes' or 'recipes' in prompt.lower():
+            return json.dumps(RECIPE_RESPONSE, indent=indent), prompt
+        return AUDIO_SCRIPT_RESPONSE, prompt
+
+    def _chat_completion(self, request):
+        latency, fail = self.server.sample('chat')
+        content, prompt = self._chat_content(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = request.get('model', 'fake-model')
+        # About four characters per token
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(content) // 4)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+
+        if not request.get('stream'):
+            time.sleep(latency)
+            if fail:
+                return self._send_upstream_error(fail)
+            self.server.count('chat')
+            return self._send(200, {
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop'
+                }],
+                'usage': usage
+            })
+
+        # Time to first token is a fifth of the latency, the rest is spread over the chunks
+        time.sleep(latency * 0.2)
+        if fail:
+            return self._send_upstream_error(fail)
+        self.server.count('chat_stream')
+
+        pieces = re.findall(r'.{1,24}', content, re.DOTALL)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write_event(payload):
+            data = f"data: {payload}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for piece in pieces:
+                time.sleep(latency * 0.8 / len(pieces))
+                write_event(json.dumps({
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]
+                }))
+            write_event(json.dumps({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+                'x_groq': {'usage': usage}
+            }))
+            write_event('[DONE]')
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-stream
+            self.close_connection = True
+
+    def _speech(self, request):
+        latency, fail = self.server.sample('tts')
+        time.sleep(latency)
+        if fail:
+            return self._send_upstream_error(fail)
+        self.server.count('tts')
+        # Roughly 15 characters of speech per second
+        seconds = min(30.0, max(0.5, len(request.get('input', '')) / 15))
+        self._send(200, silent_wav(seconds), 'audio/wav')
+
+    def _transcription(self, body):
+        latency, fail = self.server.sample('whisper')
+        time.sleep(latency)
+        if fail:
+            return self._send_upstream_error(fail)
+        self.server.count('whisper')
+        if b'name="response_format"\r\n\r\ntext' in body:
+            self._send(200, TRANSCRIPTION_RESPONSE, 'text/plain')
+        else:
+            self._send(200, {'text': TRANSCRIPTION_RESPONSE})
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Groq API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--chat-latency', default=DEFAULT_CHAT_LATENCY)
+    parser.add_argument('--tts-latency', default=DEFAULT_TTS_LATENCY)
+    parser.add_argument('--whisper-latency', default=DEFAULT_WHISPER_LATENCY)
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_ERROR_RATE, help='fraction of calls that return 503')
+    parser.add_argument('--rate-limit-rate', type=float, default=DEFAULT_RATE_LIMIT_RATE,
+                        help='fraction of calls that return 429 with a retry-after')
+    parser.add_argument('--retry-after', type=float, default=DEFAULT_RETRY_AFTER, help='retry-after of 429 responses, in seconds')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeGroqServer(
+        (args.host, args.port), args.chat_latency, args.tts_latency, args.whisper_latency,
+        error_rate=args.error_rate, seed=args.seed, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after
+    )
+    print(f"🧪 Fake Groq API listening on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
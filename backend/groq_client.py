@@ -0,0 +1,133 @@
+"""
+Shared Groq client for SnackOverflow
+One client per API key per process, so every call reuses the same HTTP
+connection pool (keep-alive, TLS sessions, HTTP/2 where available).
+"""
+
+import importlib.util
+import json
+import os
+import threading
+import httpx
+from groq import Groq, AsyncGroq
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Models used across the app
+VISION_MODEL = "meta-llama/llama-4-maverick-17b-128e-instruct"
+# Smaller vision model tried first when tiered routing is on (see api.VISION_ROUTING)
+VISION_FAST_MODEL = os.getenv('VISION_FAST_MODEL', "meta-llama/llama-4-scout-17b-16e-instruct")
+SCRIPT_MODEL = "llama-3.1-8b-instant"
+TTS_MODEL = "playai-tts"
+TRANSCRIPTION_MODEL = "whisper-large-v3-turbo"
+
+# What each model is used for. Per-model settings are keyed by role, so they stay
+# distinct when two roles share a model (e.g. VISION_FAST_MODEL=VISION_MODEL)
+MODEL_ROLES = {
+    'vision': VISION_MODEL,
+    'vision_fast': VISION_FAST_MODEL,
+    'script': SCRIPT_MODEL,
+    'tts': TTS_MODEL,
+    'transcription': TRANSCRIPTION_MODEL,
+}
+
+# HTTP connection pool settings
+GROQ_MAX_CONNECTIONS = int(os.getenv('GROQ_MAX_CONNECTIONS', 100))
+GROQ_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('GROQ_MAX_KEEPALIVE_CONNECTIONS', 20))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv('GROQ_KEEPALIVE_EXPIRY', 60))
+GROQ_CONNECT_TIMEOUT = float(os.getenv('GROQ_CONNECT_TIMEOUT', 5))
+# Applied by the upstream scheduler (upstream.py); the SDK itself doesn't retry
+GROQ_MAX_RETRIES = int(os.getenv('GROQ_MAX_RETRIES', 2))
+# HTTP/2 needs the optional h2 package; 'auto' enables it when installed
+GROQ_HTTP2 = os.getenv('GROQ_HTTP2', 'auto').lower()
+
+# Per-role request timeouts in seconds
+DEFAULT_TIMEOUT = float(os.getenv('GROQ_DEFAULT_TIMEOUT', 60))
+ROLE_TIMEOUTS = {
+    'vision': float(os.getenv('GROQ_VISION_TIMEOUT', 45)),
+    'vision_fast': float(os.getenv('GROQ_VISION_FAST_TIMEOUT', 20)),
+    'script': float(os.getenv('GROQ_SCRIPT_TIMEOUT', 10)),
+    'tts': float(os.getenv('GROQ_TTS_TIMEOUT', 30)),
+    'transcription': float(os.getenv('GROQ_TRANSCRIPTION_TIMEOUT', 20)),
+}
+
+# USD per million (prompt, completion) tokens, for cost accounting; GROQ_MODEL_PRICES
+# (JSON, e.g. {"model": [0.2, 0.6]}) adds or overrides entries
+MODEL_PRICES = {
+    VISION_MODEL: (0.20, 0.60),
+    "meta-llama/llama-4-scout-17b-16e-instruct": (0.11, 0.34),
+    SCRIPT_MODEL: (0.05, 0.08),
+}
+MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv('GROQ_MODEL_PRICES') or '{}').items()})
+
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+def http2_enabled():
+    """Whether to negotiate HTTP/2 with the Groq API"""
+    if GROQ_HTTP2 == 'auto':
+        return importlib.util.find_spec('h2') is not None
+    return GROQ_HTTP2 in ('1', 'true', 'yes')
+
+def _connection_limits():
+    return httpx.Limits(
+        max_connections=GROQ_MAX_CONNECTIONS,
+        max_keepalive_connections=GROQ_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+    )
+
+def get_groq_client(api_key=None):
+    """Return the process-wide Groq client for this API key"""
+    api_key = api_key or os.getenv('GROQ_API_KEY')
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                http_client = httpx.Client(
+                    limits=_connection_limits(),
+                    http2=http2_enabled(),
+                    timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+                )
+                client = Groq(api_key=api_key, http_client=http_client, max_retries=0)
+                _clients[api_key] = client
+    return client
+
+def get_async_groq_client(api_key=None):
+    """Return the process-wide AsyncGroq client for this API key
+
+    The underlying httpx.AsyncClient belongs to the event loop that first uses
+    it, so call this from the serving loop (one per worker process).
+    """
+    api_key = api_key or os.getenv('GROQ_API_KEY')
+    client = _async_clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _async_clients.get(api_key)
+            if client is None:
+                http_client = httpx.AsyncClient(
+                    limits=_connection_limits(),
+                    http2=http2_enabled(),
+                    timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+                )
+                client = AsyncGroq(api_key=api_key, http_client=http_client, max_retries=0)
+                _async_clients[api_key] = client
+    return client
+
+def model_cost(model, prompt_tokens, completion_tokens):
+    """USD cost of a chat call, or None for models without a token price"""
+    price = MODEL_PRICES.get(model)
+    if price is None:
+        return None
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+def model_role(model):
+    """The role a model is used for, or None; a model with several roles gets the first (vision before vision_fast)"""
+    return next((role for role, role_model in MODEL_ROLES.items() if role_model == model), None)
+
+def model_timeout(model):
+    """Request timeout for a model (its role's), for the per-call `timeout=` argument"""
+    return httpx.Timeout(ROLE_TIMEOUTS.get(model_role(model), DEFAULT_TIMEOUT), connect=GROQ_CONNECT_TIMEOUT)
@@ -0,0 +1,229 @@
+"""
+Image processing helpers for SnackOverflow
+Pillow is optional: without it, callers fall back to the original image bytes.
+"""
+
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+from image_store import guess_content_type
+from structured_log import get_logger
+
+try:
+    from PIL import Image, ImageFilter, ImageOps, ImageStat
+except ImportError:  # Pillow not installed
+    Image = None
+    ImageFilter = None
+    ImageOps = None
+    ImageStat = None
+
+# Load environment variables
+load_dotenv()
+
+log = get_logger('image_processing')
+
+THUMBNAIL_MAX_EDGE = int(os.getenv('THUMBNAIL_MAX_EDGE', 320))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', 75))
+
+# Downscaling/re-encoding applied before images are sent to the vision model
+VISION_PREPROCESS_ENABLED = os.getenv('VISION_PREPROCESS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+VISION_MAX_EDGE = int(os.getenv('VISION_MAX_EDGE', 1024))
+VISION_IMAGE_FORMAT = os.getenv('VISION_IMAGE_FORMAT', 'jpeg').upper()
+VISION_IMAGE_QUALITY = int(os.getenv('VISION_IMAGE_QUALITY', 85))
+VISION_PREPROCESS_WORKERS = int(os.getenv('VISION_PREPROCESS_WORKERS', os.cpu_count() or 4))
+
+VISION_CONTENT_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp'}
+
+# Local pre-filter that turns away shots the model can't assess (blank, blurred,
+# not a camera photo, or colourless) before any model call; each threshold can be
+# set to 0 to skip that check
+PREFILTER_ENABLED = os.getenv('PREFILTER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PREFILTER_MAX_EDGE = int(os.getenv('PREFILTER_MAX_EDGE', 256))
+PREFILTER_MIN_CONTRAST = float(os.getenv('PREFILTER_MIN_CONTRAST', 8))       # grey-level standard deviation
+PREFILTER_MIN_SHARPNESS = float(os.getenv('PREFILTER_MIN_SHARPNESS', 20))    # variance of the Laplacian
+PREFILTER_MIN_COLORS = int(os.getenv('PREFILTER_MIN_COLORS', 256))           # distinct colours at PREFILTER_MAX_EDGE
+PREFILTER_MIN_SATURATION = float(os.getenv('PREFILTER_MIN_SATURATION', 0))    # mean HSV saturation, 0-255; opt-in, pale foods fail it
+
+# Laplacian edge kernel; offset keeps negative responses inside the 8-bit range
+_LAPLACIAN = (0, 1, 0, 1, -4, 1, 0, 1, 0)
+
+# Image store variant name for a stored image's preprocessed copy (changes with the settings)
+VISION_VARIANT = f"vision-{VISION_MAX_EDGE}-{VISION_IMAGE_FORMAT.lower()}-{VISION_IMAGE_QUALITY}"
+
+# Pillow releases the GIL while decoding and resizing, so a small shared pool
+# keeps the work parallel while bounding how many full-size photos are in memory
+_preprocess_executor = ThreadPoolExecutor(max_workers=VISION_PREPROCESS_WORKERS, thread_name_prefix='vision-preprocess')
+_preprocess_stats_lock = threading.Lock()
+_preprocess_stats = {'images': 0, 'skipped': 0, 'original_bytes': 0, 'processed_bytes': 0}
+
+def pillow_available():
+    """Whether Pillow is installed"""
+    return Image is not None
+
+def create_thumbnail(image_bytes, max_edge=THUMBNAIL_MAX_EDGE, quality=THUMBNAIL_QUALITY):
+    """Downscale an image to fit max_edge and re-encode as JPEG, or None if not possible"""
+    if Image is None:
+        return None
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_edge, max_edge))
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=quality, optimize=True)
+            return output.getvalue()
+
+    except Exception as e:
+        log.error("Error creating thumbnail", error=str(e))
+        return None
+
+def _preprocess_for_vision(image_bytes, max_edge, image_format, quality):
+    original_size = len(image_bytes)
+    processed = None
+
+    if VISION_PREPROCESS_ENABLED and Image is not None and image_format in VISION_CONTENT_TYPES:
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as image:
+                # Let the JPEG decoder skip detail we are about to throw away
+                image.draft('RGB', (max_edge, max_edge))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((max_edge, max_edge))
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+
+                output = io.BytesIO()
+                image.save(output, format=image_format, quality=quality)
+                processed = output.getvalue()
+
+        except Exception as e:
+            log.warning("Error preprocessing image, sending original", error=str(e))
+
+    with _preprocess_stats_lock:
+        _preprocess_stats['images'] += 1
+        _preprocess_stats['original_bytes'] += original_size
+
+        # Keep the original when re-encoding didn't make it smaller
+        if processed is None or len(processed) >= original_size:
+            _preprocess_stats['skipped'] += 1
+            _preprocess_stats['processed_bytes'] += original_size
+            return image_bytes, guess_content_type(image_bytes)
+
+        _preprocess_stats['processed_bytes'] += len(processed)
+
+    log.debug("Vision image preprocessed", original_bytes=original_size, processed_bytes=len(processed),
+              format=image_format, max_edge=max_edge)
+    return processed, VISION_CONTENT_TYPES[image_format]
+
+def submit_preprocess_for_vision(image_bytes, max_edge=VISION_MAX_EDGE, image_format=VISION_IMAGE_FORMAT,
+                                 quality=VISION_IMAGE_QUALITY):
+    """Schedule preprocess_for_vision on the shared pool; returns a Future"""
+    return _preprocess_executor.submit(_preprocess_for_vision, image_bytes, max_edge, image_format, quality)
+
+def preprocess_for_vision(image_bytes, max_edge=VISION_MAX_EDGE, image_format=VISION_IMAGE_FORMAT,
+                          quality=VISION_IMAGE_QUALITY):
+    """Orient, downscale and re-encode an image for the vision model
+
+    Returns (image_bytes, content_type). The original bytes come back unchanged,
+    with their sniffed content type, if Pillow is missing, preprocessing is
+    disabled, or re-encoding would not make the image smaller.
+    """
+    return submit_preprocess_for_vision(image_bytes, max_edge, image_format, quality).result()
+
+def get_preprocess_stats():
+    """Counts and total before/after bytes for images sent to the vision model"""
+    with _preprocess_stats_lock:
+        stats = dict(_preprocess_stats)
+    stats['saved_bytes'] = stats['original_bytes'] - stats['processed_bytes']
+    stats['enabled'] = VISION_PREPROCESS_ENABLED and Image is not None
+    stats['max_edge'] = VISION_MAX_EDGE
+    stats['format'] = VISION_IMAGE_FORMAT
+    stats['quality'] = VISION_IMAGE_QUALITY
+    stats['prefilter'] = PREFILTER_ENABLED and Image is not None
+    return stats
+
+def compute_dhash(image_bytes, hash_size=8):
+    """Perceptual difference hash (dHash) as a 64-bit int, or None if not possible
+
+    Near-identical photos (re-shot, recompressed, slightly shifted) end up a
+    small Hamming distance apart.
+    """
+    if Image is None:
+        return None
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Decode at reduced size where the format allows it
+            image.draft('L', (hash_size * 8, hash_size * 8))
+            image = ImageOps.exif_transpose(image)
+            pixels = list(image.convert('L').resize((hash_size + 1, hash_size)).getdata())
+
+        value = 0
+        for row in range(hash_size):
+            for col in range(hash_size):
+                left = pixels[row * (hash_size + 1) + col]
+                right = pixels[row * (hash_size + 1) + col + 1]
+                value = (value << 1) | (1 if left > right else 0)
+        return value
+
+    except Exception as e:
+        log.error("Error computing perceptual hash", error=str(e))
+        return None
+
+def hamming_distance(hash1, hash2):
+    """Number of differing bits between two perceptual hashes"""
+    return bin(hash1 ^ hash2).count('1')
+
+def _prefilter_image(image_bytes, max_edge):
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft('RGB', (max_edge, max_edge))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_edge, max_edge))
+            image = image.convert('RGB')
+
+        gray = image.convert('L')
+        if PREFILTER_MIN_CONTRAST and ImageStat.Stat(gray).stddev[0] < PREFILTER_MIN_CONTRAST:
+            return 'blank'
+
+        if PREFILTER_MIN_SHARPNESS:
+            edges = gray.filter(ImageFilter.Kernel((3, 3), _LAPLACIAN, scale=1, offset=128))
+            # The kernel leaves the 1px border unfiltered
+            edges = edges.crop((1, 1, edges.width - 1, edges.height - 1))
+            if ImageStat.Stat(edges).var[0] < PREFILTER_MIN_SHARPNESS:
+                return 'blurry'
+
+        # Camera noise and shading give even a plain white food thousands of
+        # distinct colours; screenshots, documents and drawings have a few flat fills
+        if PREFILTER_MIN_COLORS and image.getcolors(PREFILTER_MIN_COLORS) is not None:
+            return 'graphic'
+
+        if PREFILTER_MIN_SATURATION and ImageStat.Stat(image.convert('HSV').getchannel('S')).mean[0] < PREFILTER_MIN_SATURATION:
+            return 'colorless'
+
+        return None
+
+    except Exception as e:
+        log.warning("Error pre-filtering image, sending it to the model", error=str(e))
+        return None
+
+def submit_prefilter_image(image_bytes, max_edge=PREFILTER_MAX_EDGE):
+    """Schedule prefilter_image on the shared preprocessing pool; returns a Future"""
+    if not PREFILTER_ENABLED or Image is None:
+        future = Future()
+        future.set_result(None)
+        return future
+    return _preprocess_executor.submit(_prefilter_image, image_bytes, max_edge)
+
+def prefilter_image(image_bytes, max_edge=PREFILTER_MAX_EDGE):
+    """Why an image can't show a food the model could assess ('blank', 'blurry', 'graphic', 'colorless'), or None
+
+    Uses cheap whole-image statistics on a small copy, so it takes a few
+    milliseconds. Always None when the pre-filter is disabled, Pillow is
+    missing or the image can't be decoded.
+    """
+    return submit_prefilter_image(image_bytes, max_edge).result()
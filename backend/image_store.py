@@ -0,0 +1,159 @@
+"""
+Content-addressed image storage for SnackOverflow
+Scan images are stored once, keyed by the SHA-256 of their bytes, either in a
+local directory or in a separate MySQL BLOB table. food_analyses only keeps the hash.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from mysql.connector import Error
+from dotenv import load_dotenv
+from database import get_database_connection
+from structured_log import get_logger
+
+# Load environment variables
+load_dotenv()
+
+log = get_logger('image_store')
+
+IMAGE_STORE_BACKEND = os.getenv('IMAGE_STORE_BACKEND', 'filesystem').lower()
+IMAGE_STORE_DIR = os.getenv(
+    'IMAGE_STORE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_store')
+)
+
+ORIGINAL = 'original'
+
+def hash_image(image_bytes):
+    """Return the SHA-256 hex digest used as the image key"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def guess_content_type(image_bytes):
+    """Sniff the image MIME type from its magic bytes"""
+    if image_bytes.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    if image_bytes[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    return 'application/octet-stream'
+
+class FilesystemImageStore:
+    """Stores images as files under <root>/<hash[:2]>/<hash>[.<variant>]"""
+
+    def __init__(self, root=IMAGE_STORE_DIR):
+        self.root = root
+
+    def _path(self, image_hash, variant=ORIGINAL):
+        filename = image_hash if variant == ORIGINAL else f"{image_hash}.{variant}"
+        return os.path.join(self.root, image_hash[:2], filename)
+
+    def put(self, image_hash, image_bytes, variant=ORIGINAL):
+        path = self._path(image_hash, variant)
+        if os.path.exists(path):
+            return
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file first so readers never see a partial image
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(image_bytes)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def get(self, image_hash, variant=ORIGINAL):
+        try:
+            with open(self._path(image_hash, variant), 'rb') as image_file:
+                return image_file.read()
+        except FileNotFoundError:
+            return None
+
+class MySQLImageStore:
+    """Stores images in the food_images BLOB table"""
+
+    def put(self, image_hash, image_bytes, variant=ORIGINAL):
+        connection = get_database_connection()
+        if not connection:
+            raise Error(msg="No database connection for image store")
+
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                INSERT IGNORE INTO food_images (sha256, variant, content_type, byte_size, data)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (image_hash, variant, guess_content_type(image_bytes), len(image_bytes), image_bytes)
+            )
+            connection.commit()
+        finally:
+            if cursor:
+                cursor.close()
+            connection.close()
+
+    def get(self, image_hash, variant=ORIGINAL):
+        connection = get_database_connection()
+        if not connection:
+            return None
+
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT data FROM food_images WHERE sha256 = %s AND variant = %s",
+                (image_hash, variant)
+            )
+            row = cursor.fetchone()
+            return bytes(row[0]) if row else None
+        finally:
+            if cursor:
+                cursor.close()
+            connection.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_image_store():
+    """Return the configured image store backend"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if IMAGE_STORE_BACKEND == 'mysql':
+                    _store = MySQLImageStore()
+                elif IMAGE_STORE_BACKEND == 'filesystem':
+                    _store = FilesystemImageStore()
+                else:
+                    raise ValueError(f"Unknown IMAGE_STORE_BACKEND: {IMAGE_STORE_BACKEND}")
+    return _store
+
+def save_image(image_bytes):
+    """Store image bytes and return their hash, or None on failure"""
+    if not image_bytes:
+        return None
+    try:
+        image_hash = hash_image(image_bytes)
+        get_image_store().put(image_hash, image_bytes)
+        return image_hash
+    except Exception as e:
+        log.error("Error storing image", error=str(e))
+        return None
+
+def load_image(image_hash, variant=ORIGINAL):
+    """Load image bytes by hash, or None if missing"""
+    if not image_hash:
+        return None
+    try:
+        return get_image_store().get(image_hash, variant)
+    except Exception as e:
+        log.error("Error loading image", image_hash=image_hash, error=str(e))
+        return None
@@ -0,0 +1,367 @@
+"""
+JSON helpers for model output
+Model responses are supposed to be a bare JSON object but often arrive
+wrapped in ```json fences, followed by prose, or cut off at max_tokens.
+extract_json() recovers the object in one scan, and Schema checks and
+normalizes its shape. orjson is used for decoding when installed.
+"""
+
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # orjson not installed, use the standard library
+    orjson = None
+
+def loads(text):
+    """Decode JSON with orjson when available; raises json.JSONDecodeError"""
+    if orjson is not None:
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        return orjson.loads(text)
+    return json.loads(text)
+
+# Characters that matter to the bracket scan; everything else is skipped in C
+_STRUCTURAL = re.compile(r'[{}\[\]",\\]')
+_CLOSERS = {'{': '}', '[': ']'}
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+def _scan_object(text, start):
+    """Scan the object opening at text[start]
+
+    Returns (end, None) when it closes at text[end - 1], or (None, repairs)
+    when the text ends first, where repairs are candidate completions
+    (most complete first) for the truncated object.
+    """
+    stack = []
+    in_string = False
+    skip_until = -1
+    # Last place the object could be cut and closed: (index, closers)
+    safe_point = (start + 1, '}')
+
+    for match in _STRUCTURAL.finditer(text, start):
+        pos = match.start()
+        if pos < skip_until:
+            continue
+        char = match.group()
+
+        if in_string:
+            if char == '\\':
+                skip_until = pos + 2
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            stack.append(char)
+            safe_point = (pos + 1, ''.join(_CLOSERS[opener] for opener in reversed(stack)))
+        elif char in '}]':
+            if not stack or _CLOSERS[stack[-1]] != char:
+                return pos + 1, None
+            stack.pop()
+            if not stack:
+                return pos + 1, None
+            safe_point = (pos + 1, ''.join(_CLOSERS[opener] for opener in reversed(stack)))
+        elif char == ',':
+            safe_point = (pos, ''.join(_CLOSERS[opener] for opener in reversed(stack)))
+
+    # Truncated: first try closing where the text stops, then at the last complete value
+    tail = text[start:].rstrip()
+    if in_string:
+        tail += '"'
+    tail = tail.rstrip(',:')
+    closers = ''.join(_CLOSERS[opener] for opener in reversed(stack))
+    index, safe_closers = safe_point
+    return None, [tail + closers, text[start:index] + safe_closers]
+
+def extract_json(text):
+    """Recover the first JSON object in a model response
+
+    Handles code fences, text before or after the object, and output that was
+    cut off mid-object (open strings and brackets are closed, a dangling key
+    is dropped) or with trailing commas. Returns (value, how) with how one of 'exact', 'extracted' or
+    'repaired'; raises json.JSONDecodeError if no object can be recovered.
+    """
+    text = text.strip()
+    if text.startswith('{') and text.endswith('}'):
+        try:
+            return loads(text), 'exact'
+        except json.JSONDecodeError:
+            pass
+
+    start = text.find('{')
+    while start != -1:
+        end, repairs = _scan_object(text, start)
+        if end is not None:
+            candidate = text[start:end]
+            try:
+                return loads(candidate), 'extracted'
+            except json.JSONDecodeError:
+                repairs = [_TRAILING_COMMA.sub(r'\1', candidate)]
+            # A failed candidate was braces in prose before the real object
+            if repairs[0] == candidate:
+                repairs = []
+
+        for candidate in repairs:
+            try:
+                return loads(candidate), 'repaired'
+            except json.JSONDecodeError:
+                pass
+        start = text.find('{', start + 1)
+
+    raise json.JSONDecodeError('No JSON object found', text, max(start, 0))
+
+class SchemaError(ValueError):
+    """A decoded model response does not have the expected shape"""
+
+def _coerce_int(value):
+    if isinstance(value, bool):
+        raise TypeError
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(float(str(value).strip()))
+
+def _coerce_number(value):
+    if isinstance(value, bool):
+        raise TypeError
+    if isinstance(value, (int, float)):
+        return value
+    return float(str(value).strip())
+
+def _coerce_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'yes', '1'):
+        return True
+    if isinstance(value, str) and value.strip().lower() in ('false', 'no', '0'):
+        return False
+    raise TypeError
+
+def _coerce_str(value):
+    if isinstance(value, (dict, list)):
+        raise TypeError
+    return str(value)
+
+_COERCERS = {
+    'int': _coerce_int,
+    'number': _coerce_number,
+    'bool': _coerce_bool,
+    'str': _coerce_str,
+}
+
+_JSON_TYPES = {'int': 'integer', 'number': 'number', 'bool': 'boolean', 'str': 'string'}
+
+# Rough output tokens per value when a field gives no max_tokens hint
+_VALUE_TOKENS = {'int': 3, 'number': 4, 'bool': 2, 'str': 16, 'any': 32}
+_DEFAULT_MAX_ITEMS = 3
+
+class Schema:
+    """Expected shape of a JSON object, compiled once into per-field checks
+
+    fields maps each name to (type, default) or (type, default, hints); type
+    is 'int', 'number', 'bool', 'str', 'any', a nested Schema, or a one-item
+    list [item_type] for arrays. Fields in `required` must be present and
+    valid, others fall back to their default. Values are coerced where
+    unambiguous ("8" -> 8) and unknown fields are kept as-is.
+
+    hints are JSON Schema keywords for the model (description, enum,
+    minimum, maxItems, ...) plus max_tokens, the output budget of the value.
+    """
+
+    def __init__(self, fields, required=()):
+        self.required = frozenset(required)
+        self.fields = {name: (spec + ({},))[:3] for name, spec in fields.items()}
+        self._checks = [(name, self._compile(kind), default) for name, (kind, default, _) in self.fields.items()]
+
+    @classmethod
+    def _compile(cls, kind):
+        if isinstance(kind, Schema):
+            return kind.validate
+        if isinstance(kind, list):
+            item_check = cls._compile(kind[0])
+
+            def check_list(value):
+                if not isinstance(value, list):
+                    raise TypeError
+                items = []
+                for item in value:
+                    try:
+                        items.append(item_check(item))
+                    except (TypeError, ValueError):
+                        continue
+                return items
+            return check_list
+        if kind == 'any':
+            return lambda value: value
+        return _COERCERS[kind]
+
+    @classmethod
+    def _json_type(cls, kind, nullable=False):
+        if isinstance(kind, Schema):
+            schema = kind.json_schema()
+        elif isinstance(kind, list):
+            schema = {'type': 'array', 'items': cls._json_type(kind[0])}
+        elif kind == 'any':
+            return {}
+        else:
+            schema = {'type': _JSON_TYPES[kind]}
+        if nullable:
+            schema['type'] = [schema['type'], 'null']
+        return schema
+
+    def json_schema(self):
+        """JSON Schema for the model's structured output mode (every field is asked for)"""
+        properties = {}
+        for name, (kind, default, hints) in self.fields.items():
+            prop = self._json_type(kind, nullable=default is None and name not in self.required)
+            prop.update((key, value) for key, value in hints.items() if key != 'max_tokens')
+            properties[name] = prop
+        return {
+            'type': 'object',
+            'properties': properties,
+            'required': list(self.fields),
+            'additionalProperties': False,
+        }
+
+    @classmethod
+    def _value_tokens(cls, kind, hints):
+        if 'max_tokens' in hints:
+            return hints['max_tokens']
+        if isinstance(kind, Schema):
+            return kind.token_budget()
+        if isinstance(kind, list):
+            return 2 + hints.get('maxItems', _DEFAULT_MAX_ITEMS) * (cls._value_tokens(kind[0], {}) + 1)
+        return _VALUE_TOKENS[kind]
+
+    def token_budget(self):
+        """Estimated output tokens of a complete object, for sizing max_tokens"""
+        # Braces, plus each quoted key, colon and comma
+        return 2 + sum(
+            len(name) // 4 + 4 + self._value_tokens(kind, hints)
+            for name, (kind, _, hints) in self.fields.items()
+        )
+
+    def validate(self, value):
+        """Return a normalized copy of value; raises SchemaError if a required field is unusable"""
+        if not isinstance(value, dict):
+            raise SchemaError(f"Expected an object, got {type(value).__name__}")
+
+        result = dict(value)
+        for name, check, default in self._checks:
+            if result.get(name) is None:
+                if name in self.required:
+                    raise SchemaError(f"Missing required field '{name}'")
+                result[name] = default
+                continue
+            try:
+                result[name] = check(result[name])
+            except (TypeError, ValueError) as e:
+                if name in self.required:
+                    raise SchemaError(f"Invalid value for '{name}': {e}")
+                result[name] = default
+        return result
+
+class StreamingJSONFieldParser:
+    """Incrementally parses a streamed JSON object and yields top-level fields as they complete
+
+    Feed it text deltas as they arrive from the model; feed() returns the
+    (key, value) pairs that became complete with that chunk. Text before the
+    opening brace (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'seek_object'
+        self._key_start = 0
+        self._key = None
+        self._value_start = 0
+        self._nesting = 0
+        self._in_string = False
+        self._escaped = False
+        self.done = False
+
+    def feed(self, chunk):
+        """Add a text chunk; return newly completed (key, value) pairs"""
+        self._buffer += chunk
+        fields = []
+        buffer = self._buffer
+
+        while self._pos < len(buffer) and not self.done:
+            char = buffer[self._pos]
+            state = self._state
+
+            if state == 'seek_object':
+                if char == '{':
+                    self._state = 'seek_key'
+
+            elif state == 'seek_key':
+                if char == '"':
+                    self._key_start = self._pos + 1
+                    self._escaped = False
+                    self._state = 'key'
+                elif char == '}':
+                    self.done = True
+
+            elif state == 'key':
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._key = loads(buffer[self._key_start - 1:self._pos + 1])
+                    self._state = 'seek_colon'
+
+            elif state == 'seek_colon':
+                if char == ':':
+                    self._state = 'seek_value'
+
+            elif state == 'seek_value':
+                if not char.isspace():
+                    self._value_start = self._pos
+                    self._nesting = 0
+                    self._in_string = False
+                    self._escaped = False
+                    self._state = 'value'
+                    # Re-process this character as part of the value
+                    continue
+
+            elif state == 'value':
+                if self._in_string:
+                    if self._escaped:
+                        self._escaped = False
+                    elif char == '\\':
+                        self._escaped = True
+                    elif char == '"':
+                        self._in_string = False
+                        if self._nesting == 0:
+                            self._emit(fields, self._pos + 1)
+                elif char == '"':
+                    self._in_string = True
+                elif char in '{[':
+                    self._nesting += 1
+                elif char in '}]':
+                    if self._nesting == 0:
+                        # Closing brace of the top-level object ends a scalar value
+                        self._emit(fields, self._pos)
+                        self.done = True
+                    else:
+                        self._nesting -= 1
+                        if self._nesting == 0:
+                            self._emit(fields, self._pos + 1)
+                elif char == ',' and self._nesting == 0:
+                    self._emit(fields, self._pos)
+
+            self._pos += 1
+
+        return fields
+
+    def _emit(self, fields, end):
+        raw_value = self._buffer[self._value_start:end].strip()
+        self._state = 'seek_key'
+        try:
+            fields.append((self._key, loads(raw_value)))
+        except json.JSONDecodeError:
+            pass
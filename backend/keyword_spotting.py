@@ -0,0 +1,123 @@
+"""
+Local keyword spotting for SnackOverflow voice commands
+Short clips are decoded to 16 kHz mono PCM and run through a Vosk recognizer
+restricted to the known command phrases, so a recognized command needs no
+Whisper call. Anything else (unknown words, low confidence, long clips,
+audio that can't be decoded) returns None and the caller falls back to
+Whisper. vosk is optional: without it, or without VOSK_MODEL_PATH, every clip
+falls back. Formats other than 16-bit mono WAV are decoded with ffmpeg.
+"""
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import threading
+import wave
+from dotenv import load_dotenv
+from structured_log import get_logger
+
+try:
+    import vosk
+except ImportError:  # vosk not installed
+    vosk = None
+
+# Load environment variables
+load_dotenv()
+
+log = get_logger('keyword_spotting')
+
+VOICE_KWS_ENABLED = os.getenv('VOICE_KWS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+VOSK_MODEL_PATH = os.getenv('VOSK_MODEL_PATH', '')
+VOICE_KWS_MIN_CONFIDENCE = float(os.getenv('VOICE_KWS_MIN_CONFIDENCE', 0.85))  # mean per-word confidence
+VOICE_KWS_MAX_SECONDS = float(os.getenv('VOICE_KWS_MAX_SECONDS', 4))  # longer clips go straight to Whisper
+VOICE_KWS_DECODE_TIMEOUT = float(os.getenv('VOICE_KWS_DECODE_TIMEOUT', 2))
+
+SAMPLE_RATE = 16000
+
+# Grammar token for speech outside the phrase list
+UNKNOWN_WORD = '[unk]'
+
+_model = None
+_model_failed = False
+_model_lock = threading.Lock()
+
+def keyword_spotting_available():
+    """Whether local keyword spotting is enabled and can run"""
+    return VOICE_KWS_ENABLED and vosk is not None and bool(VOSK_MODEL_PATH) and not _model_failed
+
+def _get_model():
+    """Load the Vosk model once per process (shared by all recognizers), or None if it can't be loaded
+
+    A failed load is not retried: keyword spotting turns itself off until restart.
+    """
+    global _model, _model_failed
+    if _model is None and not _model_failed:
+        with _model_lock:
+            if _model is None and not _model_failed:
+                try:
+                    vosk.SetLogLevel(-1)
+                    _model = vosk.Model(VOSK_MODEL_PATH)
+                except Exception as e:
+                    _model_failed = True
+                    log.error("Error loading Vosk model, keyword spotting disabled", path=VOSK_MODEL_PATH, error=str(e))
+    return _model
+
+def decode_pcm(audio_bytes):
+    """Return (16-bit mono PCM bytes, sample rate) for a recording, or None if it can't be decoded"""
+    try:
+        with wave.open(io.BytesIO(audio_bytes)) as clip:
+            if clip.getnchannels() == 1 and clip.getsampwidth() == 2:
+                return clip.readframes(clip.getnframes()), clip.getframerate()
+    except (wave.Error, EOFError):
+        pass  # not a plain PCM WAV (browsers usually send WebM/Opus)
+
+    if shutil.which('ffmpeg') is None:
+        return None
+    try:
+        decoded = subprocess.run(
+            ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', 'pipe:0',
+             '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', 'pipe:1'],
+            input=audio_bytes, capture_output=True, timeout=VOICE_KWS_DECODE_TIMEOUT, check=True
+        )
+        return decoded.stdout, SAMPLE_RATE
+    except (subprocess.SubprocessError, OSError) as e:
+        log.warning("Error decoding audio for keyword spotting", error=str(e))
+        return None
+
+def spot_keywords(audio_bytes, phrases):
+    """The command phrase spoken in a short clip, or None if it isn't confidently one of `phrases`"""
+    if not keyword_spotting_available():
+        return None
+
+    model = _get_model()
+    if model is None:
+        return None
+
+    decoded = decode_pcm(audio_bytes)
+    if decoded is None:
+        return None
+    pcm, sample_rate = decoded
+    if not pcm or len(pcm) / (2 * sample_rate) > VOICE_KWS_MAX_SECONDS:
+        return None
+
+    try:
+        recognizer = vosk.KaldiRecognizer(model, sample_rate, json.dumps(list(phrases) + [UNKNOWN_WORD]))
+        recognizer.SetWords(True)
+        recognizer.AcceptWaveform(pcm)
+        result = json.loads(recognizer.FinalResult())
+    except Exception as e:
+        log.error("Error spotting keywords", error=str(e))
+        return None
+
+    text = result.get('text', '').strip()
+    words = result.get('result', [])
+    if not text or UNKNOWN_WORD in text or not words:
+        return None
+
+    confidence = sum(word.get('conf', 0) for word in words) / len(words)
+    if confidence < VOICE_KWS_MIN_CONFIDENCE:
+        log.debug("Keyword below confidence threshold", text=text, confidence=round(confidence, 3))
+        return None
+    return text
@@ -1,6 +1,8 @@
 import base64
 import os
-from groq import Groq
+from groq_client import get_groq_client, model_timeout, VISION_MODEL, SCRIPT_MODEL, TTS_MODEL
+from image_processing import preprocess_for_vision
+from upstream import call_upstream
 import argparse
 from dotenv import load_dotenv
 import subprocess
@@ -10,28 +12,30 @@ import platform
 load_dotenv()
 
 def encode_image_to_base64(image_path):
-    """Convert image file to base64 string"""
+    """Convert image file to a downscaled base64 string; returns (base64_image, content_type)"""
     try:
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            image_bytes, content_type = preprocess_for_vision(image_file.read())
+            return base64.b64encode(image_bytes).decode('utf-8'), content_type
     except Exception as e:
         print(f"Error reading image: {e}")
-        return None
+        return None, None
 
 def analyze_nutrition_with_groq(image_path, groq_api_key):
     """Analyze image for nutritional information using Groq"""
     
-    # Initialize Groq client
-    client = Groq(api_key=groq_api_key)
+    # Shared Groq client (reuses pooled HTTP connections)
+    client = get_groq_client(groq_api_key)
     
     # Convert image to base64
-    base64_image = encode_image_to_base64(image_path)
+    base64_image, content_type = encode_image_to_base64(image_path)
     if not base64_image:
         return None
     
     try:
         # Create chat completion with vision
-        chat_completion = client.chat.completions.create(
+        chat_completion = call_upstream(
+            VISION_MODEL, client.chat.completions.create,
             messages=[
                 {
                     "role": "user",
@@ -51,15 +55,16 @@ Keep it very brief for audio output."""
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
+                                "url": f"data:{content_type};base64,{base64_image}"
                             }
                         }
                     ]
                 }
             ],
-            model="meta-llama/llama-4-maverick-17b-128e-instruct",
+            model=VISION_MODEL,
             temperature=0.1,
             max_tokens=150,
+            timeout=model_timeout(VISION_MODEL),
         )
         
         return chat_completion.choices[0].message.content
@@ -126,11 +131,12 @@ def play_audio_file(file_path):
 def create_natural_audio_script(produce_name, nutrition_info, should_buy, groq_api_key):
     """Use Groq to create a natural, conversational audio script"""
     
-    client = Groq(api_key=groq_api_key)
+    client = get_groq_client(groq_api_key)
     
     try:
         # Use Groq to restructure the information into a natural sentence
-        response = client.chat.completions.create(
+        response = call_upstream(
+            SCRIPT_MODEL, client.chat.completions.create,
             messages=[
                 {
                     "role": "user",
@@ -147,9 +153,10 @@ Create a conversational sentence that sounds like a helpful friend giving advice
 Keep it under 25 words and make it sound natural for speech."""
                 }
             ],
-            model="llama-3.1-8b-instant",
+            model=SCRIPT_MODEL,
             temperature=0.3,
-            max_tokens=100
+            max_tokens=100,
+            timeout=model_timeout(SCRIPT_MODEL)
         )
         
         natural_script = response.choices[0].message.content.strip()
@@ -164,8 +171,8 @@ Keep it under 25 words and make it sound natural for speech."""
         # Fallback to simple format
         return f"This looks like {produce_name}. {nutrition_info}. {should_buy}"
 
-def create_audio_summary(produce_name, nutrition_info, should_buy, groq_api_key):
-    """Generate audio summary using Groq PlayAI TTS"""
+def create_audio_summary(produce_name, nutrition_info, should_buy, groq_api_key, play=False):
+    """Generate audio summary using Groq PlayAI TTS; plays it only when play is set"""
     
     # Create natural-sounding script using another API call
     print("🤖 Creating natural audio script...")
@@ -174,16 +181,18 @@ def create_audio_summary(produce_name, nutrition_info, should_buy, groq_api_key)
     print(f"\n🔊 AUDIO SUMMARY:")
     print(f"Text: {summary_text}")
     
-    # Initialize Groq client for TTS
-    client = Groq(api_key=groq_api_key)
+    # Shared Groq client for TTS
+    client = get_groq_client(groq_api_key)
     
     try:
         # Generate speech using Groq's PlayAI TTS
-        response = client.audio.speech.create(
-            model="playai-tts",
+        response = call_upstream(
+            TTS_MODEL, client.audio.speech.create,
+            model=TTS_MODEL,
             voice="Celeste-PlayAI",
             input=summary_text,
-            response_format="wav"
+            response_format="wav",
+            timeout=model_timeout(TTS_MODEL)
         )
         
         # Save audio file
@@ -192,10 +201,13 @@ def create_audio_summary(produce_name, nutrition_info, should_buy, groq_api_key)
         
         print(f"🎵 Audio saved as: {speech_file_path}")
         
-        # Play the audio file
-        print("🔊 Playing audio...")
-        if play_audio_file(speech_file_path):
-            print("✅ Audio playback completed")
+        # Play the audio file (opt-in with --play)
+        if play:
+            print("🔊 Playing audio...")
+            if play_audio_file(speech_file_path):
+                print("✅ Audio playback completed")
+        else:
+            print(f"💡 Use --play to play it, or open {speech_file_path}")
         
         return speech_file_path
         
@@ -209,6 +221,7 @@ def main():
     parser = argparse.ArgumentParser(description='Analyze produce from image with audio summary')
     parser.add_argument('image_path', help='Path to the image file')
     parser.add_argument('--audio', action='store_true', help='Generate audio summary')
+    parser.add_argument('--play', action='store_true', help='Play the audio summary on this machine (implies --audio)')
     
     args = parser.parse_args()
     
@@ -246,8 +259,8 @@ def main():
         print(f"   Recommendation: {should_buy}")
         
         # Generate audio summary if requested
-        if args.audio:
-            create_audio_summary(produce_name, nutrition_info, should_buy, api_key)
+        if args.audio or args.play:
+            create_audio_summary(produce_name, nutrition_info, should_buy, api_key, play=args.play)
     else:
         print("❌ Failed to analyze the image")
 
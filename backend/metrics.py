@@ -0,0 +1,246 @@
+"""
+Prometheus metrics for SnackOverflow
+Every request is timed per route, and each stage inside it (upload, preprocess,
+vision call, parse, image store, DB insert, ...) is timed per route and model,
+so /metrics shows which stage dominates latency. prometheus_client is
+optional: without it the helpers are no-ops and /metrics reports 503.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from groq_client import model_cost
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+    )
+except ImportError:  # prometheus_client not installed
+    Counter = None
+    Gauge = None
+    Histogram = None
+
+# Load environment variables
+load_dotenv()
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Upstream calls take seconds, local stages milliseconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+# Route template of the request being served ('background' outside a request)
+current_route = contextvars.ContextVar('current_route', default='background')
+
+# Model token usage of the request being served (None outside a request)
+current_usage = contextvars.ContextVar('current_usage', default=None)
+
+if METRICS_ENABLED and Histogram is not None:
+    REQUEST_SECONDS = Histogram(
+        'snackoverflow_request_seconds', 'HTTP request latency',
+        ['route', 'method', 'status'], buckets=LATENCY_BUCKETS
+    )
+    STAGE_SECONDS = Histogram(
+        'snackoverflow_stage_seconds', 'Latency of one stage of a request',
+        ['route', 'stage', 'model'], buckets=LATENCY_BUCKETS
+    )
+    UPSTREAM_ERRORS = Counter(
+        'snackoverflow_upstream_errors_total', 'Failed Groq API calls',
+        ['route', 'model', 'error']
+    )
+    PARSE_FALLBACKS = Counter(
+        'snackoverflow_parse_fallbacks_total', 'Model responses that needed a fallback parse',
+        ['kind']
+    )
+    CACHE_EVENTS = Counter(
+        'snackoverflow_cache_events_total', 'Cache lookups by cache and result',
+        ['cache', 'result']
+    )
+    MODEL_TOKENS = Counter(
+        'snackoverflow_model_tokens_total', 'Tokens used by Groq chat calls',
+        ['route', 'model', 'kind']
+    )
+    MODEL_COST = Counter(
+        'snackoverflow_model_cost_usd_total', 'Estimated USD cost of Groq chat calls',
+        ['route', 'model']
+    )
+    PREFILTER_RESULTS = Counter(
+        'snackoverflow_prefilter_total', 'Images checked by the local pre-filter: passed or why they were rejected',
+        ['result']
+    )
+    KEYWORD_SPOTTING = Counter(
+        'snackoverflow_keyword_spotting_total', 'Voice command clips resolved locally or passed on to Whisper',
+        ['result']
+    )
+    VISION_ROUTES = Counter(
+        'snackoverflow_vision_routing_total', 'Vision analyses per model tier: accepted or why they escalated',
+        ['model', 'result']
+    )
+    UPSTREAM_RETRIES = Counter(
+        'snackoverflow_upstream_retries_total', 'Groq calls retried by the upstream scheduler',
+        ['model', 'reason']
+    )
+    UPSTREAM_HEDGES = Counter(
+        'snackoverflow_upstream_hedges_total', 'Hedged Groq requests launched and won',
+        ['model', 'result']
+    )
+    UPSTREAM_REJECTIONS = Counter(
+        'snackoverflow_upstream_rejections_total', 'Groq calls failed fast without being sent',
+        ['model', 'reason']
+    )
+    RATE_LIMIT_WAIT_SECONDS = Histogram(
+        'snackoverflow_rate_limit_wait_seconds', 'Time spent waiting for a per-model rate limit token',
+        ['model'], buckets=LATENCY_BUCKETS
+    )
+    CIRCUIT_STATE = Gauge(
+        'snackoverflow_circuit_state', 'Circuit breaker state per model (0 closed, 1 half-open, 2 open)',
+        ['model'], multiprocess_mode='max'
+    )
+else:
+    REQUEST_SECONDS = STAGE_SECONDS = UPSTREAM_ERRORS = PARSE_FALLBACKS = CACHE_EVENTS = MODEL_TOKENS = None
+    UPSTREAM_RETRIES = UPSTREAM_HEDGES = UPSTREAM_REJECTIONS = RATE_LIMIT_WAIT_SECONDS = CIRCUIT_STATE = None
+    MODEL_COST = VISION_ROUTES = PREFILTER_RESULTS = KEYWORD_SPOTTING = None
+
+def metrics_available():
+    """Whether metrics are being collected"""
+    return STAGE_SECONDS is not None
+
+@contextmanager
+def stage(name, model=None):
+    """Time a block as one stage of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if STAGE_SECONDS is not None:
+            STAGE_SECONDS.labels(current_route.get(), name, model or '').observe(time.perf_counter() - started)
+
+def observe_request(route, method, status, seconds):
+    """Record the latency of a finished HTTP request"""
+    if REQUEST_SECONDS is not None:
+        REQUEST_SECONDS.labels(route, method, str(status)).observe(seconds)
+
+def record_upstream_error(model, error):
+    """Count a failed Groq call"""
+    if UPSTREAM_ERRORS is not None:
+        UPSTREAM_ERRORS.labels(current_route.get(), model, type(error).__name__).inc()
+
+def record_parse_fallback(kind):
+    """Count a model response that could not be parsed as-is ('analysis', 'recipe', ...)"""
+    if PARSE_FALLBACKS is not None:
+        PARSE_FALLBACKS.labels(kind).inc()
+
+def record_cache(cache, result):
+    """Count a cache lookup ('analysis'/'audio'/..., 'hit'/'miss')"""
+    if CACHE_EVENTS is not None:
+        CACHE_EVENTS.labels(cache, result).inc()
+
+def record_prefilter(result):
+    """Count a pre-filter decision ('passed', 'blank', 'blurry', 'graphic', 'colorless')"""
+    if PREFILTER_RESULTS is not None:
+        PREFILTER_RESULTS.labels(result).inc()
+
+def record_keyword_spotting(result):
+    """Count a voice command clip ('matched' locally or 'fallback' to Whisper)"""
+    if KEYWORD_SPOTTING is not None:
+        KEYWORD_SPOTTING.labels(result).inc()
+
+def record_vision_route(model, result):
+    """Count a tiered vision analysis ('accepted', 'low_confidence', 'invalid', 'error')"""
+    if VISION_ROUTES is not None:
+        VISION_ROUTES.labels(model, result).inc()
+
+def record_upstream_retry(model, reason):
+    """Count a retried Groq call ('rate_limit', 'server', 'timeout', 'connection')"""
+    if UPSTREAM_RETRIES is not None:
+        UPSTREAM_RETRIES.labels(model, reason).inc()
+
+def record_upstream_hedge(model, result):
+    """Count a hedged request ('launched' or 'won')"""
+    if UPSTREAM_HEDGES is not None:
+        UPSTREAM_HEDGES.labels(model, result).inc()
+
+def record_upstream_rejection(model, reason):
+    """Count a call failed fast ('circuit_open' or 'rate_limited')"""
+    if UPSTREAM_REJECTIONS is not None:
+        UPSTREAM_REJECTIONS.labels(model, reason).inc()
+
+def observe_rate_limit_wait(model, seconds):
+    if RATE_LIMIT_WAIT_SECONDS is not None:
+        RATE_LIMIT_WAIT_SECONDS.labels(model).observe(seconds)
+
+CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+def set_circuit_state(model, state):
+    if CIRCUIT_STATE is not None:
+        CIRCUIT_STATE.labels(model).set(CIRCUIT_STATES[state])
+
+class TokenUsage:
+    """Prompt and completion tokens (and their cost) summed over the model calls of one request"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.calls = 0
+
+    def add(self, prompt_tokens, completion_tokens, cost=0.0):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+            self.calls += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+                'total_tokens': self.prompt_tokens + self.completion_tokens,
+                'cost_usd': round(self.cost, 6),
+                'calls': self.calls,
+            }
+
+def start_token_usage():
+    """Begin counting model tokens for the current request"""
+    usage = TokenUsage()
+    current_usage.set(usage)
+    return usage
+
+def record_token_usage(model, usage):
+    """Count the `usage` of one Groq chat completion (or streamed x_groq usage)"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    cost = model_cost(model, prompt_tokens, completion_tokens) or 0.0
+    if MODEL_TOKENS is not None:
+        route = current_route.get()
+        MODEL_TOKENS.labels(route, model, 'prompt').inc(prompt_tokens)
+        MODEL_TOKENS.labels(route, model, 'completion').inc(completion_tokens)
+        MODEL_COST.labels(route, model).inc(cost)
+    totals = current_usage.get()
+    if totals is not None:
+        totals.add(prompt_tokens, completion_tokens, cost)
+
+def token_usage():
+    """Token usage of the current request so far, or None outside a request"""
+    totals = current_usage.get()
+    return totals.as_dict() if totals is not None else None
+
+def render_metrics():
+    """Return (body, content_type) in the Prometheus text format, or None if unavailable
+
+    With PROMETHEUS_MULTIPROC_DIR set (several worker processes), samples from
+    every worker are aggregated.
+    """
+    if not metrics_available():
+        return None
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
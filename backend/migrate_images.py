@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+One-shot image migration for SnackOverflow
+Moves base64 images out of food_analyses.image_data into the content-addressed
+image store and records their SHA-256 in food_analyses.image_hash.
+"""
+
+import argparse
+import base64
+import binascii
+from mysql.connector import Error
+from dotenv import load_dotenv
+from database import get_database_connection, create_tables, column_exists
+from image_store import get_image_store, hash_image, IMAGE_STORE_BACKEND
+
+def migrate_images(batch_size=50, dry_run=False):
+    """Convert rows in batches; returns (migrated, skipped) counts"""
+    connection = get_database_connection()
+    if not connection:
+        return None
+
+    store = get_image_store()
+    migrated = 0
+    skipped = 0
+    last_id = 0
+
+    cursor = None
+    try:
+        cursor = connection.cursor()
+
+        if not column_exists(cursor, 'food_analyses', 'image_data'):
+            print("✅ No legacy image_data column found - nothing to migrate")
+            return migrated, skipped
+
+        while True:
+            cursor.execute(
+                """
+                SELECT id, image_data FROM food_analyses
+                WHERE id > %s AND image_data IS NOT NULL
+                ORDER BY id
+                LIMIT %s
+                """,
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            for row_id, image_data in rows:
+                last_id = row_id
+                try:
+                    image_bytes = base64.b64decode(image_data, validate=True)
+                except (binascii.Error, ValueError) as e:
+                    print(f"   ⚠️ Row {row_id}: invalid base64 ({e}), skipping")
+                    skipped += 1
+                    continue
+
+                image_hash = hash_image(image_bytes)
+                if not dry_run:
+                    store.put(image_hash, image_bytes)
+                    cursor.execute(
+                        "UPDATE food_analyses SET image_hash = %s, image_data = NULL WHERE id = %s",
+                        (image_hash, row_id)
+                    )
+                migrated += 1
+
+            if not dry_run:
+                connection.commit()
+            print(f"   ✅ Migrated {migrated} images so far (last id {last_id})")
+
+        return migrated, skipped
+
+    except Error as e:
+        print(f"❌ Error migrating images: {e}")
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        connection.close()
+
+def drop_legacy_column():
+    """Drop food_analyses.image_data once every row has been migrated"""
+    connection = get_database_connection()
+    if not connection:
+        return False
+
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        if not column_exists(cursor, 'food_analyses', 'image_data'):
+            return True
+
+        cursor.execute("SELECT COUNT(*) FROM food_analyses WHERE image_data IS NOT NULL")
+        remaining = cursor.fetchone()[0]
+        if remaining:
+            print(f"⚠️ {remaining} rows still have image_data - not dropping the column")
+            return False
+
+        cursor.execute("ALTER TABLE food_analyses DROP COLUMN image_data")
+        connection.commit()
+        print("✅ Dropped legacy image_data column")
+        return True
+
+    except Error as e:
+        print(f"❌ Error dropping image_data column: {e}")
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Move base64 images from food_analyses into the image store')
+    parser.add_argument('--batch-size', type=int, default=50, help='Rows converted per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='Decode and hash images without writing anything')
+    parser.add_argument('--drop-column', action='store_true', help='Drop the image_data column after a complete migration')
+
+    args = parser.parse_args()
+    load_dotenv()
+
+    print("🍌 SnackOverflow Image Migration")
+    print("=" * 40)
+    print(f"📦 Image store backend: {IMAGE_STORE_BACKEND}")
+
+    if not create_tables():
+        print("❌ Could not prepare database tables")
+        return
+
+    result = migrate_images(args.batch_size, args.dry_run)
+    if result is None:
+        print("\n❌ Migration failed")
+        return
+
+    migrated, skipped = result
+    print(f"\n📊 Migrated {migrated} images, skipped {skipped}")
+
+    if args.drop_column and not args.dry_run:
+        drop_legacy_column()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Request pipelines shared by the Flask and ASGI serving modes
+A pipeline is a generator holding the orchestration of one request (cache
+lookups, preprocessing, Groq calls, parsing, storage). Instead of calling Groq
+itself it yields the call it needs (GroqCall, GroqStream, NextChunk) and gets
+the result back, and it yields Emit for every piece of a streamed body.
+
+run_pipeline / drive_pipeline run a pipeline on the caller's thread with the
+sync Groq client (api.py). run_pipeline_async / stream_pipeline_async await
+the calls on the AsyncGroq client and run the steps in between in a worker
+thread, so the event loop never blocks (asgi.py). Either way the pipeline
+code, and every fix to it, is the same.
+"""
+
+import asyncio
+import contextvars
+from upstream import call_upstream, call_upstream_async, upstream_guard, upstream_guard_async, upstream_stream_errors
+from groq_client import get_groq_client, get_async_groq_client
+
+class GroqCall:
+    """Call a Groq SDK method (e.g. 'chat.completions.create') for `model` under the upstream scheduler
+
+    The pipeline gets the SDK's return value back, or the response body when
+    read=True.
+    """
+
+    def __init__(self, model, method, kwargs, read=False):
+        self.model = model
+        self.method = method
+        self.kwargs = kwargs
+        self.read = read
+
+class GroqStream:
+    """Open a streamed Groq call; the pipeline gets a handle to pass to NextChunk
+
+    Chat completions stream parsed chunks; binary=True opens a
+    with_streaming_response method and streams its raw bytes. The stream is
+    closed when the pipeline finishes.
+    """
+
+    def __init__(self, model, method, kwargs, binary=False):
+        self.model = model
+        self.method = method
+        self.kwargs = kwargs
+        self.binary = binary
+
+class NextChunk:
+    """Read the next chunk of an open stream; the pipeline gets None at the end"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+class Emit:
+    """Hand a piece of a streamed response body (an SSE event, audio bytes) to the client"""
+
+    def __init__(self, value):
+        self.value = value
+
+class Spawn:
+    """Start another pipeline in the background without waiting for it
+
+    The sync driver runs it on `executor`; the async driver runs it as a task
+    on the event loop.
+    """
+
+    def __init__(self, steps, executor):
+        self.steps = steps
+        self.executor = executor
+
+class StreamedResponse:
+    """Route pipeline result: a body produced by another pipeline's Emits
+
+    With on_error set, the first chunk is read before the headers go out and an
+    error raised up to then becomes on_error(error), a regular response.
+    """
+
+    def __init__(self, steps, mimetype, headers=None, on_error=None):
+        self.steps = steps
+        self.mimetype = mimetype
+        self.headers = headers or {}
+        self.on_error = on_error
+
+class FileResponse:
+    """Route pipeline result: a file on disk served with conditional request support"""
+
+    def __init__(self, path, mimetype, etag=None, headers=None):
+        self.path = path
+        self.mimetype = mimetype
+        self.etag = etag
+        self.headers = headers or {}
+
+def _method(client, path):
+    target = client
+    for name in path.split('.'):
+        target = getattr(target, name)
+    return target
+
+def _chat_chunks(client, effect):
+    stream = call_upstream(effect.model, _method(client, effect.method), **effect.kwargs)
+    try:
+        with upstream_stream_errors(effect.model):
+            yield from stream
+    finally:
+        stream.close()
+
+def _binary_chunks(client, effect):
+    with upstream_guard(effect.model), _method(client, effect.method)(**effect.kwargs) as response:
+        yield from response.iter_bytes()
+
+def _perform(client, effect, streams, groq_api_key):
+    if isinstance(effect, Spawn):
+        return effect.executor.submit(contextvars.copy_context().run, run_pipeline, effect.steps, groq_api_key)
+    if isinstance(effect, GroqCall):
+        result = call_upstream(effect.model, _method(client, effect.method), **effect.kwargs)
+        return result.read() if effect.read else result
+    if isinstance(effect, GroqStream):
+        stream = (_binary_chunks if effect.binary else _chat_chunks)(client, effect)
+        streams.append(stream)
+        return stream
+    if isinstance(effect, NextChunk):
+        return next(effect.stream, None)
+    raise TypeError(f"Unknown pipeline effect: {effect!r}")
+
+def drive_pipeline(steps, groq_api_key=None):
+    """Run a pipeline on the sync Groq client, yielding what it emits; returns the pipeline's result"""
+    client = get_groq_client(groq_api_key)
+    streams = []
+    reply, error = None, None
+    try:
+        while True:
+            try:
+                effect = steps.throw(error) if error is not None else steps.send(reply)
+            except StopIteration as done:
+                return done.value
+            reply, error = None, None
+            if isinstance(effect, Emit):
+                yield effect.value
+                continue
+            try:
+                reply = _perform(client, effect, streams, groq_api_key)
+            except Exception as e:
+                error = e
+    finally:
+        steps.close()
+        for stream in streams:
+            stream.close()
+
+def run_pipeline(steps, groq_api_key=None):
+    """Run a pipeline that doesn't emit and return its result"""
+    driver = drive_pipeline(steps, groq_api_key)
+    while True:
+        try:
+            next(driver)
+        except StopIteration as done:
+            return done.value
+
+class _Result:
+    def __init__(self, value):
+        self.value = value
+
+def _advance(steps, reply, error):
+    # Runs in a worker thread; StopIteration can't cross a Future, so it's returned instead
+    try:
+        return steps.throw(error) if error is not None else steps.send(reply)
+    except StopIteration as done:
+        return _Result(done.value)
+
+async def _chat_chunks_async(client, effect):
+    stream = await call_upstream_async(effect.model, _method(client, effect.method), **effect.kwargs)
+    try:
+        with upstream_stream_errors(effect.model):
+            async for chunk in stream:
+                yield chunk
+    finally:
+        await stream.close()
+
+async def _binary_chunks_async(client, effect):
+    async with upstream_guard_async(effect.model), _method(client, effect.method)(**effect.kwargs) as response:
+        async for chunk in response.iter_bytes():
+            yield chunk
+
+# Strong references so background tasks aren't garbage collected mid-flight
+_background_tasks = set()
+
+def start_background_task(coro):
+    """Run a coroutine on the running loop without awaiting it"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def _perform_async(client, effect, streams, groq_api_key):
+    if isinstance(effect, Spawn):
+        return start_background_task(run_pipeline_async(effect.steps, groq_api_key))
+    if isinstance(effect, GroqCall):
+        result = await call_upstream_async(effect.model, _method(client, effect.method), **effect.kwargs)
+        return await result.read() if effect.read else result
+    if isinstance(effect, GroqStream):
+        stream = (_binary_chunks_async if effect.binary else _chat_chunks_async)(client, effect)
+        streams.append(stream)
+        return stream
+    if isinstance(effect, NextChunk):
+        try:
+            return await effect.stream.__anext__()
+        except StopAsyncIteration:
+            return None
+    raise TypeError(f"Unknown pipeline effect: {effect!r}")
+
+async def _drive_async(steps, groq_api_key):
+    client = get_async_groq_client(groq_api_key)
+    streams = []
+    reply, error = None, None
+    stepping = False
+    try:
+        while True:
+            stepping = True
+            effect = await asyncio.to_thread(_advance, steps, reply, error)
+            stepping = False
+            reply, error = None, None
+            if isinstance(effect, (_Result, Emit)):
+                yield effect
+                if isinstance(effect, _Result):
+                    return
+                continue
+            try:
+                reply = await _perform_async(client, effect, streams, groq_api_key)
+            except Exception as e:
+                error = e
+    finally:
+        for stream in streams:
+            await stream.aclose()
+        # A step cancelled mid-run is still executing in its thread; the generator is closed when collected
+        if not stepping:
+            await asyncio.to_thread(steps.close)
+
+async def run_pipeline_async(steps, groq_api_key=None):
+    """Async version of run_pipeline"""
+    result = None
+    async for item in _drive_async(steps, groq_api_key):
+        if isinstance(item, _Result):
+            result = item.value
+    return result
+
+async def stream_pipeline_async(steps, groq_api_key=None):
+    """Async version of drive_pipeline: an async generator of what the pipeline emits"""
+    driver = _drive_async(steps, groq_api_key)
+    try:
+        async for item in driver:
+            if isinstance(item, Emit):
+                yield item.value
+    finally:
+        await driver.aclose()
@@ -0,0 +1,95 @@
+"""
+Structured JSON logging for SnackOverflow
+One JSON object per line on stdout with the timestamp, level, logger, message,
+the route being served and any extra fields, e.g.
+
+    log = get_logger(__name__)
+    log.info("Analysis saved", analysis_id=42)
+
+LOG_FORMAT=text switches to plain lines for local development.
+"""
+
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from metrics import current_route
+
+# Load environment variables
+load_dotenv()
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json').lower()
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as a single-line JSON object"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage(),
+            'route': current_route.get(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Plain 'level logger: message key=value' lines"""
+
+    def format(self, record):
+        fields = ' '.join(f"{key}={value}" for key, value in getattr(record, 'fields', {}).items())
+        line = f"{record.levelname.lower()} {record.name}: {record.getMessage()}"
+        if fields:
+            line = f"{line} {fields}"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+class StructuredLogger:
+    """Thin wrapper so extra fields can be passed as keyword arguments"""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, message, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, message, extra={'fields': fields}, exc_info=exc_info)
+
+    def debug(self, message, **fields):
+        self._log(logging.DEBUG, message, fields)
+
+    def info(self, message, **fields):
+        self._log(logging.INFO, message, fields)
+
+    def warning(self, message, **fields):
+        self._log(logging.WARNING, message, fields)
+
+    def error(self, message, **fields):
+        self._log(logging.ERROR, message, fields)
+
+    def exception(self, message, **fields):
+        self._log(logging.ERROR, message, fields, exc_info=True)
+
+_configured = False
+
+def _configure():
+    global _configured
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(TextFormatter() if LOG_FORMAT == 'text' else JSONFormatter())
+    root = logging.getLogger('snackoverflow')
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+    _configured = True
+
+def get_logger(name):
+    """Return a structured logger under the 'snackoverflow' namespace"""
+    if not _configured:
+        _configure()
+    return StructuredLogger(logging.getLogger(f"snackoverflow.{name}"))
@@ -0,0 +1,188 @@
+"""
+Tests for api.py helpers: analysis parsing and caching, cache keys, history cursors
+and the streamed /analyze pipeline
+"""
+
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+import api
+from pipeline import Emit, GroqCall, GroqStream, NextChunk
+
+COMPLETE_ANALYSIS = (
+    '{"fruit_name": "Apple", "freshness_level": 8, "freshness_state": "Fresh", '
+    '"visual_indicators": "bright red", "should_buy": true, "best_use": "Eat now", '
+    '"shelf_life_days": 7, "calories": 95, "nutrition_highlights": "fiber", '
+    '"health_benefits": "", "purchase_recommendation": "Buy", "storage_method": "Fridge", '
+    '"food_pun": "Apple-solutely", "confidence": 0.9}'
+)
+
+class RecordingCache:
+    def __init__(self):
+        self.stored = []
+
+    def lookup(self, image_hash, dhash):
+        return None, None
+
+    def store(self, image_hash, dhash, result):
+        self.stored.append(result)
+
+@pytest.fixture
+def cache(monkeypatch):
+    recording = RecordingCache()
+    monkeypatch.setattr(api, 'get_analysis_cache', lambda: recording)
+    return recording
+
+def test_parse_complete_analysis():
+    analysis = api.parse_groq_response(COMPLETE_ANALYSIS)
+    assert analysis['fruit_name'] == 'Apple'
+    assert analysis['calories'] == 95
+    assert 'repaired' not in analysis
+
+def test_parse_repaired_analysis_with_core_fields():
+    truncated = COMPLETE_ANALYSIS[:COMPLETE_ANALYSIS.index('"nutrition_highlights"') + 30]
+    analysis = api.parse_groq_response(truncated)
+    assert analysis['repaired'] is True
+    assert analysis['calories'] == 95
+    assert analysis['storage_method'] == ""
+
+def test_parse_repaired_analysis_missing_core_fields_falls_back():
+    truncated = COMPLETE_ANALYSIS[:COMPLETE_ANALYSIS.index('"shelf_life_days"')]
+    analysis = api.parse_groq_response(truncated)
+    assert analysis['fruit_name'] == 'No food detected'
+    assert analysis['raw_analysis'] == truncated.strip()
+
+def test_finish_analysis_caches_complete_analyses_only(cache):
+    api.finish_analysis(COMPLETE_ANALYSIS, 'sha-1', None)
+    api.finish_analysis(COMPLETE_ANALYSIS[:-40], 'sha-2', None)
+    api.finish_analysis('no json here', 'sha-3', None)
+    assert [result['fruit_name'] for result in cache.stored] == ['Apple']
+
+def test_recipe_cache_key_ignores_order_case_and_small_shelf_life_changes():
+    basket = [
+        {'name': 'Apple', 'quality': 'Fresh', 'shelfLife': 6},
+        {'name': 'Green  Banana', 'quality': 'Ripe', 'shelfLife': 2},
+    ]
+    same_basket = [
+        {'name': 'green banana', 'quality': 'ripe ', 'shelfLife': 3},
+        {'name': 'APPLE', 'quality': 'Fresh', 'shelfLife': 5},
+    ]
+    assert api.recipe_cache_key(basket) == api.recipe_cache_key(same_basket)
+
+    older_apple = [dict(basket[0], shelfLife=1), basket[1]]
+    assert api.recipe_cache_key(basket) != api.recipe_cache_key(older_apple)
+
+def test_comparison_cache_key_ignores_order():
+    items = [{'image_hash': 'aaa'}, {'image_hash': 'bbb'}]
+    assert api.comparison_cache_key(items) == api.comparison_cache_key(items[::-1])
+    assert api.comparison_cache_key(items) != api.comparison_cache_key(items[:1])
+
+def test_history_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15)
+    cursor = api.format_history_cursor({'created_at': created_at, 'id': 42})
+    assert cursor == '2024-05-01T12:30:15,42'
+    assert api.parse_history_cursor(cursor) == (created_at, 42)
+
+@pytest.mark.parametrize('cursor', ['', '42', 'yesterday,42', '2024-05-01T12:30:15,abc'])
+def test_history_cursor_malformed(cursor):
+    with pytest.raises(ValueError):
+        api.parse_history_cursor(cursor)
+
+def text_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], x_groq=None, usage=None)
+
+def drive_stream(steps, texts, error=None):
+    """Run a streaming pipeline by hand: the stream yields `texts`, then raises `error` (or ends)"""
+    emitted = []
+    pending = [text_chunk(text) for text in texts]
+    try:
+        effect = steps.send(None)
+        while True:
+            if isinstance(effect, Emit):
+                emitted.append(effect.value)
+                effect = steps.send(None)
+            elif isinstance(effect, GroqStream):
+                effect = steps.send('stream')
+            elif isinstance(effect, NextChunk):
+                if pending:
+                    effect = steps.send(pending.pop(0))
+                elif error is not None:
+                    effect = steps.throw(error)
+                else:
+                    effect = steps.send(None)
+            else:
+                raise AssertionError(f"Unexpected effect {effect!r}")
+    except StopIteration:
+        return emitted
+
+@pytest.fixture
+def stream_setup(monkeypatch, cache):
+    stored = []
+    monkeypatch.setattr(api, 'encode_image_for_vision', lambda image_bytes: ('base64', 'image/jpeg'))
+    monkeypatch.setattr(api, 'compute_dhash', lambda image_bytes: None)
+    monkeypatch.setattr(api, 'store_analysis', lambda result, filename, image_bytes: stored.append(result))
+    return SimpleNamespace(cache=cache, stored=stored)
+
+def test_stream_analysis_complete(stream_setup):
+    halfway = len(COMPLETE_ANALYSIS) // 2
+    events = drive_stream(
+        api.stream_analysis_events('apple.jpg', b'image'),
+        [COMPLETE_ANALYSIS[:halfway], COMPLETE_ANALYSIS[halfway:]]
+    )
+    assert events[0].startswith('event: field')
+    assert events[-1].startswith('event: result')
+    assert len(stream_setup.stored) == 1
+    assert len(stream_setup.cache.stored) == 1
+
+def test_stream_analysis_broken_off_is_not_stored_or_cached(stream_setup):
+    events = drive_stream(
+        api.stream_analysis_events('apple.jpg', b'image'),
+        [COMPLETE_ANALYSIS[:120]],
+        error=RuntimeError('connection reset')
+    )
+    assert events[-1].startswith('event: error')
+    assert not any(event.startswith('event: result') for event in events)
+    assert stream_setup.stored == []
+    assert stream_setup.cache.stored == []
+
+def test_stream_analysis_truncated_reply_is_stored_but_not_cached(stream_setup):
+    truncated = COMPLETE_ANALYSIS[:COMPLETE_ANALYSIS.index('"storage_method"')]
+    events = drive_stream(api.stream_analysis_events('apple.jpg', b'image'), [truncated])
+    assert events[-1].startswith('event: result')
+    assert stream_setup.stored[0]['repaired'] is True
+    assert stream_setup.cache.stored == []
+
+def chat_reply(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=None)
+
+def drive_calls(steps, replies):
+    """Run a pipeline by hand, answering each GroqCall with replies[model]"""
+    try:
+        effect = steps.send(None)
+        while True:
+            assert isinstance(effect, GroqCall), f"Unexpected effect {effect!r}"
+            effect = steps.send(chat_reply(replies[effect.model]))
+    except StopIteration as done:
+        return done.value
+
+@pytest.fixture
+def tiered(monkeypatch, cache):
+    parsed = []
+    parse = api.parse_groq_response
+    monkeypatch.setattr(api, 'vision_tiers', lambda: ('fast-model', 'top-model'))
+    monkeypatch.setattr(api, 'parse_groq_response', lambda text: parsed.append(text) or parse(text))
+    monkeypatch.setattr(api, 'encode_image_for_vision', lambda image_bytes: ('base64', 'image/jpeg'))
+    monkeypatch.setattr(api, 'compute_dhash', lambda image_bytes: None)
+    return parsed
+
+def test_accepted_fast_reply_is_parsed_once(tiered):
+    result, status = drive_calls(api.analyze_with_cache(b'image'), {'fast-model': COMPLETE_ANALYSIS})
+    assert (result['fruit_name'], result['vision_model'], status) == ('Apple', 'fast-model', 'miss')
+    assert tiered == []
+
+def test_low_confidence_fast_reply_escalates(tiered):
+    unsure = COMPLETE_ANALYSIS.replace('"confidence": 0.9', '"confidence": 0.2')
+    replies = {'fast-model': unsure, 'top-model': COMPLETE_ANALYSIS}
+    result, _ = drive_calls(api.analyze_with_cache(b'image'), replies)
+    assert result['vision_model'] == 'top-model'
+    assert tiered == [COMPLETE_ANALYSIS]
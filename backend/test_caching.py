@@ -0,0 +1,81 @@
+"""
+Tests for the in-process TTL/LRU cache and the analysis result cache
+"""
+
+import caching
+from analysis_cache import AnalysisCache, SQLiteCacheTier
+from caching import TTLLRUCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_lru_evicts_least_recently_used():
+    cache = TTLLRUCache(max_entries=2, ttl=0)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(caching.time, 'monotonic', clock)
+    cache = TTLLRUCache(max_entries=10, ttl=60)
+    cache.set('a', 1)
+    clock.now += 30
+    assert cache.get_with_age('a') == (1, 30)
+    clock.now += 31
+    assert cache.get('a', 'gone') == 'gone'
+    assert cache.items() == []
+    assert cache.stats()['entries'] == 0
+
+def test_items_skip_expired_entries(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(caching.time, 'monotonic', clock)
+    cache = TTLLRUCache(max_entries=10, ttl=60)
+    cache.set('old', 1)
+    clock.now += 45
+    cache.set('new', 2)
+    clock.now += 30
+    assert cache.items() == [('new', 2)]
+
+def test_analysis_cache_exact_and_perceptual_keys():
+    cache = AnalysisCache(ttl=60, max_entries=10, threshold=4, shared='none')
+    cache.store('sha-apple', 0b1111_0000, {'fruit_name': 'Apple'})
+
+    assert cache.lookup('sha-apple', None) == ({'fruit_name': 'Apple'}, 'exact')
+    # A re-shot: different bytes, dHash a few bits away
+    assert cache.lookup('sha-reshot', 0b1111_0110) == ({'fruit_name': 'Apple'}, 'perceptual')
+    # Too many differing bits
+    assert cache.lookup('sha-other', 0b0000_1111) == (None, None)
+    assert cache.lookup('sha-other', None) == (None, None)
+
+def test_analysis_cache_returns_copies():
+    cache = AnalysisCache(ttl=60, max_entries=10, threshold=4, shared='none')
+    cache.store('sha-apple', None, {'fruit_name': 'Apple'})
+    result, _ = cache.lookup('sha-apple', None)
+    result['cache'] = 'hit'
+    assert cache.lookup('sha-apple', None) == ({'fruit_name': 'Apple'}, 'exact')
+
+def test_sqlite_tier_matches_within_shared_bands(tmp_path):
+    tier = SQLiteCacheTier(path=str(tmp_path / 'cache.sqlite3'), ttl=60)
+    tier.store('sha-apple', 0xFFFF_0000_0000_0000, {'fruit_name': 'Apple'})
+
+    assert tier.lookup('sha-apple', None, 6) == ({'fruit_name': 'Apple'}, 0)
+    assert tier.lookup('sha-reshot', 0xFFFF_0000_0000_0003, 6) == ({'fruit_name': 'Apple'}, 2)
+    assert tier.lookup('sha-other', 0x0000_FFFF_0000_0000, 6) is None
+
+def test_sqlite_tier_high_threshold_compares_every_row(tmp_path):
+    tier = SQLiteCacheTier(path=str(tmp_path / 'cache.sqlite3'), ttl=60)
+    tier.store('sha-apple', 0, {'fruit_name': 'Apple'})
+    # One bit off in every band, so no band matches
+    one_bit_per_band = 0x0101_0101_0101_0101
+    assert tier.lookup('sha-reshot', one_bit_per_band, 7) is None
+    assert tier.lookup('sha-reshot', one_bit_per_band, 8) == ({'fruit_name': 'Apple'}, 8)
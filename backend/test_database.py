@@ -7,7 +7,6 @@ This script tests all database functions with various scenarios.
 import os
 import sys
 import json
-import base64
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -20,6 +19,7 @@ from database import (
     save_food_analysis, 
     get_recent_analyses
 )
+from image_store import save_image
 
 def test_connection():
     """Test 1: Database Connection"""
@@ -67,10 +67,10 @@ def test_save_analysis():
         'food_pun': 'You\'re apple-solutely going to love this!'
     }
     
-    # Test with sample image data
-    sample_image_data = base64.b64encode(b"fake_image_data_for_testing").decode('utf-8')
+    # Test with sample image data stored in the image store
+    sample_image_hash = save_image(b"fake_image_data_for_testing")
     
-    result_id = save_food_analysis(test_data, "test_apple.jpg", sample_image_data)
+    result_id = save_food_analysis(test_data, "test_apple.jpg", sample_image_hash)
     
     if result_id:
         print(f"✅ Food analysis saved with ID: {result_id}")
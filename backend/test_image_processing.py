@@ -0,0 +1,65 @@
+"""
+Tests for the local image pre-filter
+"""
+
+import io
+import os
+import pytest
+import image_processing
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+IMG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'img')
+
+@pytest.fixture(autouse=True)
+def prefilter_on(monkeypatch):
+    monkeypatch.setattr(image_processing, 'PREFILTER_ENABLED', True)
+
+def encode(image, format='JPEG'):
+    buffer = io.BytesIO()
+    image.save(buffer, format, quality=90)
+    return buffer.getvalue()
+
+def pale_food_photo():
+    """White rice in soft light: off-white grains, gentle shading and mild sensor noise"""
+    image = Image.new('RGB', (800, 600), (214, 210, 202))
+    draw = ImageDraw.Draw(image)
+    for index in range(900):
+        x, y = (index * 37) % 800, (index * 53) % 600
+        draw.ellipse((x, y, x + 22, y + 9), fill=(232, 229, 222), outline=(196, 191, 182))
+    shading = Image.linear_gradient('L').resize((800, 600)).point(lambda v: v // 8)
+    channels = [
+        ImageChops.add(ImageChops.subtract(channel, shading), Image.effect_noise((800, 600), 3), offset=-128)
+        for channel in image.split()
+    ]
+    return Image.merge('RGB', channels).filter(ImageFilter.GaussianBlur(0.7))
+
+def document():
+    image = Image.new('RGB', (1200, 1600), 'white')
+    draw = ImageDraw.Draw(image)
+    for y in range(60, 1550, 28):
+        draw.text((60, y), "Lorem ipsum dolor sit amet, consectetur adipiscing elit " * 2, fill='black')
+    return image
+
+@pytest.mark.parametrize('name', ['apple.webp', 'bad-apple.webp'])
+def test_food_photos_pass(name):
+    with open(os.path.join(IMG_DIR, name), 'rb') as image_file:
+        assert image_processing.prefilter_image(image_file.read()) is None
+
+def test_pale_food_passes():
+    assert image_processing.prefilter_image(encode(pale_food_photo())) is None
+
+def test_blank_frame_rejected():
+    assert image_processing.prefilter_image(encode(Image.new('RGB', (640, 480), (20, 20, 20)))) == 'blank'
+
+def test_blurred_photo_rejected():
+    with open(os.path.join(IMG_DIR, 'apple.webp'), 'rb') as image_file:
+        photo = Image.open(image_file).convert('RGB')
+    assert image_processing.prefilter_image(encode(photo.filter(ImageFilter.GaussianBlur(12)))) == 'blurry'
+
+@pytest.mark.parametrize('format', ['PNG', 'JPEG'])
+def test_documents_rejected_as_graphics(format):
+    assert image_processing.prefilter_image(encode(document(), format)) == 'graphic'
+
+def test_disabled_prefilter_passes_everything(monkeypatch):
+    monkeypatch.setattr(image_processing, 'PREFILTER_ENABLED', False)
+    assert image_processing.prefilter_image(encode(document())) is None
@@ -0,0 +1,94 @@
+"""
+Tests for json_utils: recovering JSON from model output, Schema and the streaming field parser
+"""
+
+import json
+import pytest
+from json_utils import Schema, SchemaError, StreamingJSONFieldParser, extract_json
+
+FRUIT_SCHEMA = Schema({
+    "fruit_name": ('str', None, {"max_tokens": 6}),
+    "calories": ('int', 0),
+    "should_buy": ('bool', False),
+    "tags": (['str'], [], {"maxItems": 2}),
+}, required=("fruit_name",))
+
+def test_extract_json_exact():
+    assert extract_json('{"a": 1}') == ({"a": 1}, 'exact')
+
+def test_extract_json_fenced_with_prose():
+    text = 'Here you go:\n```json\n{"a": {"b": [1, 2]}}\n```\nEnjoy!'
+    assert extract_json(text) == ({"a": {"b": [1, 2]}}, 'extracted')
+
+def test_extract_json_skips_braces_in_prose():
+    assert extract_json('Use {curly} braces. {"a": "}"}') == ({"a": "}"}, 'extracted')
+
+def test_extract_json_trailing_comma():
+    assert extract_json('{"a": 1, "b": [1, 2,],}') == ({"a": 1, "b": [1, 2]}, 'repaired')
+
+def test_extract_json_truncated_string():
+    value, how = extract_json('{"fruit_name": "Apple", "visual_indicators": "bright red, fi')
+    assert how == 'repaired'
+    assert value == {"fruit_name": "Apple", "visual_indicators": "bright red, fi"}
+
+def test_extract_json_truncated_drops_dangling_key():
+    value, how = extract_json('{"fruit_name": "Apple", "calories": 95, "should_')
+    assert how == 'repaired'
+    assert value == {"fruit_name": "Apple", "calories": 95}
+
+def test_extract_json_truncated_nested():
+    value, how = extract_json('{"recipes": [{"name": "Pie", "steps": ["peel", "bake"')
+    assert how == 'repaired'
+    assert value == {"recipes": [{"name": "Pie", "steps": ["peel", "bake"]}]}
+
+def test_extract_json_no_object():
+    with pytest.raises(json.JSONDecodeError):
+        extract_json('I could not see any food in this picture.')
+
+def test_schema_validate_coerces_and_defaults():
+    result = FRUIT_SCHEMA.validate({"fruit_name": "Apple", "calories": "95", "should_buy": "yes", "extra": 1})
+    assert result == {"fruit_name": "Apple", "calories": 95, "should_buy": True, "tags": [], "extra": 1}
+
+def test_schema_validate_invalid_optional_falls_back():
+    result = FRUIT_SCHEMA.validate({"fruit_name": "Apple", "calories": "lots", "tags": ["red", 3, {"x": 1}]})
+    assert result["calories"] == 0
+    assert result["tags"] == ["red", "3"]
+
+def test_schema_validate_required():
+    with pytest.raises(SchemaError):
+        FRUIT_SCHEMA.validate({"calories": 95})
+    with pytest.raises(SchemaError):
+        FRUIT_SCHEMA.validate({"fruit_name": None})
+    with pytest.raises(SchemaError):
+        FRUIT_SCHEMA.validate(["not", "an", "object"])
+
+def test_schema_json_schema():
+    schema = FRUIT_SCHEMA.json_schema()
+    assert schema['required'] == ["fruit_name", "calories", "should_buy", "tags"]
+    assert schema['additionalProperties'] is False
+    assert schema['properties']['fruit_name'] == {'type': 'string'}
+    assert schema['properties']['calories'] == {'type': 'integer'}
+    assert schema['properties']['tags'] == {'type': 'array', 'items': {'type': 'string'}, 'maxItems': 2}
+
+def test_schema_json_schema_nullable_default():
+    schema = Schema({"food_pun": ('str', None)}).json_schema()
+    assert schema['properties']['food_pun'] == {'type': ['string', 'null']}
+
+def test_schema_token_budget():
+    # Braces, then per field len(name) // 4 + 4 plus the value's tokens
+    expected = 2 + (2 + 4 + 6) + (2 + 4 + 3) + (2 + 4 + 2) + (1 + 4 + 2 + 2 * (16 + 1))
+    assert FRUIT_SCHEMA.token_budget() == expected
+
+def test_streaming_parser_fields_as_they_complete():
+    parser = StreamingJSONFieldParser()
+    assert parser.feed('```json\n{"fruit_name": "App') == []
+    assert parser.feed('le", "calories": 9') == [("fruit_name", "Apple")]
+    assert parser.feed('5, "tags": ["red", "cr') == [("calories", 95)]
+    assert parser.feed('isp"], "note": "a \\"quoted\\" }"}') == [("tags", ["red", "crisp"]), ("note", 'a "quoted" }')]
+    assert parser.done
+
+def test_streaming_parser_truncated_stream_keeps_complete_fields_only():
+    parser = StreamingJSONFieldParser()
+    fields = parser.feed('{"fruit_name": "Apple", "visual_indicators": "bright red, fi')
+    assert fields == [("fruit_name", "Apple")]
+    assert not parser.done
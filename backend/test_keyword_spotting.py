@@ -0,0 +1,28 @@
+"""
+Tests for local keyword spotting setup
+"""
+
+from types import SimpleNamespace
+import pytest
+import keyword_spotting
+
+@pytest.fixture
+def broken_vosk(monkeypatch):
+    loads = []
+
+    def load_model(path):
+        loads.append(path)
+        raise RuntimeError("model directory is empty")
+    monkeypatch.setattr(keyword_spotting, 'vosk', SimpleNamespace(SetLogLevel=lambda level: None, Model=load_model))
+    monkeypatch.setattr(keyword_spotting, 'VOICE_KWS_ENABLED', True)
+    monkeypatch.setattr(keyword_spotting, 'VOSK_MODEL_PATH', '/models/vosk')
+    monkeypatch.setattr(keyword_spotting, '_model', None)
+    monkeypatch.setattr(keyword_spotting, '_model_failed', False)
+    return loads
+
+def test_failed_model_load_disables_keyword_spotting(broken_vosk):
+    assert keyword_spotting.keyword_spotting_available()
+    for _ in range(3):
+        assert keyword_spotting.spot_keywords(b'clip', ['scan food']) is None
+    assert broken_vosk == ['/models/vosk']
+    assert not keyword_spotting.keyword_spotting_available()
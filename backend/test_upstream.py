@@ -0,0 +1,196 @@
+"""
+Tests for the upstream scheduler: rate limit bucket, circuit breaker and retries
+"""
+
+import itertools
+import httpx
+import pytest
+import upstream
+from groq import APIConnectionError, BadRequestError, InternalServerError, RateLimitError
+from upstream import CircuitBreaker, CircuitOpenError, TokenBucket, call_upstream, upstream_stream_errors
+
+_models = itertools.count()
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(upstream.time, 'monotonic', fake)
+    return fake
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(upstream.time, 'sleep', lambda seconds: None)
+
+def fresh_model():
+    """A model name no other test has used, so it gets its own limiter"""
+    return f"test-model-{next(_models)}"
+
+def status_error(error_class, status_code):
+    request = httpx.Request('POST', 'https://api.groq.test/v1/chat/completions')
+    return error_class("upstream said no", response=httpx.Response(status_code, request=request), body=None)
+
+def failing(*errors, result='ok'):
+    """A fake SDK method that raises each error in turn, then returns result"""
+    calls = []
+    pending = list(errors)
+
+    def fn(**kwargs):
+        calls.append(kwargs)
+        if pending:
+            raise pending.pop(0)
+        return result
+    fn.calls = calls
+    return fn
+
+def test_token_bucket_burst_then_wait(clock):
+    bucket = TokenBucket(60, burst_seconds=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert not bucket.try_reserve()
+    clock.now += 2
+    assert bucket.try_reserve()
+
+def test_token_bucket_refund_and_pause(clock):
+    bucket = TokenBucket(60, burst_seconds=1)
+    assert bucket.reserve() == 0.0
+    bucket.refund()
+    assert bucket.reserve() == 0.0
+    bucket.refund()
+    bucket.pause(5)
+    assert bucket.reserve() == pytest.approx(5.0)
+    assert not bucket.try_reserve()
+
+def test_token_bucket_unlimited():
+    bucket = TokenBucket(0)
+    assert all(bucket.reserve() == 0.0 for _ in range(1000))
+
+def test_circuit_opens_after_threshold(clock):
+    breaker = CircuitBreaker(fresh_model(), threshold=2, cooldown=30)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record(ok=False)
+    assert breaker.is_open()
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.allow()
+    assert raised.value.retry_after == pytest.approx(30)
+
+def test_circuit_half_open_trial(clock):
+    breaker = CircuitBreaker(fresh_model(), threshold=1, cooldown=30)
+    breaker.allow()
+    breaker.record(ok=False)
+    clock.now += 31
+
+    breaker.allow()
+    assert breaker.state == 'half_open'
+    # Only one trial call at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(ok=True)
+    assert breaker.state == 'closed'
+
+def test_circuit_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(fresh_model(), threshold=1, cooldown=30)
+    breaker.allow()
+    breaker.record(ok=False)
+    clock.now += 31
+    breaker.allow()
+    breaker.record(ok=False)
+    assert breaker.is_open()
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(fresh_model(), threshold=2, cooldown=30)
+    for ok in (False, True, False):
+        breaker.allow()
+        breaker.record(ok=ok)
+    assert breaker.state == 'closed'
+
+def test_call_upstream_retries_server_and_connection_errors(no_sleep, monkeypatch):
+    monkeypatch.setattr(upstream, 'UPSTREAM_MAX_RETRIES', 2)
+    request = httpx.Request('POST', 'https://api.groq.test')
+    fn = failing(status_error(InternalServerError, 503), APIConnectionError(request=request))
+    assert call_upstream(fresh_model(), fn, messages=[]) == 'ok'
+    assert len(fn.calls) == 3
+
+def test_call_upstream_gives_up_after_max_retries(no_sleep, monkeypatch):
+    monkeypatch.setattr(upstream, 'UPSTREAM_MAX_RETRIES', 1)
+    fn = failing(*[status_error(InternalServerError, 500)] * 3)
+    with pytest.raises(InternalServerError):
+        call_upstream(fresh_model(), fn)
+    assert len(fn.calls) == 2
+
+def test_call_upstream_does_not_retry_client_errors(no_sleep):
+    fn = failing(status_error(BadRequestError, 400))
+    with pytest.raises(BadRequestError):
+        call_upstream(fresh_model(), fn)
+    assert len(fn.calls) == 1
+
+def test_call_upstream_passes_model_kwarg_through():
+    fn = failing()
+    call_upstream(fresh_model(), fn, model='llama', messages=[])
+    assert fn.calls == [{'model': 'llama', 'messages': []}]
+
+def call_failing(model, error):
+    with pytest.raises(type(error)):
+        call_upstream(model, failing(error))
+
+def test_client_errors_mean_the_model_is_reachable(no_sleep, monkeypatch):
+    monkeypatch.setattr(upstream, 'UPSTREAM_MAX_RETRIES', 0)
+    model = fresh_model()
+    upstream.get_limiter(model).breaker.threshold = 2
+    for error in (status_error(InternalServerError, 502), status_error(BadRequestError, 400),
+                  status_error(InternalServerError, 502), status_error(RateLimitError, 429),
+                  status_error(InternalServerError, 502)):
+        call_failing(model, error)
+    assert upstream.get_limiter(model).breaker.state == 'closed'
+
+def test_programming_errors_do_not_count_either_way(no_sleep, monkeypatch):
+    monkeypatch.setattr(upstream, 'UPSTREAM_MAX_RETRIES', 0)
+    model = fresh_model()
+    upstream.get_limiter(model).breaker.threshold = 2
+    for _ in range(3):
+        call_failing(model, TypeError("bug on our side"))
+    assert upstream.get_limiter(model).breaker.state == 'closed'
+
+    # Nor do they reset the count of real failures
+    for error in (status_error(InternalServerError, 502), TypeError("bug"), status_error(InternalServerError, 502)):
+        call_failing(model, error)
+    assert upstream.get_limiter(model).breaker.is_open()
+
+def test_stream_errors_count_against_the_circuit():
+    model = fresh_model()
+    breaker = upstream.get_limiter(model).breaker
+    breaker.threshold = 1
+    request = httpx.Request('POST', 'https://api.groq.test')
+
+    with pytest.raises(ValueError):
+        with upstream_stream_errors(model):
+            raise ValueError("bad chunk handling on our side")
+    assert breaker.state == 'closed'
+
+    with pytest.raises(httpx.RemoteProtocolError):
+        with upstream_stream_errors(model):
+            raise httpx.RemoteProtocolError("peer closed connection", request=request)
+    assert breaker.is_open()
+
+def test_limits_are_keyed_by_role(monkeypatch):
+    import groq_client
+    model = fresh_model()
+    monkeypatch.setitem(groq_client.MODEL_ROLES, 'vision', model)
+    monkeypatch.setitem(groq_client.MODEL_ROLES, 'vision_fast', model)
+    monkeypatch.setitem(upstream.ROLE_RPM, 'vision', 30)
+    monkeypatch.setitem(upstream.ROLE_RPM, 'vision_fast', 600)
+    monkeypatch.setitem(groq_client.ROLE_TIMEOUTS, 'vision', 45)
+    monkeypatch.setitem(groq_client.ROLE_TIMEOUTS, 'vision_fast', 20)
+
+    # The same model as both tiers runs on the primary vision settings
+    assert groq_client.model_role(model) == 'vision'
+    assert upstream.get_limiter(model).bucket.rate == pytest.approx(0.5)
+    assert groq_client.model_timeout(model).read == 45
+    assert groq_client.model_role('unknown-model') is None
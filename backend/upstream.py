@@ -0,0 +1,524 @@
+"""
+Upstream scheduler for Groq calls
+Every Groq request goes through call_upstream (or call_upstream_async), which
+per model:
+
+- waits for a token from a requests-per-minute bucket, so bursts are smoothed
+  out instead of tripping provider limits; a 429's retry-after pauses the
+  bucket for every caller, not just the one that hit it
+- retries rate limits, 5xx, timeouts and connection errors with jittered
+  exponential backoff (the SDK's own retries are turned off)
+- optionally hedges: when a call is still running after the model's recent
+  p95 latency, a second identical request is sent and the first answer wins
+- fails fast through a circuit breaker after repeated upstream failures
+  (5xx, timeouts, connection errors, including streams that break off;
+  4xx and 429 replies don't count), letting a single trial request through
+  once the cooldown has passed
+
+Calls that can't be made raise UpstreamUnavailable, which callers handle
+like any other Groq error.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+import httpx
+from groq import APIConnectionError, APIError, APIResponseValidationError, APIStatusError, APITimeoutError
+from groq_client import GROQ_MAX_CONNECTIONS, GROQ_MAX_RETRIES, model_role
+from metrics import (
+    observe_rate_limit_wait, record_upstream_hedge, record_upstream_rejection, record_upstream_retry,
+    set_circuit_state
+)
+from structured_log import get_logger
+
+# Load environment variables
+load_dotenv()
+
+log = get_logger('upstream')
+
+# Requests per minute sent to each role's model (0 = no client-side limit); set
+# them to the account's Groq limits. A model shared by two roles gets one bucket,
+# limited by its first role (see groq_client.model_role)
+DEFAULT_RPM = int(os.getenv('GROQ_DEFAULT_RPM', 0))
+ROLE_RPM = {
+    'vision': int(os.getenv('GROQ_VISION_RPM', DEFAULT_RPM)),
+    'vision_fast': int(os.getenv('GROQ_VISION_FAST_RPM', DEFAULT_RPM)),
+    'script': int(os.getenv('GROQ_SCRIPT_RPM', DEFAULT_RPM)),
+    'tts': int(os.getenv('GROQ_TTS_RPM', DEFAULT_RPM)),
+    'transcription': int(os.getenv('GROQ_TRANSCRIPTION_RPM', DEFAULT_RPM)),
+}
+# Bucket size in seconds of traffic, i.e. how large a burst goes out at once
+UPSTREAM_BURST_SECONDS = float(os.getenv('UPSTREAM_BURST_SECONDS', 10))
+# Longer waits for a token (or a retry-after) fail fast instead of queueing
+UPSTREAM_MAX_QUEUE_WAIT = float(os.getenv('UPSTREAM_MAX_QUEUE_WAIT', 10))
+
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', GROQ_MAX_RETRIES))
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', 0.5))
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', 8))
+
+UPSTREAM_HEDGE_ENABLED = os.getenv('UPSTREAM_HEDGE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+UPSTREAM_HEDGE_QUANTILE = float(os.getenv('UPSTREAM_HEDGE_QUANTILE', 0.95))
+# Successful calls needed before a model's latency quantile is trusted
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv('UPSTREAM_HEDGE_MIN_SAMPLES', 20))
+# Threads that run hedged sync calls. Both the primary and the hedge run here
+# (the caller has to be free to take whichever answers first), so this caps
+# concurrent hedged calls; it matches the connection limit so it never binds first
+UPSTREAM_HEDGE_WORKERS = int(os.getenv('UPSTREAM_HEDGE_WORKERS', GROQ_MAX_CONNECTIONS))
+
+# Consecutive upstream failures that open a model's circuit (0 = never)
+UPSTREAM_BREAKER_FAILURES = int(os.getenv('UPSTREAM_BREAKER_FAILURES', 5))
+UPSTREAM_BREAKER_COOLDOWN = float(os.getenv('UPSTREAM_BREAKER_COOLDOWN', 30))
+
+LATENCY_WINDOW = 200
+
+class UpstreamUnavailable(Exception):
+    """A Groq call was not sent; retry_after is a hint in seconds"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(UpstreamUnavailable):
+    """The model's circuit breaker is open"""
+
+class RateLimitedError(UpstreamUnavailable):
+    """The model's rate limit would make the caller wait too long"""
+
+def retry_reason(error):
+    """Why an error is worth retrying ('rate_limit', 'server', 'timeout', 'connection'), or None"""
+    # httpx errors reach us unwrapped when a streamed body breaks off
+    if isinstance(error, (APITimeoutError, httpx.TimeoutException)):
+        return 'timeout'
+    if isinstance(error, (APIConnectionError, httpx.TransportError)):
+        return 'connection'
+    if isinstance(error, APIStatusError):
+        if error.status_code == 429:
+            return 'rate_limit'
+        if error.status_code >= 500 or error.status_code == 408:
+            return 'server'
+        return None
+    if isinstance(error, APIError) and not isinstance(error, APIResponseValidationError):
+        # An error event in the middle of a streamed reply
+        return 'server'
+    return None
+
+def is_upstream_failure(error):
+    """Whether an error says the model is failing (5xx, timeout, connection) and should count against its breaker"""
+    return retry_reason(error) in ('server', 'timeout', 'connection')
+
+def retry_after_seconds(error):
+    """Seconds from a retry-after-ms / retry-after header, or None"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:  # HTTP-date form
+        pass
+    return None
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for retry number `attempt` (0-based)"""
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+class TokenBucket:
+    """Requests-per-minute limit for one model
+
+    reserve() never blocks: it takes a token (possibly going into debt) and
+    returns how long the caller must wait before sending, so the same bucket
+    serves threads and the event loop.
+    """
+
+    def __init__(self, requests_per_minute, burst_seconds=UPSTREAM_BURST_SECONDS):
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token; returns the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            delay = max(0.0, self._paused_until - now)
+            if self.rate:
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self.rate)
+            return delay
+
+    def try_reserve(self):
+        """Take a token only if one is available right now"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return False
+            if not self.rate:
+                return True
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def refund(self):
+        """Give back a reserved token that was never used"""
+        with self._lock:
+            if self.rate:
+                self._tokens = min(self.capacity, self._tokens + 1)
+
+    def pause(self, seconds):
+        """Hold every caller back for `seconds` (after a 429)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests_per_minute': self.rate * 60,
+                'tokens': round(self._tokens, 2) if self.rate else None,
+                'paused_for': round(max(0.0, self._paused_until - time.monotonic()), 2),
+            }
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures; after `cooldown` one trial call decides"""
+
+    def __init__(self, model, threshold=UPSTREAM_BREAKER_FAILURES, cooldown=UPSTREAM_BREAKER_COOLDOWN):
+        self.model = model
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            log.warning("Circuit state changed", model=self.model, state=state, previous=self.state)
+            self.state = state
+            set_circuit_state(self.model, state)
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may be sent now"""
+        with self._lock:
+            if self.state == 'open':
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(f"Circuit open for {self.model}", retry_after=remaining)
+                self._set_state('half_open')
+            if self.state == 'half_open':
+                if self._trial_running:
+                    raise CircuitOpenError(f"Circuit half-open for {self.model}, trial call running", retry_after=1)
+                self._trial_running = True
+
+    def record(self, ok):
+        """Record the outcome of an allowed call (ok = the upstream answered)"""
+        with self._lock:
+            self._trial_running = False
+            if ok:
+                self._failures = 0
+                self._set_state('closed')
+                return
+            self._failures += 1
+            if self.state == 'half_open' or (self.threshold and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._set_state('open')
+
+    def release(self):
+        """Free the trial slot of a call that ended without an answer (cancelled or never sent)"""
+        with self._lock:
+            self._trial_running = False
+
+    def is_open(self):
+        with self._lock:
+            return self.state == 'open'
+
+class LatencyWindow:
+    """Recent successful call latencies of one model, kept sorted for quantiles"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._recent = deque(maxlen=size)
+        self._sorted = []
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            if len(self._recent) == self._recent.maxlen:
+                oldest = self._recent[0]
+                del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+            self._recent.append(seconds)
+            bisect.insort(self._sorted, seconds)
+
+    def quantile(self, fraction, min_samples=UPSTREAM_HEDGE_MIN_SAMPLES):
+        """Latency at `fraction`, or None with fewer than min_samples calls"""
+        with self._lock:
+            if len(self._sorted) < max(1, min_samples):
+                return None
+            return self._sorted[min(len(self._sorted) - 1, int(fraction * len(self._sorted)))]
+
+class ModelLimiter:
+    """Rate limit, circuit breaker and latency window of one model"""
+
+    def __init__(self, model):
+        self.model = model
+        self.bucket = TokenBucket(ROLE_RPM.get(model_role(model), DEFAULT_RPM))
+        self.breaker = CircuitBreaker(model)
+        self.latency = LatencyWindow()
+
+    def admit(self):
+        """Check the breaker and reserve a token; returns the seconds to wait before sending"""
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            record_upstream_rejection(self.model, 'circuit_open')
+            raise
+        delay = self.bucket.reserve()
+        if delay > UPSTREAM_MAX_QUEUE_WAIT:
+            self.bucket.refund()
+            self.breaker.release()
+            record_upstream_rejection(self.model, 'rate_limited')
+            raise RateLimitedError(f"Rate limit for {self.model} needs a {delay:.1f}s wait", retry_after=delay)
+        observe_rate_limit_wait(self.model, delay)
+        return delay
+
+    def failed(self, error, attempt):
+        """Record a failed call; returns the delay before retrying, or None to give up"""
+        reason = retry_reason(error)
+        if is_upstream_failure(error):
+            self.breaker.record(ok=False)
+        elif isinstance(error, APIStatusError):
+            # A 429 or another 4xx still means the model is reachable
+            self.breaker.record(ok=True)
+        else:
+            # Not an answer from the model (e.g. a bug on our side): no verdict either way
+            self.breaker.release()
+        if reason is None:
+            return None
+
+        retry_after = retry_after_seconds(error)
+        if reason == 'rate_limit':
+            self.bucket.pause(retry_after if retry_after is not None else backoff_delay(attempt))
+        if attempt >= UPSTREAM_MAX_RETRIES or self.breaker.is_open():
+            return None
+        if retry_after is not None and retry_after > UPSTREAM_MAX_QUEUE_WAIT:
+            return None
+
+        record_upstream_retry(self.model, reason)
+        log.info("Retrying Groq call", model=self.model, reason=reason, attempt=attempt + 1, retry_after=retry_after)
+        # The bucket already holds everyone back for a rate limit; jitter spreads the wave
+        return random.uniform(0, UPSTREAM_BACKOFF_BASE) if reason == 'rate_limit' else backoff_delay(attempt)
+
+    def succeeded(self, seconds, record_latency=True):
+        self.breaker.record(ok=True)
+        if record_latency:
+            self.latency.add(seconds)
+
+    def hedge_delay(self):
+        """Seconds after which to hedge a call, or None if hedging is off or untrained"""
+        if not UPSTREAM_HEDGE_ENABLED:
+            return None
+        return self.latency.quantile(UPSTREAM_HEDGE_QUANTILE)
+
+    def stats(self):
+        return {
+            'rate_limit': self.bucket.stats(),
+            'circuit': self.breaker.state,
+            'hedge_after': self.latency.quantile(UPSTREAM_HEDGE_QUANTILE),
+        }
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=UPSTREAM_HEDGE_WORKERS, thread_name_prefix='upstream-hedge')
+
+def get_limiter(model):
+    """Return the process-wide limiter for a model"""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(model, ModelLimiter(model))
+    return limiter
+
+def _hedgeable(kwargs, hedge):
+    # Streams can't be raced: their output is consumed as it arrives
+    return hedge if hedge is not None else not kwargs.get('stream')
+
+def _call_hedged(limiter, fn, args, kwargs):
+    hedge_after = limiter.hedge_delay()
+    if hedge_after is None:
+        return fn(*args, **kwargs)
+
+    primary = _hedge_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    done, _ = wait([primary], timeout=hedge_after)
+    # Hedge only with a spare token: it must not make rate limiting worse
+    if done or not limiter.bucket.try_reserve():
+        return primary.result()
+
+    record_upstream_hedge(limiter.model, 'launched')
+    hedged = _hedge_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+    pending = {primary, hedged}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is hedged:
+                    record_upstream_hedge(limiter.model, 'won')
+                # The slower request can't be cancelled mid-flight; its result is dropped
+                return future.result()
+    # Both failed: report the primary's error
+    return primary.result()
+
+def call_upstream(model, fn, /, *args, hedge=None, **kwargs):
+    """Call fn(*args, **kwargs), a Groq SDK method for `model`, under the scheduler"""
+    limiter = get_limiter(model)
+    hedge = _hedgeable(kwargs, hedge)
+    attempt = 0
+    while True:
+        delay = limiter.admit()
+        if delay:
+            time.sleep(delay)
+
+        started = time.perf_counter()
+        try:
+            result = _call_hedged(limiter, fn, args, kwargs) if hedge else fn(*args, **kwargs)
+        except Exception as e:
+            retry_delay = limiter.failed(e, attempt)
+            if retry_delay is None:
+                raise
+            attempt += 1
+            time.sleep(retry_delay)
+            continue
+        except BaseException:
+            limiter.breaker.release()
+            raise
+
+        limiter.succeeded(time.perf_counter() - started, record_latency=hedge)
+        return result
+
+async def _call_hedged_async(limiter, fn, args, kwargs):
+    hedge_after = limiter.hedge_delay()
+    if hedge_after is None:
+        return await fn(*args, **kwargs)
+
+    primary = asyncio.ensure_future(fn(*args, **kwargs))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if done or not limiter.bucket.try_reserve():
+            return await primary
+
+        record_upstream_hedge(limiter.model, 'launched')
+        hedged = asyncio.ensure_future(fn(*args, **kwargs))
+        tasks.append(hedged)
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedged:
+                        record_upstream_hedge(limiter.model, 'won')
+                    return task.result()
+        return primary.result()
+    finally:
+        # Unlike threads, the losing request can be cancelled
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def call_upstream_async(model, fn, /, *args, hedge=None, **kwargs):
+    """Async version of call_upstream for AsyncGroq methods"""
+    limiter = get_limiter(model)
+    hedge = _hedgeable(kwargs, hedge)
+    attempt = 0
+    while True:
+        delay = limiter.admit()
+        if delay:
+            await asyncio.sleep(delay)
+
+        started = time.perf_counter()
+        try:
+            result = await (_call_hedged_async(limiter, fn, args, kwargs) if hedge else fn(*args, **kwargs))
+        except Exception as e:
+            retry_delay = limiter.failed(e, attempt)
+            if retry_delay is None:
+                raise
+            attempt += 1
+            await asyncio.sleep(retry_delay)
+            continue
+        except BaseException:
+            # Cancelled, e.g. the client went away
+            limiter.breaker.release()
+            raise
+
+        limiter.succeeded(time.perf_counter() - started, record_latency=hedge)
+        return result
+
+@contextmanager
+def upstream_stream_errors(model):
+    """Count upstream failures raised while reading a call_upstream stream against the model's breaker
+
+    call_upstream only sees the request that opens the stream; a body that
+    breaks off later is reported here. Wraps sync and async iteration alike.
+    """
+    try:
+        yield
+    except Exception as e:
+        if is_upstream_failure(e):
+            get_limiter(model).breaker.record(ok=False)
+        raise
+
+@contextmanager
+def upstream_guard(model):
+    """Rate limit and circuit breaker (no retries) around a streamed call whose output is used as it arrives"""
+    limiter = get_limiter(model)
+    delay = limiter.admit()
+    if delay:
+        time.sleep(delay)
+    failed = False
+    try:
+        yield
+    except Exception as e:
+        failed = True
+        limiter.failed(e, UPSTREAM_MAX_RETRIES)
+        raise
+    finally:
+        if not failed:
+            limiter.succeeded(0, record_latency=False)
+
+@asynccontextmanager
+async def upstream_guard_async(model):
+    """Async version of upstream_guard"""
+    limiter = get_limiter(model)
+    delay = limiter.admit()
+    if delay:
+        await asyncio.sleep(delay)
+    failed = False
+    try:
+        yield
+    except Exception as e:
+        failed = True
+        limiter.failed(e, UPSTREAM_MAX_RETRIES)
+        raise
+    finally:
+        if not failed:
+            limiter.succeeded(0, record_latency=False)
+
+def upstream_stats():
+    """Rate limit, circuit and hedging state per model"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {model: limiter.stats() for model, limiter in limiters.items()}
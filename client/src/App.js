@@ -66,23 +66,34 @@ function App() {
     return null;
   };
 
+  // Fetch synthesized speech from the backend and play it in the browser
+  const playGeneratedAudio = async (text) => {
+    const response = await fetch('http://localhost:5000/generate-audio?stream=1', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ text, format: 'mp3' }),
+    });
+    
+    if (!response.ok) {
+      throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    
+    const audioUrl = URL.createObjectURL(await response.blob());
+    const audio = new Audio(audioUrl);
+    audio.onended = () => URL.revokeObjectURL(audioUrl);
+    await audio.play();
+  };
+
   // Announce text for screen readers and voice feedback
   const announceText = async (text) => {
     setCurrentAnnouncement(text);
     
     if (voiceEnabled) {
       try {
-        const response = await fetch('http://localhost:5000/generate-audio', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({ text }),
-        });
-        
-        if (response.ok) {
-          console.log('🔊 Announcement played:', text);
-        }
+        await playGeneratedAudio(text);
+        console.log('🔊 Announcement played:', text);
       } catch (error) {
         console.error('Error playing announcement:', error);
         // Fallback to browser speech synthesis
@@ -504,30 +515,9 @@ function App() {
     try {
       console.log('🎤 Generating audio for:', text);
       
-      // Call a new backend endpoint that generates audio from text
-      const response = await fetch('http://localhost:5000/generate-audio', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          text: text
-        }),
-      });
-      
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-      
-      const result = await response.json();
-      
-      if (result.audio_file) {
-        console.log('🔊 Audio generated:', result.audio_file);
-        // The backend will handle playing the audio
-        console.log('✅ Audio playback completed by backend');
-      } else {
-        console.log('❌ No audio file generated');
-      }
+      // The backend returns the synthesized audio, which we play here
+      await playGeneratedAudio(text);
+      console.log('✅ Audio playback started');
       
     } catch (error) {
       console.error('Error generating audio:', error);
@@ -553,7 +543,7 @@ function App() {
         const response = await fetch('http://localhost:5000/analyses/recent?limit=20');
         if (response.ok) {
           const data = await response.json();
-          setScanHistory(data);
+          setScanHistory(data.map(item => ({ ...item, analysisId: item.id })));
         }
       } catch (error) {
         console.error('Error loading scan history:', error);
@@ -678,7 +668,8 @@ function App() {
       
       // Add to history (the backend now saves to database automatically)
       const newHistoryItem = {
-        id: transformedResult.id || Date.now(),
+        id: result.id || Date.now(),
+        analysisId: result.id || null,
         ...transformedResult,
         image: previewUrl,
         timestamp: "Just now"
@@ -765,24 +756,32 @@ function App() {
       const selectedItemsData = scanHistory.filter((item) => selectedItems.includes(item.id));
       console.log('Selected items:', selectedItemsData);
       
-      // Convert the image URLs to blobs
-      const image1 = await fetch(selectedItemsData[0].image)
-          .then(response => response.blob())
-          .then(blob => new File([blob], 'image1.jpg', { type: 'image/jpeg' }));
-      const image2 = await fetch(selectedItemsData[1].image)
-          .then(response => response.blob())
-          .then(blob => new File([blob], 'image2.jpg', { type: 'image/jpeg' }));
-      
-      // Create a FormData object to send the images
-      const formData = new FormData();
-      formData.append('image1', image1);
-      formData.append('image2', image2);
-      
-      // Send the images to the backend
-      fetch('http://localhost:5000/compare-fruits', {
+      let request;
+      if (selectedItemsData.every(item => item.analysisId)) {
+        // Saved scans: the backend reuses the stored images
+        request = {
           method: 'POST',
-          body: formData,
-      })
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ analysis_ids: selectedItemsData.map(item => item.analysisId) }),
+        };
+      } else {
+        // Convert the image URLs to blobs
+        const image1 = await fetch(selectedItemsData[0].image)
+            .then(response => response.blob())
+            .then(blob => new File([blob], 'image1.jpg', { type: 'image/jpeg' }));
+        const image2 = await fetch(selectedItemsData[1].image)
+            .then(response => response.blob())
+            .then(blob => new File([blob], 'image2.jpg', { type: 'image/jpeg' }));
+        
+        // Create a FormData object to send the images
+        const formData = new FormData();
+        formData.append('image1', image1);
+        formData.append('image2', image2);
+        request = { method: 'POST', body: formData };
+      }
+      
+      // Send the comparison to the backend
+      fetch('http://localhost:5000/compare-fruits', request)
       .then(response => response.json())
       .then(data => {
         console.log(data)
@@ -1162,7 +1161,7 @@ function App() {
                     onChange={() => handleSelect(item.id)}
                     aria-label={`Select ${item.name} for recipe generation`}
                   />
-                  <img src={item.image} alt={`${item.name} scan`} className="history-image" />
+                  <img src={item.thumbnail || item.image} alt={`${item.name} scan`} className="history-image" loading="lazy" />
                   <div className="history-content">
                     <h4>{item.name}</h4>
                     <div className="history-details">